@@ -0,0 +1,267 @@
+"""Admission control in front of the chat and code-analysis endpoints.
+
+Every request is keyed by its session (or client address before a session
+exists) and passes two gates before the view runs:
+
+* token buckets, one per key plus an optional global one, charged by request
+  size so a pasted 5000-line file costs more than "thanks!". An empty bucket
+  is rejected at once with 429 and the exact Retry-After.
+* concurrency caps per key and per worker. A request over a cap waits in a
+  bounded FIFO queue until a slot frees up or its deadline passes; a full
+  queue or a missed deadline is rejected with 503 (429 when one session
+  already has a full share of the queue).
+
+Limits apply per worker process.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """The request was not admitted; answer with status and Retry-After"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost):
+        """Take cost tokens; returns 0, or the seconds until they would be available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        cost = min(cost, self.burst)  # Oversized requests drain a full bucket instead of never fitting
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+    def refund(self, cost):
+        self.tokens = min(self.burst, self.tokens + min(cost, self.burst))
+
+
+class RateLimiter:
+    """Token bucket per key, plus an optional global bucket (rates in requests per minute)"""
+
+    def __init__(self, rate, burst, global_rate=0, global_burst=0, max_keys=10000):
+        self.rate = rate / 60
+        self.burst = burst
+        self.global_bucket = TokenBucket(global_rate / 60, global_burst or global_rate) if global_rate else None
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key, cost):
+        if not self.rate:
+            return
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(key)
+            wait = bucket.take(cost)
+            if wait:
+                raise Rejected(429, "rate_limited", wait)
+            if self.global_bucket is not None:
+                wait = self.global_bucket.take(cost)
+                if wait:
+                    bucket.refund(cost)
+                    raise Rejected(429, "global_rate_limited", wait)
+
+
+class ThreadWaiter:
+    def __init__(self, key):
+        self.key = key
+        self.event = threading.Event()
+
+    def grant(self):
+        self.event.set()
+
+
+class AsyncWaiter:
+    def __init__(self, key, loop):
+        self.key = key
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def grant(self):
+        self.loop.call_soon_threadsafe(self._set)
+
+    def _set(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ConcurrencyLimiter:
+    """Caps on requests running per key and per worker, with a bounded FIFO wait queue"""
+
+    def __init__(self, limit, key_limit, max_queue, on_change=None):
+        self.limit = limit
+        self.key_limit = key_limit
+        self.max_queue = max_queue
+        self.on_change = on_change
+        self.active = 0
+        self._per_key = {}
+        self._queue = deque()
+        self._lock = threading.Lock()
+
+    def _can_run(self, key):
+        return ((not self.limit or self.active < self.limit)
+                and (not self.key_limit or self._per_key.get(key, 0) < self.key_limit))
+
+    def _start(self, key):
+        self.active += 1
+        self._per_key[key] = self._per_key.get(key, 0) + 1
+
+    def enter(self, key, make_waiter, retry_after):
+        """Start now (returns None) or queue a waiter to be granted later"""
+        with self._lock:
+            if self._can_run(key):
+                self._start(key)
+                waiter = None
+            elif len(self._queue) >= self.max_queue:
+                raise Rejected(503, "queue_full", retry_after)
+            elif self.key_limit and sum(1 for w in self._queue if w.key == key) >= self.key_limit:
+                raise Rejected(429, "session_busy", retry_after)
+            else:
+                waiter = make_waiter(key)
+                self._queue.append(waiter)
+        self._changed()
+        return waiter
+
+    def abandon(self, waiter):
+        """Drop a waiter whose deadline passed; False if it was granted in the meantime"""
+        with self._lock:
+            try:
+                self._queue.remove(waiter)
+            except ValueError:
+                return False
+        self._changed()
+        return True
+
+    def release(self, key):
+        granted = []
+        with self._lock:
+            self.active -= 1
+            if self._per_key.get(key, 0) <= 1:
+                self._per_key.pop(key, None)
+            else:
+                self._per_key[key] -= 1
+            for waiter in list(self._queue):
+                if self._can_run(waiter.key):
+                    self._queue.remove(waiter)
+                    self._start(waiter.key)
+                    granted.append(waiter)
+        for waiter in granted:
+            waiter.grant()
+        self._changed()
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.active, len(self._queue))
+
+
+class Ticket:
+    """An admitted request's slot, released exactly once"""
+
+    def __init__(self, limiter, key):
+        self.limiter = limiter
+        self.key = key
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.limiter.release(self.key)
+
+
+class AdmissionController:
+    def __init__(self, rate_limiter, concurrency, queue_timeout=10, retry_after=5, cost_unit=1000):
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.cost_unit = cost_unit
+        self.admitted = 0
+        self.rejected = {}
+        self._lock = threading.Lock()
+
+    def cost(self, body_size):
+        """Bucket tokens for a request body: 1, plus 1 per cost_unit estimated prompt tokens"""
+        if not self.cost_unit:
+            return 1
+        return 1 + (body_size / 4) / self.cost_unit
+
+    def _reject(self, error):
+        with self._lock:
+            self.rejected[error.reason] = self.rejected.get(error.reason, 0) + 1
+        logger.warning(f"Request not admitted: {error.reason} (retry after {error.retry_after}s)")
+        return error
+
+    def _admitted(self, key):
+        with self._lock:
+            self.admitted += 1
+        return Ticket(self.concurrency, key)
+
+    def admit(self, key, body_size=0):
+        """Block until the request may run; returns a Ticket or raises Rejected"""
+        try:
+            self.rate_limiter.check(key, self.cost(body_size))
+            waiter = self.concurrency.enter(key, ThreadWaiter, self.retry_after)
+        except Rejected as e:
+            raise self._reject(e)
+        if waiter is not None and not waiter.event.wait(self.queue_timeout) and self.concurrency.abandon(waiter):
+            raise self._reject(Rejected(503, "queue_timeout", self.retry_after))
+        return self._admitted(key)
+
+    async def async_admit(self, key, body_size=0):
+        """Async counterpart of admit for handlers on an event loop"""
+        loop = asyncio.get_running_loop()
+        try:
+            self.rate_limiter.check(key, self.cost(body_size))
+            waiter = self.concurrency.enter(key, lambda k: AsyncWaiter(k, loop), self.retry_after)
+        except Rejected as e:
+            raise self._reject(e)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if self.concurrency.abandon(waiter):
+                    raise self._reject(Rejected(503, "queue_timeout", self.retry_after)) from None
+            except asyncio.CancelledError:
+                if not self.concurrency.abandon(waiter):
+                    self.concurrency.release(key)
+                raise
+        return self._admitted(key)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "active": self.concurrency.active,
+                "queued": self.concurrency.queued,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+            }
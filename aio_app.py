@@ -0,0 +1,767 @@
+"""Async serving mode for Enhanced VibeCoding.
+
+Run with gunicorn's aiohttp worker (gunicorn.conf.py also preloads and warms
+up the app):
+
+    SERVING_MODE=aio gunicorn
+    gunicorn aio_app:app --worker-class aiohttp.GunicornWebWorker
+
+The long-waiting endpoints (/chat, /chat/stream, /health) are served natively on
+the event loop, with every OpenRouter call going through one shared
+aiohttp.ClientSession per worker process. While a generation is in flight the
+worker only holds a socket, so one process can keep hundreds of requests waiting
+on the upstream. Their blocking steps (session, conversation and usage SQLite
+calls, classification, rendering) run on a small pool of blocking threads, so
+they never stall the loop. All other routes are handed to the Flask app on a thread pool of
+their own, so they behave exactly as under the sync worker: each request keeps
+one thread from its view to the end of its (possibly streamed) response, and
+its body is read from the connection as Flask consumes it, so an archive upload
+is streamed to disk rather than buffered (and capped at client_max_size) by
+aiohttp.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+from flask.ctx import RequestContext
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import app as flask_module
+from model_router import AsyncModelRouter
+from admission import Rejected
+from generations import GenerationCancelled, GenerationError, GenerationExists
+from singleflight import FlightTimeout
+from upstream import AsyncUpstreamClient, CircuitOpenError, UpstreamStreamError, error_code, parse_stream_line
+from uploads import UploadError
+from usage import continuation_payload
+from app import (
+    CANCELLED_STATUS,
+    MODELS,
+    OPENROUTER_API_URL,
+    REPLY_CONTINUATIONS,
+    UPLOAD_FORM_OVERHEAD,
+    UPSTREAM_ERRORS,
+    account_usage,
+    admission_key,
+    admission_rejection,
+    append_to_conversation,
+    build_assistant_message,
+    cached_reply_stream,
+    chat_message,
+    chat_response_body,
+    circuit_open_response,
+    conversation_id,
+    conversation_store,
+    finalize_reply,
+    finish_chat_reply,
+    finish_flight,
+    join_flight,
+    leading_flight,
+    lookup_cached_reply,
+    note_coalesced_reply,
+    note_upstream_response,
+    prepare_chat_request,
+    read_completion_reply,
+    record_coalesced_reply,
+    record_stage,
+    settle_cancelled,
+    sse_event,
+    start_generation,
+    store_cached_reply,
+    stream_error_event,
+    timed_stage,
+    upstream_status_error,
+)
+
+logger = logging.getLogger(__name__)
+
+flask_app = flask_module.app
+
+UPSTREAM_CLIENT = web.AppKey("upstream_client", AsyncUpstreamClient)
+MODEL_ROUTER = web.AppKey("model_router", AsyncModelRouter)
+PRECONNECT = web.AppKey("preconnect", asyncio.Task)
+FLASK_EXECUTOR = web.AppKey("flask_executor", ThreadPoolExecutor)
+BLOCKING_EXECUTOR = web.AppKey("blocking_executor", ThreadPoolExecutor)
+
+# Connections kept open to OpenRouter per worker process
+UPSTREAM_CONNECTION_LIMIT = 200
+
+# Largest body read for a request; /uploads reads up to the archive limit instead
+CLIENT_MAX_SIZE = flask_app.config.get('MAX_CONTENT_LENGTH') or 16 * 1024 * 1024
+# Bytes read from the connection at a time for a Flask route
+BODY_CHUNK_SIZE = 64 * 1024
+# Flask requests served at once per worker process, streamed responses included; the rest wait for a thread
+FLASK_THREADS = int(os.getenv("AIO_FLASK_THREADS", "64"))
+# Chunks of a streamed Flask response produced ahead of what the client has taken
+FLASK_STREAM_AHEAD = 8
+# Threads for the blocking steps (SQLite, classification, rendering) of /chat and /chat/stream per worker process
+BLOCKING_THREADS = int(os.getenv("AIO_BLOCKING_THREADS", "8"))
+
+# Headers set by Flask that aiohttp must compute itself
+HOP_BY_HOP_HEADERS = {'content-length', 'transfer-encoding', 'connection'}
+
+
+class BodyReader:
+    """wsgi.input for a Flask thread, reading an aiohttp request body off the event loop as it is consumed"""
+
+    def __init__(self, content, loop, limit):
+        self.content = content
+        self.loop = loop
+        self.limit = limit
+        self.received = 0
+
+    def _await(self, coro):
+        data = asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+        self.received += len(data)
+        if self.received > self.limit:
+            raise RequestEntityTooLarge()
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(BODY_CHUNK_SIZE), b''))
+        return self._await(self.content.read(size))
+
+    def readline(self, size=-1):
+        return self._await(self.content.readline())
+
+
+def wsgi_environ(request, body=b''):
+    builder = EnvironBuilder(
+        path=request.path,
+        method=request.method,
+        query_string=request.query_string,
+        headers=list(request.headers.items()),
+        data=body,
+        base_url=f"{request.scheme}://{request.host}",
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    environ['REMOTE_ADDR'] = request.remote or ''
+    return environ
+
+
+async def build_environ(request):
+    """Build a WSGI environ for an aiohttp request so Flask can handle it"""
+    return wsgi_environ(request, await request.read())
+
+
+def body_limit(request):
+    """Largest body a Flask route reads: the archive limit for /uploads, client_max_size for the rest"""
+    if request.path == "/uploads":
+        return flask_module.upload_store.max_bytes + UPLOAD_FORM_OVERHEAD
+    return CLIENT_MAX_SIZE
+
+
+def streaming_environ(request):
+    """Build a WSGI environ whose body is read from the connection as Flask reads wsgi.input"""
+    environ = wsgi_environ(request)
+    environ['wsgi.input'] = BodyReader(request.content, asyncio.get_running_loop(), body_limit(request))
+    # Without a body EnvironBuilder sets these for an empty one, and a new multipart boundary
+    environ.pop('CONTENT_LENGTH', None)
+    if 'Content-Type' in request.headers:
+        environ['CONTENT_TYPE'] = request.headers['Content-Type']
+    if request.content_length is not None:
+        environ['CONTENT_LENGTH'] = str(request.content_length)
+    elif request.body_exists:
+        environ['wsgi.input_terminated'] = True  # Chunked: BodyReader stops at the end and at the limit
+    return environ
+
+
+def open_flask_context(environ):
+    """Run Flask's before_request hooks for environ and return (session, early_response)"""
+    with flask_app.request_context(environ) as ctx:
+        early = flask_app.preprocess_request()
+        if early is not None:
+            return ctx.session, finalize_flask_response(environ, ctx.session, early)
+        return ctx.session, None
+
+
+def in_request(environ, flask_session, fn, *args):
+    """Call fn in a request context for environ holding the session opened for it (not loaded again)"""
+    with RequestContext(flask_app, environ, session=flask_session):
+        return fn(*args)
+
+
+def finalize_flask_response(environ, flask_session, rv):
+    """Turn a view return value into a Flask response, running after_request hooks and saving the session"""
+    with RequestContext(flask_app, environ, session=flask_session):
+        response = flask_app.make_response(rv)
+        return flask_app.process_response(response)
+
+
+def to_aiohttp_response(response):
+    """Convert a buffered Flask response into an aiohttp response"""
+    headers = [(k, v) for k, v in response.headers.to_wsgi_list() if k.lower() not in HOP_BY_HOP_HEADERS]
+    body = response.get_data()
+    response.close()  # Fires call_on_close callbacks, as a WSGI server would
+    return web.Response(body=body, status=response.status_code, headers=headers)
+
+
+def flask_to_aiohttp(environ, flask_session, rv):
+    return to_aiohttp_response(finalize_flask_response(environ, flask_session, rv))
+
+
+async def off_loop(request, fn, *args):
+    """Run fn on the blocking pool in a copy of the current context, so Flask's app context (and `g`) carries over.
+
+    Session, conversation and usage reads and writes are SQLite calls, and
+    classification and rendering are CPU work: each takes milliseconds that,
+    on the event loop, every other request of the worker would wait for.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        request.app[BLOCKING_EXECUTOR], functools.partial(context.run, fn, *args))
+
+
+def client_disconnected(request):
+    """Generation.disconnected for an aiohttp request: True once its connection is closing"""
+    return lambda: request.transport is None or request.transport.is_closing()
+
+
+async def until_cancelled(generation, awaitable):
+    """Await awaitable, raising GenerationCancelled as soon as the generation is cancelled from any thread"""
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(awaitable)
+    generation.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if generation.cancelled and not asyncio.current_task().cancelling():
+            raise GenerationCancelled(generation.reason) from None
+        raise
+
+
+async def continue_upstream(router, chat_request, reply):
+    """Async counterpart of app.continue_upstream"""
+    logger.info(f"Reply stopped at max_tokens ({chat_request['payload']['max_tokens']}), continuing it")
+    try:
+        response = await router.post(chat_request['headers'], continuation_payload(chat_request['payload'], reply))
+    except (CircuitOpenError, asyncio.TimeoutError, aiohttp.ClientError) as e:
+        logger.warning(f"Continuation failed, keeping the truncated reply: {e}")
+        return None
+    if response.status != 200:
+        logger.warning(f"Continuation failed with status {response.status}, keeping the truncated reply")
+        response.close()
+        return None
+    return response
+
+
+async def complete_reply(router, generation, chat_request, reply):
+    """Async counterpart of app.complete_reply"""
+    usage = chat_request['usage']
+    usage.end_call(reply)
+    while usage.wants_continuation(REPLY_CONTINUATIONS):
+        response = await until_cancelled(generation, continue_upstream(router, chat_request, reply))
+        if response is None:
+            break
+        async with response:
+            data = await response.json(content_type=None)
+        part, error_reply = read_completion_reply(data, usage)
+        if error_reply:
+            break
+        reply += part
+        usage.end_call(reply)
+    return reply
+
+
+def shared_app_context(handler):
+    """Run a handler inside one Flask app context, so `g` spans all of its request contexts"""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        with flask_app.app_context():
+            return await handler(request)
+    return wrapper
+
+
+def admission_controlled(handler):
+    """Async counterpart of app.admission_controlled; the slot is held until the handler has responded"""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        admission = flask_module.admission
+        if admission is None:
+            return await handler(request)
+        key = admission_key(request.cookies.get(flask_app.session_interface.get_cookie_name(flask_app)), request.remote)
+        try:
+            ticket = await admission.async_admit(key, request.content_length or 0)
+        except Rejected as e:
+            body, status, headers = admission_rejection(e, request.path)
+            return web.json_response(body, status=status, headers=headers)
+        try:
+            return await handler(request)
+        finally:
+            ticket.release()
+    return wrapper
+
+
+async def health(request):
+    return web.json_response({
+        "status": "healthy",
+        "message": "Enhanced VibeCoding is running!",
+        "upstream": request.app[UPSTREAM_CLIENT].snapshot(),
+        "models": request.app[MODEL_ROUTER].snapshot(),
+        "coalescing": flask_module.flight_group.snapshot() if flask_module.flight_group else None,
+        "admission": flask_module.admission.snapshot() if flask_module.admission else None,
+        "generations": flask_module.generation_registry.snapshot()
+    }, status=200)
+
+
+def start_chat(request, stream):
+    """The blocking start of a native chat request, run in its request context on the blocking pool.
+
+    Returns (chat_request, generation, rv): rv is a complete answer (no API
+    key, cache hit), and generation is None for a request coalesced onto an
+    identical one in flight.
+    """
+    user_input = chat_message()
+    logger.info(f"Received async {'streaming ' if stream else ''}chat request: {user_input[:100]}...")
+
+    if not flask_module.OPENROUTER_API_KEY:
+        logger.error("OPENROUTER_API_KEY not found in environment variables")
+        return None, None, ({"reply": "⚠️ API key not configured. Please contact the administrator."}, 500)
+
+    chat_request = prepare_chat_request(user_input)
+    if stream:
+        chat_request['payload']['stream'] = True
+
+    cached_reply = lookup_cached_reply(chat_request)
+    if cached_reply is not None:
+        append_to_conversation(build_assistant_message(cached_reply, chat_request['request_type']))
+        if not stream:
+            return chat_request, None, chat_response_body(cached_reply, chat_request)
+        return chat_request, None, flask_app.response_class(
+            ''.join(cached_reply_stream(cached_reply, chat_request)),
+            mimetype='text/event-stream',
+            headers={"Cache-Control": "no-cache"}
+        )
+
+    if join_flight(chat_request):
+        return chat_request, None, None
+    return chat_request, start_generation(chat_request, client_disconnected(request)), None
+
+
+def finish_stream_reply(chat_request, reply, sid, model):
+    """Post-process, record, account for and cache a streamed reply; returns the body of its done event"""
+    request_type = chat_request['request_type']
+    reply = finalize_reply(reply, request_type, chat_request['intents'])
+    with timed_stage('session_save', chat_request['timings']):
+        conversation_store.append_message(
+            sid, build_assistant_message(reply, request_type, model, chat_request['usage']))
+    account_usage(chat_request, sid, model)
+    store_cached_reply(chat_request, reply)
+    logger.info(f"Successfully streamed AI response for {request_type} (approx {len(reply)} chars)")
+    body = chat_response_body(reply, chat_request)
+    finish_flight(chat_request, 200, body, model)
+    return body
+
+
+def record_coalesced_stream_reply(chat_request, sid, reply, model):
+    with timed_stage('session_save', chat_request['timings']):
+        conversation_store.append_message(sid, build_assistant_message(reply, chat_request['request_type'], model))
+
+
+@admission_controlled
+@shared_app_context
+async def chat(request):
+    """Async counterpart of app.chat sharing its analysis and prompt pipeline; blocking steps run off the loop"""
+    environ = await build_environ(request)
+    flask_session, early = await off_loop(request, open_flask_context, environ)
+    if early is not None:
+        return await off_loop(request, to_aiohttp_response, early)
+
+    def respond(rv):
+        return off_loop(request, flask_to_aiohttp, environ, flask_session, rv)
+
+    def in_this_request(fn, *args):
+        return off_loop(request, in_request, environ, flask_session, fn, *args)
+
+    try:
+        chat_request, generation, rv = await in_this_request(start_chat, request, False)
+        if rv is not None:
+            return await respond(rv)
+
+        if generation is None:
+            await chat_request['flight'].async_wait(flask_module.flight_group.timeout)
+            return await respond(await in_this_request(record_coalesced_reply, chat_request))
+
+        router = request.app[MODEL_ROUTER]
+        upstream_started = time.perf_counter()
+        routed = until_cancelled(generation, router.post(chat_request['headers'], chat_request['payload']))
+        async with await routed as response:
+            record_stage('upstream_ttfb', response.ttfb, chat_request['timings'])
+            logger.info(f"OpenRouter API response status: {response.status} from {response.model}")
+            note_upstream_response(chat_request, response.status, response.model)
+            if response.status != 200:
+                error_reply = upstream_status_error(response.status, await response.text())
+                return await respond(({"reply": error_reply}, 500))
+            data = await response.json(content_type=None)
+            record_stage('upstream_total', time.perf_counter() - upstream_started, chat_request['timings'])
+
+        reply, error_reply = read_completion_reply(data, chat_request['usage'])
+        if error_reply:
+            return await respond(({"reply": error_reply}, 500))
+        reply = await complete_reply(router, generation, chat_request, reply)
+        reply = await in_this_request(finish_chat_reply, reply, chat_request, response.model)
+        await off_loop(request, store_cached_reply, chat_request, reply)
+        chat_request['model'] = response.model
+
+        logger.info(f"Successfully generated AI response for {chat_request['request_type']} (approx {len(reply)} chars)")
+        return await respond(await off_loop(request, chat_response_body, reply, chat_request))
+
+    except UploadError as e:
+        return await respond(({"reply": f"⚠️ {e}"}, 400))
+
+    except GenerationExists as e:
+        return await respond(({"reply": f"⚠️ {e}"}, 409))
+
+    except GenerationError as e:
+        return await respond(({"reply": f"⚠️ {e}"}, 400))
+
+    except GenerationCancelled:
+        return await respond((await off_loop(request, settle_cancelled, chat_request), CANCELLED_STATUS))
+
+    except CircuitOpenError as e:
+        return await respond(circuit_open_response(e))
+
+    except (asyncio.TimeoutError, FlightTimeout):
+        logger.error("Request timed out")
+        return await respond(({"reply": "⚠️ Request timed out. Please try again with a shorter request."}, 500))
+
+    except aiohttp.ClientError as e:
+        logger.error(f"Request error: {e}")
+        return await respond(({"reply": "⚠️ Network error. Please check your connection and try again."}, 500))
+
+    except Exception as e:
+        logger.error(f"Unexpected error in async chat endpoint: {e}")
+        return await respond(({"reply": "⚠️ Something went wrong. Please try again later."}, 500))
+
+
+@admission_controlled
+@shared_app_context
+async def chat_stream(request):
+    """Async counterpart of app.chat_stream relaying upstream deltas as SSE; blocking steps run off the loop"""
+    environ = await build_environ(request)
+    flask_session, early = await off_loop(request, open_flask_context, environ)
+    if early is not None:
+        return await off_loop(request, to_aiohttp_response, early)
+
+    def respond(rv):
+        return off_loop(request, flask_to_aiohttp, environ, flask_session, rv)
+
+    try:
+        chat_request, generation, rv = await off_loop(
+            request, in_request, environ, flask_session, start_chat, request, True)
+        if rv is not None:
+            return await respond(rv)
+
+        if generation is None:
+            flight = chat_request['flight']
+            await flight.async_wait_started(flask_module.flight_group.timeout)
+            if not flight.parts and flight.status not in (None, 200):
+                return await respond((flight.body, flight.status))
+            return await relay_coalesced_stream(request, environ, flask_session, chat_request)
+
+        router = request.app[MODEL_ROUTER]
+        upstream_started = time.perf_counter()
+        response = await until_cancelled(generation, router.post(chat_request['headers'], chat_request['payload']))
+        record_stage('upstream_ttfb', response.ttfb, chat_request['timings'])
+    except UploadError as e:
+        return await respond(({"reply": f"⚠️ {e}"}, 400))
+    except GenerationExists as e:
+        return await respond(({"reply": f"⚠️ {e}"}, 409))
+    except GenerationError as e:
+        return await respond(({"reply": f"⚠️ {e}"}, 400))
+    except GenerationCancelled:
+        return await respond((await off_loop(request, settle_cancelled, chat_request), CANCELLED_STATUS))
+    except CircuitOpenError as e:
+        return await respond(circuit_open_response(e))
+    except UpstreamStreamError as e:
+        logger.error(f"API Error before first delta: {e}")
+        return await respond(({"reply": f"⚠️ API Error: {e}"}, 500))
+    except (asyncio.TimeoutError, FlightTimeout):
+        logger.error("Request timed out")
+        return await respond(({"reply": "⚠️ Request timed out. Please try again with a shorter request."}, 500))
+    except aiohttp.ClientError as e:
+        logger.error(f"Request error: {e}")
+        return await respond(({"reply": "⚠️ Network error. Please check your connection and try again."}, 500))
+    except Exception as e:
+        logger.error(f"Unexpected error in async chat stream endpoint: {e}")
+        return await respond(({"reply": "⚠️ Something went wrong. Please try again later."}, 500))
+
+    async with response:
+        logger.info(f"OpenRouter API stream status: {response.status} from {response.model}")
+        note_upstream_response(chat_request, response.status, response.model)
+        if response.status != 200:
+            error_reply = upstream_status_error(response.status, await response.text())
+            return await respond(({"reply": error_reply}, 500))
+
+        sid = await off_loop(request, in_request, environ, flask_session, conversation_id)
+        headers_source, stream = await open_event_stream(request, environ, flask_session)
+        flight = leading_flight(chat_request)
+        usage = chat_request['usage']
+        parts = []
+        replied = False
+        reading = response  # The response being relayed, a continuation once the reply stopped at max_tokens
+
+        async def relay():
+            nonlocal reading
+            while reading is not None:
+                async with reading:
+                    async for line in reading.iter_lines():
+                        delta = parse_stream_line(line, usage)
+                        if delta is None:
+                            break
+                        if delta:
+                            parts.append(delta)
+                            if flight is not None:
+                                flight.publish(delta)
+                            await stream.write(sse_event('delta', {"content": delta}).encode('utf-8'))
+                reply = ''.join(parts)
+                usage.end_call(reply)
+                reading = (await continue_upstream(router, chat_request, reply)
+                           if usage.wants_continuation(REPLY_CONTINUATIONS) else None)
+
+        try:
+            await until_cancelled(generation, relay())
+            record_stage('upstream_total', time.perf_counter() - upstream_started, chat_request['timings'])
+
+            body = await off_loop(request, finish_stream_reply, chat_request, ''.join(parts), sid, response.model)
+            replied = True
+            await stream.write(sse_event('done', body).encode('utf-8'))
+
+        except GenerationCancelled:
+            if reading is not None:
+                reading.close()
+            body = await off_loop(request, settle_cancelled, chat_request, parts, sid, response.model)
+            if generation.reason == "disconnected":
+                return stream
+            await stream.write(sse_event('cancelled', body).encode('utf-8'))
+
+        except ConnectionResetError:
+            # The client went away: stop generating a reply nobody will read
+            if not replied and generation.cancel("disconnected"):
+                if reading is not None:
+                    reading.close()
+                await off_loop(request, settle_cancelled, chat_request, parts, sid, response.model)
+            return stream
+
+        except UpstreamStreamError as e:
+            logger.error(f"API Error during stream: {e}")
+            UPSTREAM_ERRORS.inc(code="stream_error")
+            await stream.write(stream_error_event(chat_request, f"⚠️ API Error: {e}").encode('utf-8'))
+
+        except (asyncio.TimeoutError, aiohttp.ClientPayloadError) as e:
+            logger.error(f"Stream error: {e}")
+            UPSTREAM_ERRORS.inc(code=error_code(e))
+            await stream.write(stream_error_event(
+                chat_request, "⚠️ Network error. Please check your connection and try again.").encode('utf-8'))
+
+        finally:
+            # Records the request in the chat metrics, settles an interrupted flight and finishes the generation
+            await off_loop(request, headers_source.close)
+
+        await stream.write_eof()
+        return stream
+
+
+async def open_event_stream(request, environ, flask_session):
+    """Start an SSE response carrying the headers (session cookie included) Flask would send"""
+    headers_source = await off_loop(request, finalize_flask_response, environ, flask_session, flask_app.response_class(
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    ))
+    stream = web.StreamResponse(status=200, headers=[
+        (k, v) for k, v in headers_source.headers.to_wsgi_list() if k.lower() not in HOP_BY_HOP_HEADERS
+    ])
+    await stream.prepare(request)
+    return headers_source, stream
+
+
+async def relay_coalesced_stream(request, environ, flask_session, chat_request):
+    """Async counterpart of app.relay_coalesced_stream"""
+    flight = chat_request['flight']
+    sid = await off_loop(request, in_request, environ, flask_session, conversation_id)
+
+    headers_source, stream = await open_event_stream(request, environ, flask_session)
+    streamed = False
+    try:
+        async for delta in flight.async_updates(flask_module.flight_group.timeout):
+            streamed = True
+            await stream.write(sse_event('delta', {"content": delta}).encode('utf-8'))
+
+        note_coalesced_reply(chat_request, flight)
+        if flight.status != 200:
+            chat_request['stream_status'] = "stream_error"
+            await stream.write(sse_event('error', flight.body).encode('utf-8'))
+        else:
+            reply = flight.body['reply']
+            if not streamed:
+                await stream.write(sse_event('delta', {"content": reply}).encode('utf-8'))
+            if chat_request['record_reply']:
+                await off_loop(request, record_coalesced_stream_reply, chat_request, sid, reply, flight.model)
+            await stream.write(sse_event('done', flight.body).encode('utf-8'))
+
+    except FlightTimeout as e:
+        logger.error(f"Coalesced stream timed out: {e}")
+        chat_request['stream_status'] = "stream_error"
+        await stream.write(sse_event(
+            'error', {"reply": "⚠️ Request timed out. Please try again with a shorter request."}).encode('utf-8'))
+
+    finally:
+        await off_loop(request, headers_source.close)
+
+    await stream.write_eof()
+    return stream
+
+
+class FlaskRun:
+    """One Flask request run start to finish on one thread, its response handed to the event loop chunk by chunk.
+
+    stream_with_context pushes the request context on the thread that ran the
+    view and pops it when the body ends, so a streamed body cannot be pulled a
+    next() at a time on whichever pool thread is free. The thread stays at
+    most FLASK_STREAM_AHEAD chunks ahead of the client, and closes the body
+    (GeneratorExit in the view's generator) once the client has gone.
+    """
+
+    def __init__(self, loop, environ):
+        self.loop = loop
+        self.environ = environ
+        self.queue = asyncio.Queue()
+        self.credits = threading.Semaphore(FLASK_STREAM_AHEAD)
+        self.stopped = threading.Event()
+
+    def _deliver(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:  # The loop closed while the worker shut down
+            pass
+
+    def run(self):
+        """On a Flask thread: delivers (status, headers), then each chunk, then None; or an exception"""
+        try:
+            app_iter, status, headers = run_wsgi_app(flask_app, self.environ)
+        except Exception as e:
+            self._deliver(e)
+            return
+        self._deliver((status, headers))
+        try:
+            for chunk in app_iter:
+                if chunk:
+                    self.credits.acquire()
+                    if self.stopped.is_set():
+                        break
+                    self._deliver(chunk)
+        except Exception as e:
+            self._deliver(e)
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                close()
+            self._deliver(None)
+
+    async def next(self):
+        item = await self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def consumed(self):
+        self.credits.release()
+
+    def stop(self):
+        self.stopped.set()
+        self.credits.release()
+
+
+async def flask_fallback(request):
+    """Serve any other route through the Flask WSGI app on the Flask thread pool"""
+    if request.content_length is not None and request.content_length > body_limit(request):
+        return web.json_response({"error": "Request body too large"}, status=413)
+    run = FlaskRun(asyncio.get_running_loop(), streaming_environ(request))
+    request.app[FLASK_EXECUTOR].submit(run.run)
+    try:
+        status, headers = await run.next()
+        response = web.StreamResponse(status=int(status.split(' ', 1)[0]), headers=[
+            (k, v) for k, v in headers.to_wsgi_list() if k.lower() not in HOP_BY_HOP_HEADERS
+        ])
+        await response.prepare(request)
+        while (chunk := await run.next()) is not None:
+            await response.write(chunk)
+            run.consumed()
+    except ConnectionResetError:
+        return response  # The client went away; stopping closes the body, as a WSGI server would
+    finally:
+        run.stop()
+    await response.write_eof()
+    return response
+
+
+async def open_upstream_client(aio_app):
+    client = AsyncUpstreamClient(
+        OPENROUTER_API_URL,
+        retry_policy=flask_module.upstream_client.retry_policy,
+        breaker=flask_module.upstream_client.breaker,  # One breaker per process for both paths
+        on_error=flask_module.upstream_client.on_error,
+    )
+    client.session = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=180),  # Same budget as the sync path
+        connector=aiohttp.TCPConnector(limit=UPSTREAM_CONNECTION_LIMIT),
+        json_serialize=json.dumps,
+        trace_configs=[client.trace_config()],
+    )
+    aio_app[UPSTREAM_CLIENT] = client
+    if flask_module.UPSTREAM_PRECONNECT:
+        aio_app[PRECONNECT] = asyncio.create_task(client.preconnect())
+    # Shares the sync router's per-model stats and circuit breakers, so both paths hedge on the same
+    # latencies and skip the same failing models
+    aio_app[MODEL_ROUTER] = AsyncModelRouter(
+        client, MODELS, flask_module.hedge_policy, stats=flask_module.model_router.stats,
+        breakers=flask_module.model_router.breakers)
+
+
+async def open_flask_executor(aio_app):
+    aio_app[FLASK_EXECUTOR] = ThreadPoolExecutor(FLASK_THREADS, thread_name_prefix="flask")
+    aio_app[BLOCKING_EXECUTOR] = ThreadPoolExecutor(BLOCKING_THREADS, thread_name_prefix="blocking")
+
+
+async def close_flask_executor(aio_app):
+    aio_app[FLASK_EXECUTOR].shutdown(wait=False, cancel_futures=True)
+    aio_app[BLOCKING_EXECUTOR].shutdown(wait=False, cancel_futures=True)
+
+
+async def close_upstream_client(aio_app):
+    if PRECONNECT in aio_app:
+        aio_app[PRECONNECT].cancel()
+    await aio_app[UPSTREAM_CLIENT].session.close()
+
+
+def create_app():
+    flask_module.create_app()  # Warm-up; done once in the gunicorn master when the app is preloaded
+    aio_app = web.Application(client_max_size=CLIENT_MAX_SIZE)
+    aio_app.on_startup.append(open_upstream_client)
+    aio_app.on_startup.append(open_flask_executor)
+    aio_app.on_cleanup.append(close_upstream_client)
+    aio_app.on_cleanup.append(close_flask_executor)
+    aio_app.router.add_get("/health", health)
+    aio_app.router.add_post("/chat", chat)
+    aio_app.router.add_post("/chat/stream", chat_stream)
+    aio_app.router.add_route("*", "/{tail:.*}", flask_fallback)
+    return aio_app
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    web.run_app(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -1,10 +1,35 @@
-from flask import Flask, request, render_template, jsonify, session
+from flask import Flask, request, render_template, jsonify, session, Response, stream_with_context, g, has_request_context, make_response
+from werkzeug.exceptions import RequestEntityTooLarge
 import requests
 import os
 import logging
+import functools
+from contextlib import contextmanager
 from datetime import datetime
 import re
 import json
+import threading
+import time
+from upstream import UpstreamClient, RetryPolicy, CircuitBreaker, CircuitOpenError, UpstreamStreamError, error_code, parse_retry_after, parse_stream_line
+from session_store import create_store, ServerSideSessionInterface
+from metrics import Registry, TOKEN_BUCKETS
+from classifier import classify, extract_code_blocks, find_intents, intents_for
+from code_store import new_versions
+from prompt_builder import assemble_prompt, code_block_references, estimate_tokens
+from response_cache import cache_key, ResponseCache, MemoryLRUCache, SQLiteCache
+from model_router import ModelRouter, HedgePolicy, Inflight
+from singleflight import create_flight_group, FlightTimeout, INTERRUPTED_BODY
+from admission import AdmissionController, ConcurrencyLimiter, RateLimiter, Rejected
+from renderer import ReplyRenderer, render_markdown
+from code_analysis import AnalysisPool, analyze, content_key
+from jobs import FINISHED, JobRunner, JobsFull, JobStore
+from uploads import UploadError, UploadStore, UploadTooLarge
+from generations import GenerationCancelled, GenerationError, GenerationExists, create_generation_registry, socket_disconnected
+from batch import FanOut, ItemError, RateLimited
+from usage import SAMPLED_FINISH_REASONS, Usage, UsageLedger, continuation_payload, create_token_budget
+from event_log import EventLog
+from lazy import Lazy
+from assets import AssetBundle, CachedPage, IMMUTABLE, compress, fingerprint, pick_encoding, pick_variant
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,170 +40,972 @@ app = Flask(__name__)
 # Secret key for session management (use environment variable in production)
 app.secret_key = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 
+# Fingerprinted CSS/JS bundle, loaded on first use (built from static/ then if `python assets.py` has not run)
+asset_bundle = AssetBundle(os.path.join(app.root_path, "static"))
+app.jinja_env.globals['asset_url'] = asset_bundle.url
+
+# The HTML shell has no per-request content: render it once and answer repeat visits with 304
+home_page = CachedPage(lambda: render_template("index.html"))
+
+# Prometheus metrics at /metrics (METRICS_DIR: a directory shared by all gunicorn workers to aggregate them)
+metrics_registry = Registry(os.getenv("METRICS_DIR"))
+STAGE_SECONDS = metrics_registry.histogram(
+    "vibecoding_stage_seconds", "Time spent in each stage of a chat request", ["stage"])
+CHAT_REQUESTS = metrics_registry.counter(
+    "vibecoding_chat_requests_total", "Chat requests by endpoint, request type and response status",
+    ["endpoint", "request_type", "status"])
+CHAT_SECONDS = metrics_registry.histogram(
+    "vibecoding_chat_request_seconds", "Wall time of chat requests until the last byte was sent", ["endpoint"])
+PROMPT_TOKENS = metrics_registry.histogram(
+    "vibecoding_prompt_tokens", "Estimated size of prompts sent upstream", ["request_type"], buckets=TOKEN_BUCKETS)
+REPLY_TOKENS = metrics_registry.histogram(
+    "vibecoding_reply_tokens", "Estimated size of AI replies", ["request_type"], buckets=TOKEN_BUCKETS)
+MAX_TOKENS_RESERVED = metrics_registry.histogram(
+    "vibecoding_max_tokens", "max_tokens reserved per upstream request", ["request_type"], buckets=TOKEN_BUCKETS)
+UPSTREAM_TOKENS = metrics_registry.counter(
+    "vibecoding_upstream_tokens_total", "Tokens used by generated replies, as reported by OpenRouter",
+    ["request_type", "kind"])
+REPLY_FINISHES = metrics_registry.counter(
+    "vibecoding_reply_finish_total", "Generated replies by why they stopped", ["request_type", "finish_reason"])
+UPSTREAM_ERRORS = metrics_registry.counter(
+    "vibecoding_upstream_errors_total", "Failed upstream attempts by HTTP status or error kind", ["code"])
+COALESCED_REQUESTS = metrics_registry.counter(
+    "vibecoding_coalesced_requests_total", "Chat requests served by an identical upstream call already in flight",
+    ["endpoint"])
+ADMISSION_REJECTIONS = metrics_registry.counter(
+    "vibecoding_admission_rejections_total", "Requests turned away by admission control", ["endpoint", "reason"])
+ADMISSION_ACTIVE = metrics_registry.gauge(
+    "vibecoding_admission_active", "Admitted requests currently running")
+ADMISSION_QUEUED = metrics_registry.gauge(
+    "vibecoding_admission_queued", "Requests waiting in the admission queue")
+JOBS_FINISHED = metrics_registry.counter(
+    "vibecoding_jobs_total", "Background chat jobs by outcome", ["status"])
+BATCH_PROMPTS = metrics_registry.counter(
+    "vibecoding_batch_prompts_total", "Prompts answered by /chat/batch", ["outcome"])
+GENERATIONS_CANCELLED = metrics_registry.counter(
+    "vibecoding_generations_cancelled_total", "Upstream generations stopped before they finished", ["reason"])
+
+CHAT_ENDPOINTS = {"chat", "chat_stream"}
+
+# JSON answers compressed on the fly when the client accepts it (streams are left alone)
+COMPRESSED_ENDPOINTS = {"chat", "chat_history", "list_conversations", "search_conversations"}
+MIN_COMPRESS_SIZE = 1024
+
+# /chat-history pages
+HISTORY_FIELDS = {"role", "content", "html", "timestamp", "metadata"}
+MAX_HISTORY_PAGE = 200
+
+# Status of a chat request whose generation was cancelled (nginx's "client closed request")
+CANCELLED_STATUS = 499
+
+# /conversations
+MAX_CONVERSATIONS_PAGE = 200
+MAX_SEARCH_RESULTS = 50
+TITLE_MAX_LENGTH = 120
+
+def current_timings():
+    """Stage timings (ms) of the chat request being handled, if any"""
+    return g.get('stage_timings') if has_request_context() else None
+
+def record_stage(stage, seconds, timings=None):
+    """Observe a stage duration and add it to the request's stage timings"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if timings is None:
+        timings = current_timings()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0) + seconds * 1000, 2)
+
+@contextmanager
+def timed_stage(stage, timings=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, timings)
+
+class TimedSessionInterface(ServerSideSessionInterface):
+    """Server-side sessions whose saves are timed as the session_save stage"""
+    
+    def save_session(self, app, session, response):
+        if not session.modified:
+            return
+        with timed_stage('session_save'):
+            super().save_session(app, session, response)
+
+# Server-side sessions: the cookie only carries a signed session id
+conversation_store = Lazy(lambda: create_store(
+    os.getenv("SESSION_BACKEND", "sqlite"),  # "sqlite" or "memory"
+    os.getenv("SESSION_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vibecoding.db"))
+))
+app.session_interface = TimedSessionInterface(conversation_store)
+
+# Opt-in reply cache for deterministic request types (RESPONSE_CACHE=1)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "0") == "1"
+CACHEABLE_REQUEST_TYPES = set(os.getenv("RESPONSE_CACHE_TYPES", "debug_code,optimize_code").split(","))
+response_cache = Lazy(lambda: ResponseCache(
+    MemoryLRUCache(
+        max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    ),
+    SQLiteCache(
+        os.getenv("RESPONSE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_cache.db")),
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    )
+)) if RESPONSE_CACHE_ENABLED else None
+
+# Assistant replies rendered to HTML server-side (SERVER_RENDER=0 leaves markdown to the browser)
+reply_renderer = ReplyRenderer(
+    MemoryLRUCache(max_entries=int(os.getenv("RENDER_CACHE_SIZE", "512")), ttl=float(os.getenv("RENDER_CACHE_TTL", "86400")))
+) if os.getenv("SERVER_RENDER", "1") == "1" else None
+
+# /analyze-code results cached by content hash; batches and large files run on a process pool with a per-file timeout
+analysis_cache = MemoryLRUCache(
+    max_entries=int(os.getenv("ANALYSIS_CACHE_SIZE", "1024")), ttl=float(os.getenv("ANALYSIS_CACHE_TTL", "86400"))
+)
+analysis_pool = AnalysisPool(
+    workers=int(os.getenv("ANALYSIS_WORKERS", "0")) or None,  # 0: one per CPU
+    timeout=float(os.getenv("ANALYSIS_TIMEOUT", "10"))
+)
+ANALYSIS_BATCH_MAX_FILES = int(os.getenv("ANALYSIS_BATCH_MAX_FILES", "1000"))
+ANALYSIS_MAX_FILE_BYTES = int(os.getenv("ANALYSIS_MAX_FILE_BYTES", str(1024 * 1024)))
+ANALYSIS_CHUNK_FILES = int(os.getenv("ANALYSIS_CHUNK_FILES", "64"))  # Sources held in memory at once per batch
+ANALYSIS_INLINE_MAX_BYTES = int(os.getenv("ANALYSIS_INLINE_MAX_BYTES", str(64 * 1024)))  # Single files analyzed in-process
+
+# Zip archives (/uploads) streamed to disk, analyzed file by file and attachable to chat messages
+upload_store = UploadStore(
+    os.getenv("UPLOAD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")),
+    max_bytes=int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024))),
+    max_file_bytes=ANALYSIS_MAX_FILE_BYTES,
+    max_files=int(os.getenv("UPLOAD_MAX_FILES", "2000")),
+    ttl=float(os.getenv("UPLOAD_TTL", str(24 * 3600)))
+)
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # Multipart framing read on top of the archive
+UPLOAD_ATTACH_MAX_FILES = int(os.getenv("UPLOAD_ATTACH_MAX_FILES", "20"))
+UPLOAD_ATTACH_MAX_CHARS = int(os.getenv("UPLOAD_ATTACH_MAX_CHARS", str(200 * 1024)))
+
+# Background chat jobs (/jobs): run on a bounded pool per worker, output kept in SQLite for any worker to serve
+job_store = Lazy(lambda: JobStore(
+    os.getenv("JOBS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db")),
+    ttl=float(os.getenv("JOBS_TTL", str(24 * 3600)))  # How long finished jobs stay retrievable
+))
+job_runner = Lazy(lambda: JobRunner(
+    job_store,
+    workers=int(os.getenv("JOBS_WORKERS", "4")),
+    max_pending=int(os.getenv("JOBS_MAX_PENDING", "32")),
+    on_finish=lambda status: JOBS_FINISHED.inc(status=status)
+))
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "0.25"))
+
+# One JSONL record per chat request, written off the request path (EVENT_LOG=0 turns it off)
+event_log = Lazy(lambda: EventLog(
+    os.getenv("EVENT_LOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "requests.jsonl")),
+    max_bytes=int(os.getenv("EVENT_LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+    rotate_interval=float(os.getenv("EVENT_LOG_ROTATE_INTERVAL", str(24 * 3600))),
+    flush_interval=float(os.getenv("EVENT_LOG_FLUSH_INTERVAL", "1.0"))
+)) if os.getenv("EVENT_LOG", "1") == "1" else None
+
+# Identical in-flight upstream calls are made once and shared (REQUEST_COALESCING=0 turns it off;
+# REQUEST_COALESCING_SHARED=1 also coalesces across the gunicorn workers of this host)
+flight_group = Lazy(lambda: create_flight_group(
+    os.getenv("REQUEST_COALESCING_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "singleflight.db"))
+    if os.getenv("REQUEST_COALESCING_SHARED", "0") == "1" else None,
+    timeout=float(os.getenv("REQUEST_COALESCING_TIMEOUT", "200"))  # Longest a subscriber waits for the leader
+)) if os.getenv("REQUEST_COALESCING", "1") == "1" else None
+
+# Upstream calls stop on POST /chat/<id>/cancel or when the client disconnects (CANCEL_SHARED=0: a cancel
+# only reaches generations running on the worker that receives it)
+generation_registry = Lazy(lambda: create_generation_registry(
+    os.getenv("CANCEL_SHARED_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "generations.db"))
+    if os.getenv("CANCEL_SHARED", "1") == "1" else None,
+    poll_interval=float(os.getenv("CANCEL_POLL_INTERVAL", "0.25")),  # How soon disconnects and remote cancels are seen
+    on_cancel=lambda reason: GENERATIONS_CANCELLED.inc(reason=reason)
+))
+# The part of a reply generated before its generation was cancelled: "keep" records it in the history, "discard" drops it
+KEEP_CANCELLED_REPLIES = os.getenv("CANCELLED_REPLIES", "keep") == "keep"
+
+# Token usage of every generated reply, totalled per session and request type at /usage (USAGE_LEDGER=0 turns it off)
+usage_ledger = Lazy(lambda: UsageLedger(
+    os.getenv("USAGE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "usage.db")),
+    retention=float(os.getenv("USAGE_RETENTION", str(30 * 24 * 3600)))
+)) if os.getenv("USAGE_LEDGER", "1") == "1" else None
+
+# max_tokens picked per request type and intent from the completion lengths seen so far
+# (MAX_TOKENS_ADAPTIVE=0 reserves MAX_TOKENS for every request)
+MAX_TOKENS = int(os.getenv("MAX_TOKENS", "12000"))
+token_budget = Lazy(lambda: create_token_budget(
+    usage_ledger,
+    ceiling=MAX_TOKENS,
+    floor=int(os.getenv("MAX_TOKENS_FLOOR", "512")),
+    quantile=float(os.getenv("MAX_TOKENS_QUANTILE", "0.95")),
+    headroom=float(os.getenv("MAX_TOKENS_HEADROOM", "1.25")),
+    min_samples=int(os.getenv("MAX_TOKENS_MIN_SAMPLES", "20"))  # Replies seen before the defaults give way
+)) if os.getenv("MAX_TOKENS_ADAPTIVE", "1") == "1" else None
+# Follow-up calls that continue a reply cut off at max_tokens
+REPLY_CONTINUATIONS = int(os.getenv("REPLY_CONTINUATIONS", "2"))
+
+# /chat/batch: prompts per request, default concurrency of one batch, and upstream calls all batches
+# of this worker may have in flight at once
+BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_INFLIGHT = int(os.getenv("BATCH_MAX_INFLIGHT", "16"))
+batch_slots = threading.BoundedSemaphore(BATCH_MAX_INFLIGHT)
+
 # Use environment variable for security
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 
 # BEST FREE CODING MODEL - Enhanced model selection
 MODEL = "meta-llama/llama-3.3-8b-instruct:free"  # 🥇 BEST for coding & reasoning
 
-# Alternative excellent free coding models (in order of preference):
-# MODEL = "qwen/qwen-2.5-coder-7b-instruct"     # 🥈 Specialized coding model  
-# MODEL = "deepseek/deepseek-chat"               # 🥉 General but strong at coding
-# MODEL = "qwen/qwen-2.5-7b-instruct"           # Good general model
+# Alternative excellent free coding models (in order of preference), used as fallbacks
+FALLBACK_MODELS = [
+    "qwen/qwen-2.5-coder-7b-instruct",     # 🥈 Specialized coding model
+    "deepseek/deepseek-chat",               # 🥉 General but strong at coding
+    "qwen/qwen-2.5-7b-instruct",           # Good general model
+]
+
+# Models tried in order (OPENROUTER_MODELS="model-a,model-b" overrides the list above)
+MODELS = [m.strip() for m in os.getenv("OPENROUTER_MODELS", ",".join([MODEL] + FALLBACK_MODELS)).split(",") if m.strip()]
+
+# Most recent messages considered for the prompt; the token budget decides how many are sent
+HISTORY_WINDOW = 40
+
+# Pasted code that is a new version of a block already in the prompt is sent as a unified diff (CODE_DIFFS=0 turns it off)
+CODE_DIFFS = os.getenv("CODE_DIFFS", "1") == "1"
+
+# Chat completions endpoint (overridable to point at a local stand-in)
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+def upstream_breaker():
+    return CircuitBreaker(
+        failure_threshold=int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5")),
+        recovery_timeout=float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "30"))
+    )
+
+# Shared keep-alive client: connection pool, retry budget and circuit breaker
+upstream_client = Lazy(lambda: UpstreamClient(
+    OPENROUTER_API_URL,
+    pool_size=int(os.getenv("UPSTREAM_POOL_SIZE", "20")),
+    retry_policy=RetryPolicy(
+        max_retries=int(os.getenv("UPSTREAM_MAX_RETRIES", "3")),
+        budget=float(os.getenv("UPSTREAM_RETRY_BUDGET", "20"))  # Seconds of backoff + retried attempts per request
+    ),
+    breaker=upstream_breaker(),
+    timeout=180,  # Increased timeout for longer responses
+    on_error=lambda code: UPSTREAM_ERRORS.inc(code=code)
+))
+
+# Each worker opens one upstream connection as it starts (UPSTREAM_PRECONNECT=0 turns it off)
+UPSTREAM_PRECONNECT = os.getenv("UPSTREAM_PRECONNECT", "1") == "1"
+
+# Fallback across MODELS, plus opt-in hedging of slow requests (MODEL_HEDGING=1)
+hedge_policy = HedgePolicy(
+    enabled=os.getenv("MODEL_HEDGING", "0") == "1",
+    min_delay=float(os.getenv("MODEL_HEDGE_MIN_DELAY", "1")),
+    max_delay=float(os.getenv("MODEL_HEDGE_MAX_DELAY", "30")),
+    max_ratio=float(os.getenv("MODEL_HEDGE_MAX_RATIO", "0.1"))  # Hedges per request, bounds the extra spend
+)
+# One circuit breaker per model: a model that keeps failing is skipped while the others still serve
+model_router = ModelRouter(upstream_client, MODELS, hedge_policy,
+                           breakers={model: upstream_breaker() for model in MODELS})
+
+def record_admission_load(active, queued):
+    ADMISSION_ACTIVE.set(active)
+    ADMISSION_QUEUED.set(queued)
+
+# Admission control for /chat, /chat/stream and /analyze-code, per worker process (ADMISSION_CONTROL=0 turns it off)
+admission = AdmissionController(
+    RateLimiter(
+        rate=float(os.getenv("ADMISSION_SESSION_RATE", "20")),  # Requests per minute per session
+        burst=float(os.getenv("ADMISSION_SESSION_BURST", "10")),
+        global_rate=float(os.getenv("ADMISSION_GLOBAL_RATE", "0"))  # Requests per minute for the worker, 0 = no limit
+    ),
+    ConcurrencyLimiter(
+        limit=int(os.getenv("ADMISSION_MAX_CONCURRENT", "32")),
+        key_limit=int(os.getenv("ADMISSION_SESSION_CONCURRENT", "2")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+        on_change=record_admission_load
+    ),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+    cost_unit=float(os.getenv("ADMISSION_COST_TOKENS", "1000"))  # Each this many estimated prompt tokens cost one more request
+) if os.getenv("ADMISSION_CONTROL", "1") == "1" else None
+
+ADMISSION_MESSAGES = {
+    429: "⚠️ Too many requests at once. Please wait a moment and try again.",
+    503: "⚠️ The server is busy right now. Please try again in a few seconds.",
+}
+
+def admission_key(cookie, remote_addr):
+    """Session a request belongs to, or its client address before it has one"""
+    sid = app.session_interface.session_id(app, cookie) if cookie else None
+    return f"session:{sid}" if sid else f"addr:{remote_addr}"
+
+def admission_rejection(error, endpoint, message_key="reply"):
+    """Fast 429/503 answer for a request that was not admitted"""
+    ADMISSION_REJECTIONS.inc(endpoint=endpoint, reason=error.reason)
+    return {message_key: ADMISSION_MESSAGES[error.status]}, error.status, {"Retry-After": str(error.retry_after)}
+
+def admission_controlled(message_key="reply"):
+    """Run the view once admission control lets the request in, holding its slot until the response is closed"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if admission is None:
+                return view(*args, **kwargs)
+            key = admission_key(request.cookies.get(app.session_interface.get_cookie_name(app)), request.remote_addr)
+            try:
+                ticket = admission.admit(key, request.content_length or 0)
+            except Rejected as e:
+                return admission_rejection(e, request.path, message_key)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                ticket.release()
+                raise
+            # Streams keep their slot until the last event has been sent
+            response.call_on_close(ticket.release)
+            return response
+        return wrapper
+    return decorator
 
 def extract_code_from_message(message):
     """Extract code blocks from user message for analysis"""
-    code_blocks = []
-    # Match code blocks with language specification
-    pattern = r'```(\w*)\n(.*?)```'
-    matches = re.findall(pattern, message, re.DOTALL)
-    
-    for language, code in matches:
-        code_blocks.append({
-            'language': language or 'text',
-            'code': code.strip()
-        })
-    
-    # Also check for inline code or code without proper formatting
-    if not code_blocks:
-        # Look for common code patterns
-        code_patterns = [
-            r'def\s+\w+\([^)]*\):\s*\n',  # Python functions
-            r'function\s+\w+\([^)]*\)\s*{',  # JavaScript functions
-            r'class\s+\w+[\s\S]*?{',  # Class definitions
-            r'import\s+\w+',  # Import statements
-            r'from\s+\w+\s+import',  # Python imports
-            r'#include\s*<[^>]+>',  # C/C++ includes
-            r'public\s+class\s+\w+',  # Java classes
-        ]
-        
-        for pattern in code_patterns:
-            if re.search(pattern, message, re.MULTILINE):
-                # Extract potential code block
-                lines = message.split('\n')
-                code_lines = []
-                in_code = False
-                
-                for line in lines:
-                    if re.search(pattern, line) or in_code:
-                        in_code = True
-                        code_lines.append(line)
-                        # Simple heuristic to end code block
-                        if line.strip() == '' and len(code_lines) > 5:
-                            break
-                
-                if code_lines:
-                    code_blocks.append({
-                        'language': 'auto-detected',
-                        'code': '\n'.join(code_lines)
-                    })
-                break
-    
-    return code_blocks
+    return extract_code_blocks(message)
 
 def analyze_code_intent(user_input, code_blocks):
     """Analyze what the user wants to do with the code"""
+    return intents_for(find_intents(user_input.lower()), bool(code_blocks))
+
+def detect_request_type(user_input):
+    """Enhanced request type detection"""
+    return classify(user_input).request_type
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_chat_metrics(response):
+    """Count chat requests once their (possibly streamed) response has been sent"""
+    if request.endpoint not in CHAT_ENDPOINTS:
+        return response
+    endpoint = request.path
+    started = g.get('request_started', time.perf_counter())
+    chat_request = g.get('chat_request')
+    
+    def record():
+        request_type = chat_request['request_type'] if chat_request else "unknown"
+        # Streams that failed after the 200 was sent report "stream_error"
+        status = (chat_request or {}).get('stream_status') or str(response.status_code)
+        duration = time.perf_counter() - started
+        CHAT_REQUESTS.inc(endpoint=endpoint, request_type=request_type, status=status)
+        CHAT_SECONDS.observe(duration, endpoint=endpoint)
+        if event_log is not None:
+            event_log.emit(chat_event(endpoint, status, duration, chat_request))
+    
+    response.call_on_close(record)
+    return response
+
+def chat_event(endpoint, status, duration, chat_request):
+    """Event log record of one chat request"""
+    chat_request = chat_request or {}
+    return {
+        "ts": datetime.now().isoformat(timespec='milliseconds'),
+        "endpoint": endpoint,
+        "status": status,
+        "duration_ms": round(duration * 1000, 2),
+        "request_type": chat_request.get('request_type', "unknown"),
+        "intents": chat_request.get('intents'),
+        "prompt_tokens": chat_request.get('prompt_tokens'),
+        "reply_chars": chat_request.get('reply_chars'),
+        "stages": chat_request.get('timings'),
+        "upstream_status": chat_request.get('upstream_status'),
+        "model": chat_request.get('model'),
+        "cache": chat_request.get('cache'),
+        "coalesced": bool(chat_request.get('flight')) and not chat_request.get('flight_leader'),
+        "cancelled": chat_request['generation'].reason if chat_request.get('generation') else None,
+        "usage": chat_request['usage'].as_dict() if chat_request.get('usage') and chat_request['usage'].calls else None,
+    }
+
+# Registered before settle_flight so it runs after it: Flask runs after_request hooks in reverse order
+@app.after_request
+def compress_response(response):
+    """gzip/brotli JSON bodies of the chat and history endpoints"""
+    if (request.endpoint not in COMPRESSED_ENDPOINTS or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    encoding = pick_encoding(request.accept_encodings) if len(body) >= MIN_COMPRESS_SIZE else None
+    response.vary.add('Accept-Encoding')
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, _ = response.get_etag()
+    if etag:
+        # Same content, different bytes: only weakly equal to the uncompressed variant
+        response.set_etag(etag, weak=True)
+    return response
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint (summed over all workers when METRICS_DIR is set)"""
+    return Response(metrics_registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Health check endpoint for Render
+@app.route("/health")
+def health():
+    return jsonify({
+        "status": "healthy",
+        "message": "Enhanced VibeCoding is running!",
+        "upstream": upstream_client.snapshot(),
+        "models": model_router.snapshot(),
+        "coalescing": flight_group.snapshot() if flight_group else None,
+        "admission": admission.snapshot() if admission else None,
+        "jobs": job_runner.snapshot(),
+        "generations": generation_registry.snapshot(),
+        "token_budget": token_budget.snapshot() if token_budget else None,
+        "event_log": event_log.snapshot() if event_log else None
+    }), 200
+
+def negotiated_response(variants, etag, content_type, cache_control):
+    """Best precompressed variant the client accepts, or 304 when its copy is current"""
+    body, encoding = pick_variant(variants, request.accept_encodings)
+    tag = f"{etag}-{encoding}" if encoding else etag
+    headers = {"Cache-Control": cache_control, "ETag": f'"{tag}"', "Vary": "Accept-Encoding"}
+    if request.if_none_match.contains(tag):
+        return Response(status=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, content_type=content_type, headers=headers)
+
+@app.route("/")
+def home():
+    try:
+        variants, etag = home_page.get()
+    except Exception as e:
+        logger.error(f"Error serving home page: {e}")
+        return jsonify({"error": "Template not found"}), 500
+    return negotiated_response(variants, etag, "text/html; charset=utf-8", "no-cache")
+
+@app.route("/assets/<filename>")
+def asset(filename):
+    """Fingerprinted bundle files: cached by browsers for a year, never revalidated"""
+    found = asset_bundle.get(filename)
+    if found is None:
+        return jsonify({"error": "Endpoint not found"}), 404
+    variants, etag, content_type = found
+    return negotiated_response(variants, etag, content_type, IMMUTABLE)
+
+def conversation_id():
+    """Id of the session's open conversation (issues the cookie for new sessions).
+
+    A session starts in the conversation whose id is its own session id.
+    """
+    if session.new:
+        session.modified = True
+    return session.get('conversation_id', session.sid)
+
+def chat_message():
+    """The posted chat message, followed by the uploaded files it attaches as code blocks.
+    
+    The body may carry "attachments": [{"upload_id", "path"}, ...]; raises
+    UploadError when one cannot be attached.
+    """
+    data = request.get_json(silent=True) or {}
+    message = data.get("message", "")
+    if message and data.get("attachments"):
+        message += upload_store.attachment_text(session.sid, data["attachments"], UPLOAD_ATTACH_MAX_FILES,
+                                                UPLOAD_ATTACH_MAX_CHARS)
+    return message
+
+def get_conversation(limit=None):
+    """History of the open conversation, oldest first"""
+    return conversation_store.get_messages(conversation_id(), limit)
+
+def append_to_conversation(message):
+    """Append one message to the current session's history"""
+    with timed_stage('session_save'):
+        return conversation_store.append_message(conversation_id(), message)
+
+def prepare_chat_request(user_input):
+    """Analyze the user message, update session state and build the OpenRouter request"""
+    g.stage_timings = timings = {}
+    
+    # Initialize user context if not exists
+    if 'user_context' not in session:
+        session['user_context'] = {
+            'name': None,
+            'mood_today': None,
+            'current_projects': [],
+            'coding_level': None,
+            'favorite_languages': [],
+            'personal_notes': []
+        }
+    
+    # Enhanced request analysis (single scan for code blocks, intents and type)
+    with timed_stage('classification'):
+        code_blocks, intents, request_type = classify(user_input)
+    
+    logger.info(f"Detected request type: {request_type}, Intents: {intents}")
+    if code_blocks:
+        logger.info(f"Found {len(code_blocks)} code blocks")
+    
+    # Simple context extraction from user input (basic sentiment and info)
+    user_context = session['user_context']
     user_input_lower = user_input.lower()
     
-    # Debug/fix indicators
-    debug_keywords = [
-        'fix', 'debug', 'error', 'bug', 'broken', 'not working', 'issue', 
-        'problem', 'wrong', 'incorrect', 'doesn\'t work', 'failed', 
-        'exception', 'crash', 'syntax error', 'runtime error'
-    ]
+    # Detect if user is sharing personal info or mood
+    mood_indicators = {
+        'tired': '😴', 'stressed': '😰', 'frustrated': '😤', 'excited': '🎉',
+        'happy': '😊', 'sad': '😢', 'angry': '😠', 'overwhelmed': '😵',
+        'good day': '✨', 'bad day': '💙', 'great': '🌟', 'awesome': '🚀'
+    }
+    
+    for mood, emoji in mood_indicators.items():
+        if mood in user_input_lower:
+            user_context['mood_today'] = f"{mood} {emoji}"
+            break
+    
+    # Detect name sharing
+    if 'my name is' in user_input_lower or 'i\'m ' in user_input_lower:
+        name_match = re.search(r"(?:my name is|i'm|i am)\s+([a-zA-Z]+)", user_input_lower)
+        if name_match:
+            user_context['name'] = name_match.group(1).title()
+    
+    session['user_context'] = user_context
+    
+    # Add user message to conversation history, unless it resubmits the message still waiting
+    # for its reply (double send, retry): the prompt then matches the original request's, so
+    # both are served by one upstream call
+    with timed_stage('session_save'):
+        _, appended = conversation_store.append_unless_repeated(conversation_id(), {
+            "role": "user", 
+            "content": user_input,
+            "timestamp": datetime.now().isoformat(),
+            "metadata": {
+                "request_type": request_type,
+                "intents": intents,
+                "has_code": len(code_blocks) > 0
+            }
+        })
+    if not appended:
+        logger.info("Resubmitted message, reusing the pending history entry")
     
-    # Optimization indicators
-    optimize_keywords = [
-        'optimize', 'improve', 'better', 'faster', 'efficient', 'performance',
-        'refactor', 'clean up', 'make it better'
-    ]
+    assembly_started = time.perf_counter()
     
-    # Explanation indicators
-    explain_keywords = [
-        'explain', 'what does', 'how does', 'understand', 'break down',
-        'step by step', 'walk through'
-    ]
+    # Pasted code that is a new version of a block still in the prompt goes as a diff
+    versions = conversation_store.code_versions(conversation_id()) if CODE_DIFFS else None
     
-    # Enhancement indicators
-    enhance_keywords = [
-        'add', 'extend', 'modify', 'change', 'update', 'enhance',
-        'feature', 'functionality', 'new'
-    ]
+    # Build messages array with conversation history and user context
+    messages = system_messages(request_type, intents, code_blocks, new_versions(user_input, versions))
     
-    # Creation indicators
-    create_keywords = [
-        'create', 'make', 'build', 'write', 'generate', 'develop',
-        'code for', 'function for', 'script for'
-    ]
+    # Add user context info for the AI to reference (only for personal conversations)
+    if request_type == 'general_chat':
+        context_summary = []
+        if user_context['name']:
+            context_summary.append(f"User's name: {user_context['name']}")
+        if user_context['mood_today']:
+            context_summary.append(f"User's mood today: {user_context['mood_today']}")
+        if user_context['current_projects']:
+            context_summary.append(f"Current projects: {', '.join(user_context['current_projects'])}")
+        
+        if context_summary:
+            context_message = "Personal context about the user: " + " | ".join(context_summary)
+            messages.append({"role": "system", "content": context_message})
     
-    intents = []
+    # Add conversation history with intelligent context selection
+    recent_conversation = get_conversation(HISTORY_WINDOW)
     
-    if any(keyword in user_input_lower for keyword in debug_keywords):
-        intents.append('debug')
+    # Filter conversation to include only relevant context
+    filtered_conversation = filter_relevant_conversation(recent_conversation, request_type)
     
-    if any(keyword in user_input_lower for keyword in optimize_keywords):
-        intents.append('optimize')
+    # Pack history newest-first into the request type's token budget
+    messages, prompt_tokens = assemble_prompt(messages, filtered_conversation, request_type, versions)
+    record_stage('prompt_assembly', time.perf_counter() - assembly_started)
+    PROMPT_TOKENS.observe(prompt_tokens, request_type=request_type)
     
-    if any(keyword in user_input_lower for keyword in explain_keywords):
-        intents.append('explain')
+    g.chat_request = build_chat_request(messages, request_type, intents, prompt_tokens, session.sid, timings)
+    return g.chat_request
+
+def upstream_headers():
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://vibecoding-y73m.onrender.com",
+        "X-Title": "Enhanced VibeCoding AI"
+    }
+
+def system_messages(request_type, intents, code_blocks, diffable=()):
+    """The system prompt for the request type, plus the analysis context when the message has code.
+
+    diffable holds the positions of the blocks the prompt may send as diffs against earlier versions.
+    """
+    # Enhanced dynamic system prompt based on request type and intents
+    messages = [{"role": "system", "content": get_enhanced_system_prompt(request_type, intents, code_blocks)}]
     
-    if any(keyword in user_input_lower for keyword in enhance_keywords):
-        intents.append('enhance')
+    # Add code analysis context if code is present (the code, or a diff of it, is only sent in the user message)
+    if code_blocks:
+        code_context = "Code blocks provided by user:\n" + code_block_references(code_blocks, diffable) + "\n"
+        
+        messages.append({
+            "role": "system", 
+            "content": f"ANALYSIS CONTEXT: {code_context}\nUser's request type: {request_type}\nDetected intents: {', '.join(intents)}"
+        })
+    return messages
+
+def build_chat_request(messages, request_type, intents, prompt_tokens, session_id, timings):
+    """The OpenRouter request for an assembled prompt, with the state the chat views keep about it"""
+    # Reserve what replies of this kind usually take; longer ones are continued
+    max_tokens = token_budget.max_tokens(request_type, intents) if token_budget is not None else MAX_TOKENS
+    MAX_TOKENS_RESERVED.observe(max_tokens, request_type=request_type)
     
-    if any(keyword in user_input_lower for keyword in create_keywords):
-        intents.append('create')
+    # Enhanced payload with better parameters for code generation
+    payload = {
+        "model": MODEL,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "usage": {"include": True},  # Token counts in the response, also when streamed
+        "temperature": get_optimal_temperature(request_type, intents),
+        "top_p": 0.9,
+        "frequency_penalty": 0.1,
+        "presence_penalty": 0.1
+    }
     
-    # If code is provided but no clear intent, assume debug/fix
-    if code_blocks and not intents:
-        intents.append('debug')
+    logger.info(f"Making request to OpenRouter API with {len(messages)} messages in context...")
+    logger.info(f"Request type: {request_type}, Temperature: {payload['temperature']}, max_tokens: {max_tokens}")
     
-    # If no code and no clear intent, assume creation
-    if not code_blocks and not intents:
-        intents.append('create')
+    cacheable = RESPONSE_CACHE_ENABLED and request_type in CACHEABLE_REQUEST_TYPES
     
-    return intents
+    return {
+        "headers": upstream_headers(),
+        "payload": payload,
+        "request_type": request_type,
+        "intents": intents,
+        "prompt_tokens": prompt_tokens,
+        "usage": Usage(prompt_tokens, max_tokens),
+        "session_id": session_id,
+        "cache_key": cache_key(payload) if cacheable else None,
+        "cache": "bypass",
+        "timings": timings
+    }
 
-def detect_request_type(user_input):
-    """Enhanced request type detection"""
-    code_blocks = extract_code_from_message(user_input)
-    intents = analyze_code_intent(user_input, code_blocks)
-    
-    # Determine primary request type based on intents and content
-    if 'debug' in intents and code_blocks:
-        return 'debug_code'
-    elif 'optimize' in intents and code_blocks:
-        return 'optimize_code'
-    elif 'explain' in intents and code_blocks:
-        return 'explain_code'
-    elif 'enhance' in intents and code_blocks:
-        return 'enhance_code'
-    elif 'create' in intents or any(word in user_input.lower() for word in ['write', 'create', 'make', 'build']):
-        return 'create_code'
-    elif code_blocks:
-        return 'analyze_code'
+def lookup_cached_reply(chat_request):
+    """Return a cached reply for this exact payload, or None; records the outcome in chat_request"""
+    key = chat_request['cache_key']
+    if key is None:
+        return None
+    reply, tier = response_cache.get(key)
+    if reply is None:
+        chat_request['cache'] = "miss"
+        logger.info(f"Response cache miss for {chat_request['request_type']} ({key[:12]})")
+        return None
+    chat_request['cache'] = "hit"
+    logger.info(f"Response cache hit from {tier} tier for {chat_request['request_type']} ({key[:12]})")
+    return reply
+
+def store_cached_reply(chat_request, reply):
+    """Remember a finished reply for cacheable requests"""
+    if chat_request['cache_key'] is not None:
+        response_cache.set(chat_request['cache_key'], reply)
+
+def chat_response_body(reply, chat_request):
+    """JSON body for a chat reply, reporting the cache outcome when caching is on"""
+    chat_request['reply_chars'] = len(reply)
+    body = {"reply": reply}
+    html = render_reply(reply)
+    if html is not None:
+        body["html"] = html
+    if RESPONSE_CACHE_ENABLED:
+        body["cache"] = chat_request['cache']
+    return body
+
+def join_flight(chat_request):
+    """Lead or subscribe to the upstream call for this exact payload; returns True for subscribers"""
+    if flight_group is None:
+        return False
+    sid = conversation_id()
+    flight, leader = flight_group.join(chat_request['cache_key'] or cache_key(chat_request['payload']), sid)
+    chat_request['flight'] = flight
+    chat_request['flight_leader'] = leader
+    # Only the first request of each session records the shared reply in its history
+    chat_request['record_reply'] = flight.claim_session(sid)
+    if not leader:
+        COALESCED_REQUESTS.inc(endpoint=request.path)
+        logger.info(f"Coalesced onto the identical request in flight ({flight.key[:12]})")
+    return not leader
+
+def leading_flight(chat_request):
+    """The flight this request settles for its subscribers, if it leads one"""
+    return chat_request.get('flight') if chat_request.get('flight_leader') else None
+
+def finish_flight(chat_request, status, body, model=None):
+    """Hand the leader's outcome to every request coalesced onto it"""
+    flight = leading_flight(chat_request)
+    if flight is not None:
+        flight.finish(status, body, model)
+
+def record_coalesced_reply(chat_request):
+    """Outcome of the finished flight this request subscribed to, as (body, status)"""
+    flight = chat_request['flight']
+    note_coalesced_reply(chat_request, flight)
+    if flight.status == 200 and chat_request['record_reply']:
+        append_to_conversation(build_assistant_message(flight.body['reply'], chat_request['request_type'], flight.model))
+    return flight.body, flight.status
+
+def note_upstream_response(chat_request, status, model):
+    """Remember the upstream outcome for the event log"""
+    chat_request['upstream_status'] = status
+    chat_request['model'] = model
+
+def note_coalesced_reply(chat_request, flight):
+    """Event log fields of a reply received from a flight"""
+    chat_request['model'] = flight.model
+    if flight.status == 200:
+        chat_request['reply_chars'] = len(flight.body['reply'])
+
+@app.after_request
+def settle_flight(response):
+    """Share a leading chat request's JSON outcome with its subscribers"""
+    chat_request = g.get('chat_request')
+    flight = leading_flight(chat_request) if chat_request else None
+    if flight is None:
+        return response
+    if response.mimetype == 'text/event-stream':
+        # Streams settle the flight as they end; this covers clients that left before
+        response.call_on_close(lambda: flight.finish(500, INTERRUPTED_BODY))
     else:
-        return 'general_chat'
+        flight.finish(response.status_code, response.get_json(silent=True) or INTERRUPTED_BODY, chat_request.get('model'))
+    return response
 
-# Health check endpoint for Render
-@app.route("/health")
-def health():
-    return jsonify({"status": "healthy", "message": "Enhanced VibeCoding is running!"}), 200
+@app.after_request
+def finish_generation(response):
+    """Tell the client its generation id and unregister the generation once the response is closed"""
+    chat_request = g.get('chat_request')
+    generation = chat_request.get('generation') if chat_request else None
+    if generation is None:
+        return response
+    response.headers['X-Generation-Id'] = generation.id
+    response.call_on_close(lambda: generation_registry.finish(generation))
+    return response
 
-@app.route("/")
-def home():
+def build_assistant_message(reply, request_type, model=None, usage=None):
+    """Build the conversation history entry for an AI reply, with the usage of the calls that generated it"""
+    message = {
+        "role": "assistant",
+        "content": reply,
+        "timestamp": datetime.now().isoformat(),
+        "metadata": {
+            "response_to": request_type,
+            "token_count": usage.completion_tokens if usage is not None else estimate_tokens(reply)
+        }
+    }
+    html = render_reply(reply)
+    if html is not None:
+        message["html"] = html
+    if model:
+        message["metadata"]["model"] = model
+    if usage is not None:
+        message["metadata"]["usage"] = usage.as_dict()
+    return message
+
+def render_reply(reply):
+    """Sanitized HTML for a reply, or None when server-side rendering is off"""
+    if reply_renderer is None:
+        return None
+    with timed_stage('render'):
+        return reply_renderer.render(reply)
+
+def upstream_status_error(status_code, body_text):
+    """Log a non-200 OpenRouter response and build the user-facing error reply"""
+    logger.error(f"OpenRouter API Error - Status Code: {status_code}")
+    logger.error(f"Response: {body_text}")
+    return f"⚠️ API Error (Status {status_code}). Please try again later."
+
+def read_completion_reply(data, usage=None):
+    """Return (reply, error_reply) for a parsed chat completion response, reading its usage into usage"""
+    # Check if the response has the expected structure
+    if "choices" not in data:
+        logger.error("'choices' key not found in response")
+        logger.error(f"Available keys: {list(data.keys())}")
+        
+        if "error" in data:
+            error_msg = data["error"].get("message", "Unknown API error")
+            logger.error(f"API Error: {error_msg}")
+            return None, f"⚠️ API Error: {error_msg}"
+        
+        return None, "⚠️ Unexpected API response format. Please try again."
+    
+    if not data["choices"] or len(data["choices"]) == 0:
+        logger.error("No choices in API response")
+        return None, "⚠️ No response generated. Please try again."
+    
+    if usage is not None:
+        usage.read(data)
+    return data["choices"][0]["message"]["content"], None
+
+def finalize_reply(reply, request_type, intents):
+    """post_process_reply timed as the post_processing stage, recording the reply size"""
+    with timed_stage('post_processing'):
+        reply = post_process_reply(reply, request_type, intents)
+    REPLY_TOKENS.observe(estimate_tokens(reply), request_type=request_type)
+    return reply
+
+def finish_chat_reply(reply, chat_request, model=None):
+    """Post-process an AI reply, append it to the session history and account for its usage"""
+    request_type = chat_request['request_type']
+    # Post-process the reply for better formatting
+    reply = finalize_reply(reply, request_type, chat_request['intents'])
+    
+    # Add AI response to conversation history
+    append_to_conversation(build_assistant_message(reply, request_type, model, chat_request['usage']))
+    account_usage(chat_request, conversation_id(), model)
+    return reply
+
+def account_usage(chat_request, sid, model=None):
+    """Record the tokens a generated reply used: ledger, metrics and the max_tokens samples"""
+    usage = chat_request['usage']
+    request_type = chat_request['request_type']
+    UPSTREAM_TOKENS.inc(usage.prompt_tokens, request_type=request_type, kind="prompt")
+    UPSTREAM_TOKENS.inc(usage.completion_tokens, request_type=request_type, kind="completion")
+    REPLY_FINISHES.inc(request_type=request_type, finish_reason=usage.finish_reason or "unknown")
+    if token_budget is not None and usage.finish_reason in SAMPLED_FINISH_REASONS:
+        token_budget.observe(request_type, chat_request['intents'], usage.completion_tokens)
+    if usage_ledger is not None:
+        usage_ledger.record(chat_request['session_id'], sid, request_type, chat_request['intents'], model, usage)
+
+def continue_upstream(chat_request, reply):
+    """post_upstream for the rest of a reply cut off at max_tokens, or None when it cannot be had"""
+    logger.info(f"Reply stopped at max_tokens ({chat_request['payload']['max_tokens']}), continuing it")
     try:
-        # Initialize conversation history in session
-        if 'conversation' not in session:
-            session['conversation'] = []
-        return render_template("index.html")
-    except Exception as e:
-        logger.error(f"Error serving home page: {e}")
-        return jsonify({"error": "Template not found"}), 500
+        response = post_upstream(chat_request, continuation_payload(chat_request['payload'], reply))
+    except (CircuitOpenError, requests.exceptions.RequestException) as e:
+        logger.warning(f"Continuation failed, keeping the truncated reply: {e}")
+        return None
+    if response.status_code != 200:
+        logger.warning(f"Continuation failed with status {response.status_code}, keeping the truncated reply")
+        response.close()
+        return None
+    return response
+
+def complete_reply(chat_request, reply):
+    """A non-streamed reply followed by its continuations while it stops at max_tokens"""
+    usage = chat_request['usage']
+    usage.end_call(reply)
+    while usage.wants_continuation(REPLY_CONTINUATIONS):
+        response = continue_upstream(chat_request, reply)
+        if response is None:
+            break
+        try:
+            part, error_reply = read_completion_reply(response.json(), usage)
+        finally:
+            response.close()
+        if error_reply:
+            break
+        reply += part
+        usage.end_call(reply)
+    return reply
+
+def circuit_open_response(error):
+    """Fail fast while the upstream circuit breaker is open"""
+    logger.warning(f"Skipping OpenRouter call: {error}")
+    UPSTREAM_ERRORS.inc(code="circuit_open")
+    return (
+        {"reply": "⚠️ API Error: the AI service is temporarily unavailable. Please try again in a few seconds."},
+        503,
+        {"Retry-After": str(int(error.retry_after))}
+    )
+
+def client_disconnected():
+    """Generation.disconnected for this request's client socket, when the WSGI server exposes it"""
+    sock = request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+    return socket_disconnected(sock) if sock is not None else None
+
+def start_generation(chat_request, disconnected=None):
+    """Register the upstream call this request is about to make as a cancellable generation"""
+    data = request.get_json(silent=True) or {}
+    generation = generation_registry.start(data.get("generation_id"), session.sid,
+                                           disconnected or client_disconnected())
+    chat_request['generation'] = generation
+    return generation
+
+def post_upstream(chat_request, payload=None):
+    """model_router.post for the request's generation (if any); raises GenerationCancelled once it is cancelled"""
+    payload = payload or chat_request['payload']
+    generation = chat_request.get('generation')
+    if generation is None:
+        return model_router.post(chat_request['headers'], payload)
+    inflight = Inflight()
+    generation.on_cancel(inflight.abort)
+    try:
+        response = model_router.post(chat_request['headers'], payload, inflight)
+    except Exception:
+        generation.check()  # An aborted request fails in whatever way the read was cut off
+        raise
+    if generation.cancelled:
+        response.close()
+        generation.check()
+    return response
+
+def iter_generation_deltas(response, generation, usage=None):
+    """iter_stream_deltas that raises GenerationCancelled once the generation is cancelled"""
+    try:
+        for delta in iter_stream_deltas(response, usage):
+            generation.check()
+            yield delta
+    except Exception:
+        generation.check()
+        raise
+    generation.check()  # An aborted stream can also end like a finished one
+
+def iter_reply_deltas(response, chat_request, parts):
+    """Deltas of a streamed reply, collected in parts, then those of its continuations while it stops at max_tokens.
+    
+    Every response is closed once read.
+    """
+    usage = chat_request['usage']
+    generation = chat_request.get('generation')
+    while response is not None:
+        try:
+            deltas = (iter_generation_deltas(response, generation, usage) if generation is not None
+                      else iter_stream_deltas(response, usage))
+            for delta in deltas:
+                parts.append(delta)
+                yield delta
+        finally:
+            response.close()
+        reply = ''.join(parts)
+        usage.end_call(reply)
+        response = continue_upstream(chat_request, reply) if usage.wants_continuation(REPLY_CONTINUATIONS) else None
+
+def settle_cancelled(chat_request, parts=(), sid=None, model=None):
+    """Body answering a cancelled generation, also handed to coalesced subscribers.
+    
+    The reply generated so far is recorded in the history of conversation sid
+    unless CANCELLED_REPLIES=discard; it is never cached.
+    """
+    generation = chat_request['generation']
+    chat_request['stream_status'] = generation.reason
+    reply = ''.join(parts)
+    usage = chat_request['usage']
+    usage.end_call(reply, finish_reason="cancelled")  # The prompt was sent, and maybe part of the reply generated
+    account_usage(chat_request, sid, model)
+    if reply and sid is not None and KEEP_CANCELLED_REPLIES:
+        reply = finalize_reply(reply, chat_request['request_type'], chat_request['intents'])
+        message = build_assistant_message(reply, chat_request['request_type'], model, usage)
+        message["metadata"]["cancelled"] = generation.reason
+        with timed_stage('session_save'):
+            conversation_store.append_message(sid, message)
+    chat_request['reply_chars'] = len(reply)
+    body = {"reply": reply, "cancelled": generation.reason, "generation_id": generation.id}
+    finish_flight(chat_request, CANCELLED_STATUS, body, model)
+    logger.info(f"Generation {generation.id} {generation.reason} after {len(reply)} chars")
+    return body
 
 @app.route("/chat", methods=["POST"])
+@admission_controlled()
 def chat():
     try:
-        user_input = request.json.get("message", "")
+        user_input = chat_message()
         logger.info(f"Received chat request: {user_input[:100]}...")
         
         # Check if API key is available
@@ -186,190 +1013,265 @@ def chat():
             logger.error("OPENROUTER_API_KEY not found in environment variables")
             return jsonify({"reply": "⚠️ API key not configured. Please contact the administrator."}), 500
         
-        # Initialize conversation history and user context if not exists
-        if 'conversation' not in session:
-            session['conversation'] = []
-        if 'user_context' not in session:
-            session['user_context'] = {
-                'name': None,
-                'mood_today': None,
-                'current_projects': [],
-                'coding_level': None,
-                'favorite_languages': [],
-                'personal_notes': []
-            }
-        
-        # Enhanced request analysis
-        code_blocks = extract_code_from_message(user_input)
-        request_type = detect_request_type(user_input)
-        intents = analyze_code_intent(user_input, code_blocks)
-        
-        logger.info(f"Detected request type: {request_type}, Intents: {intents}")
-        if code_blocks:
-            logger.info(f"Found {len(code_blocks)} code blocks")
+        chat_request = prepare_chat_request(user_input)
+        request_type = chat_request['request_type']
         
-        # Simple context extraction from user input (basic sentiment and info)
-        user_context = session['user_context']
-        user_input_lower = user_input.lower()
+        cached_reply = lookup_cached_reply(chat_request)
+        if cached_reply is not None:
+            append_to_conversation(build_assistant_message(cached_reply, request_type))
+            return jsonify(chat_response_body(cached_reply, chat_request))
         
-        # Detect if user is sharing personal info or mood
-        mood_indicators = {
-            'tired': '😴', 'stressed': '😰', 'frustrated': '😤', 'excited': '🎉',
-            'happy': '😊', 'sad': '😢', 'angry': '😠', 'overwhelmed': '😵',
-            'good day': '✨', 'bad day': '💙', 'great': '🌟', 'awesome': '🚀'
-        }
-        
-        for mood, emoji in mood_indicators.items():
-            if mood in user_input_lower:
-                user_context['mood_today'] = f"{mood} {emoji}"
-                break
+        if join_flight(chat_request):
+            chat_request['flight'].wait(flight_group.timeout)
+            body, status = record_coalesced_reply(chat_request)
+            return jsonify(body), status
         
-        # Detect name sharing
-        if 'my name is' in user_input_lower or 'i\'m ' in user_input_lower:
-            name_match = re.search(r"(?:my name is|i'm|i am)\s+([a-zA-Z]+)", user_input_lower)
-            if name_match:
-                user_context['name'] = name_match.group(1).title()
+        start_generation(chat_request)
+        upstream_started = time.perf_counter()
+        response = post_upstream(chat_request)
+        record_stage('upstream_ttfb', response.ttfb)
         
-        session['user_context'] = user_context
+        logger.info(f"OpenRouter API response status: {response.status_code} from {response.model}")
+        note_upstream_response(chat_request, response.status_code, response.model)
         
-        # Add user message to conversation history
-        session['conversation'].append({
-            "role": "user", 
-            "content": user_input,
-            "timestamp": datetime.now().isoformat(),
-            "metadata": {
-                "request_type": request_type,
-                "intents": intents,
-                "has_code": len(code_blocks) > 0
-            }
-        })
-        
-        # Keep only last 15 exchanges (30 messages) for better context
-        if len(session['conversation']) > 30:
-            session['conversation'] = session['conversation'][-30:]
-        
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://vibecoding-y73m.onrender.com",
-            "X-Title": "Enhanced VibeCoding AI"
-        }
+        # The body was opened streamed: closing it hands the pooled connection back, whatever the outcome
+        try:
+            # Check if request was successful
+            if response.status_code != 200:
+                return jsonify({"reply": upstream_status_error(response.status_code, response.text)}), 500
+            
+            data = response.json()
+        finally:
+            response.close()
+        record_stage('upstream_total', time.perf_counter() - upstream_started)
+        logger.info("Successfully parsed API response")
         
-        # Enhanced dynamic system prompt based on request type and intents
-        system_prompt = get_enhanced_system_prompt(request_type, intents, code_blocks)
+        reply, error_reply = read_completion_reply(data, chat_request['usage'])
+        if error_reply:
+            return jsonify({"reply": error_reply}), 500
         
-        # Build messages array with conversation history and user context
-        messages = [{"role": "system", "content": system_prompt}]
+        reply = complete_reply(chat_request, reply)
+        reply = finish_chat_reply(reply, chat_request, response.model)
+        store_cached_reply(chat_request, reply)
+        chat_request['model'] = response.model
         
-        # Add code analysis context if code is present
-        if code_blocks:
-            code_context = "Code blocks provided by user:\n"
-            for i, block in enumerate(code_blocks):
-                code_context += f"\nCode Block {i+1} ({block['language']}):\n```{block['language']}\n{block['code']}\n```\n"
-            
-            messages.append({
-                "role": "system", 
-                "content": f"ANALYSIS CONTEXT: {code_context}\nUser's request type: {request_type}\nDetected intents: {', '.join(intents)}"
-            })
-        
-        # Add user context info for the AI to reference (only for personal conversations)
-        if request_type == 'general_chat':
-            context_summary = []
-            if user_context['name']:
-                context_summary.append(f"User's name: {user_context['name']}")
-            if user_context['mood_today']:
-                context_summary.append(f"User's mood today: {user_context['mood_today']}")
-            if user_context['current_projects']:
-                context_summary.append(f"Current projects: {', '.join(user_context['current_projects'])}")
-            
-            if context_summary:
-                context_message = "Personal context about the user: " + " | ".join(context_summary)
-                messages.append({"role": "system", "content": context_message})
-        
-        # Add conversation history with intelligent context selection
-        conversation_limit = get_conversation_limit(request_type)
-        recent_conversation = session['conversation'][-conversation_limit:]
-        
-        # Filter conversation to include only relevant context
-        filtered_conversation = filter_relevant_conversation(recent_conversation, request_type)
-        
-        for msg in filtered_conversation:
-            messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-
-        # Enhanced payload with better parameters for code generation
-        payload = {
-            "model": MODEL,
-            "messages": messages,
-            "max_tokens": 12000,  # Increased significantly for long code generation
-            "temperature": get_optimal_temperature(request_type, intents),
-            "top_p": 0.9,
-            "frequency_penalty": 0.1,
-            "presence_penalty": 0.1
-        }
-        
-        logger.info(f"Making request to OpenRouter API with {len(messages)} messages in context...")
-        logger.info(f"Request type: {request_type}, Temperature: {payload['temperature']}")
+        logger.info(f"Successfully generated AI response for {request_type} (approx {len(reply)} chars)")
+        return jsonify(chat_response_body(reply, chat_request))
+    
+    except UploadError as e:
+        return jsonify({"reply": f"⚠️ {e}"}), 400
+    
+    except GenerationExists as e:
+        return jsonify({"reply": f"⚠️ {e}"}), 409
+    
+    except GenerationError as e:
+        return jsonify({"reply": f"⚠️ {e}"}), 400
+    
+    except GenerationCancelled:
+        return jsonify(settle_cancelled(chat_request)), CANCELLED_STATUS
+    
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    
+    except (requests.exceptions.Timeout, FlightTimeout):
+        logger.error("Request timed out")
+        return jsonify({"reply": "⚠️ Request timed out. Please try again with a shorter request."}), 500
+    
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Request error: {e}")
+        return jsonify({"reply": "⚠️ Network error. Please check your connection and try again."}), 500
+    
+    except Exception as e:
+        logger.error(f"Unexpected error in chat endpoint: {e}")
+        return jsonify({"reply": "⚠️ Something went wrong. Please try again later."}), 500
+
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def iter_stream_deltas(response, usage=None):
+    """Yield content deltas from a routed OpenRouter streaming (SSE) response"""
+    for line in response.iter_lines():
+        delta = parse_stream_line(line, usage)
+        if delta is None:
+            break
+        if delta:
+            yield delta
+
+def relay_chat_stream(response, chat_request, sid):
+    """Relay upstream deltas to the browser, then record the assembled reply"""
+    request_type = chat_request['request_type']
+    intents = chat_request['intents']
+    generation = chat_request['generation']
+    parts = []
+    deltas = iter_reply_deltas(response, chat_request, parts)
+    replied = False
+    try:
+        flight = leading_flight(chat_request)
+        for delta in deltas:
+            if flight is not None:
+                flight.publish(delta)
+            yield sse_event('delta', {"content": delta})
+        record_stage('upstream_total', time.perf_counter() - chat_request['upstream_started'])
         
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=180  # Increased timeout for longer responses
-        )
+        # Post-process the assembled reply exactly like the non-streaming path
+        reply = finalize_reply(''.join(parts), request_type, intents)
         
-        logger.info(f"OpenRouter API response status: {response.status_code}")
+        # Written straight to the store: the cookie only holds the session id
+        with timed_stage('session_save'):
+            conversation_store.append_message(
+                sid, build_assistant_message(reply, request_type, response.model, chat_request['usage']))
+        account_usage(chat_request, sid, response.model)
+        store_cached_reply(chat_request, reply)
         
-        # Check if request was successful
-        if response.status_code != 200:
-            logger.error(f"OpenRouter API Error - Status Code: {response.status_code}")
-            logger.error(f"Response: {response.text}")
-            return jsonify({"reply": f"⚠️ API Error (Status {response.status_code}). Please try again later."}), 500
+        logger.info(f"Successfully streamed AI response for {request_type} (approx {len(reply)} chars)")
+        body = chat_response_body(reply, chat_request)
+        finish_flight(chat_request, 200, body, response.model)
+        replied = True
+        yield sse_event('done', body)
+    
+    except GenerationCancelled:
+        yield sse_event('cancelled', settle_cancelled(chat_request, parts, sid, response.model))
+    
+    except GeneratorExit:
+        # The client went away: stop generating a reply nobody will read
+        if not replied:
+            generation.cancel("disconnected")
+            settle_cancelled(chat_request, parts, sid, response.model)
+        raise
+    
+    except UpstreamStreamError as e:
+        logger.error(f"API Error during stream: {e}")
+        UPSTREAM_ERRORS.inc(code="stream_error")
+        yield stream_error_event(chat_request, f"⚠️ API Error: {e}")
+    
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Stream error: {e}")
+        UPSTREAM_ERRORS.inc(code=error_code(e))
+        yield stream_error_event(chat_request, "⚠️ Network error. Please check your connection and try again.")
+    
+    except Exception as e:
+        logger.error(f"Unexpected error while streaming: {e}")
+        yield stream_error_event(chat_request, "⚠️ Something went wrong. Please try again later.")
+    
+    finally:
+        deltas.close()
+        response.close()
+
+def stream_error_event(chat_request, error_reply):
+    """SSE error event ending a failed stream, also handed to coalesced subscribers"""
+    chat_request['stream_status'] = "stream_error"
+    body = {"reply": error_reply}
+    finish_flight(chat_request, 500, body)
+    return sse_event('error', body)
+
+def relay_coalesced_stream(chat_request, sid):
+    """Relay the deltas of the flight this stream subscribed to, then record its reply"""
+    flight = chat_request['flight']
+    streamed = False
+    try:
+        for delta in flight.updates(flight_group.timeout):
+            streamed = True
+            yield sse_event('delta', {"content": delta})
+    except FlightTimeout as e:
+        logger.error(f"Coalesced stream timed out: {e}")
+        chat_request['stream_status'] = "stream_error"
+        yield sse_event('error', {"reply": "⚠️ Request timed out. Please try again with a shorter request."})
+        return
+    
+    note_coalesced_reply(chat_request, flight)
+    if flight.status != 200:
+        chat_request['stream_status'] = "stream_error"
+        yield sse_event('error', flight.body)
+        return
+    
+    reply = flight.body['reply']
+    if not streamed:
+        # The leader was a non-streaming request
+        yield sse_event('delta', {"content": reply})
+    if chat_request['record_reply']:
+        with timed_stage('session_save'):
+            conversation_store.append_message(sid, build_assistant_message(reply, chat_request['request_type'], flight.model))
+    yield sse_event('done', flight.body)
+
+def cached_reply_stream(reply, chat_request):
+    """SSE body for a cache hit: the whole reply as one delta"""
+    yield sse_event('delta', {"content": reply})
+    yield sse_event('done', chat_response_body(reply, chat_request))
+
+@app.route("/chat/stream", methods=["POST"])
+@admission_controlled()
+def chat_stream():
+    """Stream the AI reply to the browser as Server-Sent Events"""
+    try:
+        user_input = chat_message()
+        logger.info(f"Received streaming chat request: {user_input[:100]}...")
         
-        data = response.json()
-        logger.info("Successfully parsed API response")
+        # Check if API key is available
+        if not OPENROUTER_API_KEY:
+            logger.error("OPENROUTER_API_KEY not found in environment variables")
+            return jsonify({"reply": "⚠️ API key not configured. Please contact the administrator."}), 500
         
-        # Check if the response has the expected structure
-        if "choices" not in data:
-            logger.error("'choices' key not found in response")
-            logger.error(f"Available keys: {list(data.keys())}")
-            
-            if "error" in data:
-                error_msg = data["error"].get("message", "Unknown API error")
-                logger.error(f"API Error: {error_msg}")
-                return jsonify({"reply": f"⚠️ API Error: {error_msg}"}), 500
-            
-            return jsonify({"reply": "⚠️ Unexpected API response format. Please try again."}), 500
+        chat_request = prepare_chat_request(user_input)
+        chat_request['payload']['stream'] = True
         
-        if not data["choices"] or len(data["choices"]) == 0:
-            logger.error("No choices in API response")
-            return jsonify({"reply": "⚠️ No response generated. Please try again."}), 500
+        cached_reply = lookup_cached_reply(chat_request)
+        if cached_reply is not None:
+            append_to_conversation(build_assistant_message(cached_reply, chat_request['request_type']))
+            return Response(
+                cached_reply_stream(cached_reply, chat_request),
+                mimetype='text/event-stream',
+                headers={"Cache-Control": "no-cache"}
+            )
         
-        reply = data["choices"][0]["message"]["content"]
+        if join_flight(chat_request):
+            flight = chat_request['flight']
+            flight.wait_started(flight_group.timeout)
+            if not flight.parts and flight.status not in (None, 200):
+                return jsonify(flight.body), flight.status
+            return Response(
+                stream_with_context(relay_coalesced_stream(chat_request, conversation_id())),
+                mimetype='text/event-stream',
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
         
-        # Post-process the reply for better formatting
-        reply = post_process_reply(reply, request_type, intents)
+        start_generation(chat_request)
+        chat_request['upstream_started'] = time.perf_counter()
+        response = post_upstream(chat_request)
+        record_stage('upstream_ttfb', response.ttfb)
         
-        # Add AI response to conversation history
-        session['conversation'].append({
-            "role": "assistant",
-            "content": reply,
-            "timestamp": datetime.now().isoformat(),
-            "metadata": {
-                "response_to": request_type,
-                "token_count": len(reply.split()) # Approximate token count
-            }
-        })
+        logger.info(f"OpenRouter API stream status: {response.status_code} from {response.model}")
+        note_upstream_response(chat_request, response.status_code, response.model)
         
-        # Save session
-        session.modified = True
+        if response.status_code != 200:
+            return jsonify({"reply": upstream_status_error(response.status_code, response.text)}), 500
         
-        logger.info(f"Successfully generated AI response for {request_type} (approx {len(reply)} chars)")
-        return jsonify({"reply": reply})
+        return Response(
+            stream_with_context(relay_chat_stream(response, chat_request, conversation_id())),
+            mimetype='text/event-stream',
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
     
-    except requests.exceptions.Timeout:
+    except UploadError as e:
+        return jsonify({"reply": f"⚠️ {e}"}), 400
+    
+    except GenerationExists as e:
+        return jsonify({"reply": f"⚠️ {e}"}), 409
+    
+    except GenerationError as e:
+        return jsonify({"reply": f"⚠️ {e}"}), 400
+    
+    except GenerationCancelled:
+        return jsonify(settle_cancelled(chat_request)), CANCELLED_STATUS
+    
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    
+    except UpstreamStreamError as e:
+        logger.error(f"API Error before first delta: {e}")
+        return jsonify({"reply": f"⚠️ API Error: {e}"}), 500
+    
+    except (requests.exceptions.Timeout, FlightTimeout):
         logger.error("Request timed out")
         return jsonify({"reply": "⚠️ Request timed out. Please try again with a shorter request."}), 500
     
@@ -378,11 +1280,316 @@ def chat():
         return jsonify({"reply": "⚠️ Network error. Please check your connection and try again."}), 500
     
     except Exception as e:
-        logger.error(f"Unexpected error in chat endpoint: {e}")
+        logger.error(f"Unexpected error in chat stream endpoint: {e}")
         return jsonify({"reply": "⚠️ Something went wrong. Please try again later."}), 500
 
+@app.route("/chat/<generation_id>/cancel", methods=["POST"])
+def cancel_generation(generation_id):
+    """Stop a running generation of this session; its request ends with what was generated so far"""
+    if not generation_registry.cancel(generation_id, session.sid):
+        return jsonify({"error": "Generation not found"}), 404
+    return jsonify({"generation_id": generation_id, "cancelled": True}), 200
+
+def prepare_batch_request(prompt, context, session_id):
+    """The OpenRouter request for one prompt of a batch: classified like a chat message, but without history"""
+    timings = {}
+    with timed_stage('classification', timings):
+        code_blocks, intents, request_type = classify(prompt)
+
+    assembly_started = time.perf_counter()
+    messages = system_messages(request_type, intents, code_blocks)
+    if context:
+        messages.append({"role": "system", "content": f"Shared context for every prompt of this batch:\n{context}"})
+    messages, prompt_tokens = assemble_prompt(messages, [{"role": "user", "content": prompt}], request_type)
+    record_stage('prompt_assembly', time.perf_counter() - assembly_started, timings)
+    PROMPT_TOKENS.observe(prompt_tokens, request_type=request_type)
+
+    return build_chat_request(messages, request_type, intents, prompt_tokens, session_id, timings)
+
+def run_batch_prompt(prompt, context, generation, session_id):
+    """Answer one prompt of a batch; raises RateLimited on a 429 and ItemError for other failed replies"""
+    generation.check()
+    chat_request = prepare_batch_request(prompt, context, session_id)
+    request_type = chat_request['request_type']
+
+    cached_reply = lookup_cached_reply(chat_request)
+    if cached_reply is not None:
+        return {"reply": cached_reply, "request_type": request_type, "cache": "hit"}
+
+    chat_request['generation'] = generation
+    response = post_upstream(chat_request)
+    try:
+        if response.status_code == 429:
+            raise RateLimited(parse_retry_after(response.headers.get("Retry-After")))
+        if response.status_code != 200:
+            raise ItemError(upstream_status_error(response.status_code, response.text))
+        reply, error_reply = read_completion_reply(response.json(), chat_request['usage'])
+    finally:
+        response.close()
+    if error_reply:
+        raise ItemError(error_reply)
+
+    reply = complete_reply(chat_request, reply)
+    generation.check()
+    reply = finalize_reply(reply, request_type, chat_request['intents'])
+    store_cached_reply(chat_request, reply)
+    account_usage(chat_request, None, response.model)
+    return {"reply": reply, "request_type": request_type, "model": response.model,
+            "usage": chat_request['usage'].as_dict()}
+
+def batch_error(error):
+    """(message, status) reported for a prompt of a batch that failed with error"""
+    if isinstance(error, GenerationCancelled):
+        return f"Generation {error.reason}", CANCELLED_STATUS
+    if isinstance(error, RateLimited):
+        return "⚠️ API Error: rate limited by the AI service. Please try again later.", 429
+    if isinstance(error, CircuitOpenError):
+        UPSTREAM_ERRORS.inc(code="circuit_open")
+        return "⚠️ API Error: the AI service is temporarily unavailable. Please try again in a few seconds.", 503
+    if isinstance(error, ItemError):
+        return str(error), 500
+    if isinstance(error, requests.exceptions.Timeout):
+        return "⚠️ Request timed out. Please try again with a shorter request.", 500
+    if isinstance(error, requests.exceptions.RequestException):
+        logger.error(f"Request error in batch: {error}")
+        return "⚠️ Network error. Please check your connection and try again.", 500
+    logger.error(f"Unexpected error in batch prompt: {error}")
+    return "⚠️ Something went wrong. Please try again later.", 500
+
+def batch_lines(prompts, context, concurrency, generation, session_id):
+    """NDJSON lines of a batch's replies in completion order, then the summary line.
+
+    A client that goes away cancels the batch: prompts not started yet are
+    skipped and the upstream calls in flight are aborted.
+    """
+    started = time.perf_counter()
+    fan_out = FanOut(lambda prompt: run_batch_prompt(prompt, context, generation, session_id),
+                     concurrency, batch_slots)
+    counts = {"prompts": len(prompts), "succeeded": 0, "failed": 0, "cached": 0}
+    totals = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    results = fan_out.results(prompts)
+    try:
+        for index, result, error, timings in results:
+            if error is not None:
+                message, status = batch_error(error)
+                counts["failed"] += 1
+                BATCH_PROMPTS.inc(outcome=str(status))
+                yield json.dumps({"index": index, "error": message, "status": status, "timings": timings}) + "\n"
+                continue
+            counts["succeeded"] += 1
+            counts["cached"] += result.get("cache") == "hit"
+            for field in totals:
+                totals[field] += result.get("usage", {}).get(field, 0)
+            BATCH_PROMPTS.inc(outcome="cached" if result.get("cache") == "hit" else "200")
+            yield json.dumps(dict(result, index=index, timings=timings)) + "\n"
+    except GeneratorExit:
+        generation.cancel("disconnected")
+        raise
+    finally:
+        results.close()
+    counts.update(rate_limited=fan_out.rate_limited, cancelled=generation.reason,
+                  duration_ms=round((time.perf_counter() - started) * 1000, 2), usage=totals)
+    logger.info(f"Batch {generation.id}: {counts['succeeded']} of {counts['prompts']} prompts answered "
+                f"in {counts['duration_ms']}ms")
+    yield json.dumps({"summary": counts}) + "\n"
+
+@app.route("/chat/batch", methods=["POST"])
+@admission_controlled("error")
+def chat_batch():
+    """Answer many independent prompts at once, streaming one NDJSON line per prompt as it finishes.
+
+    Body: {"prompts": ["...", ...], "context": "...", "concurrency": 8}.
+    Every prompt is classified and prompted like a /chat message, with the
+    optional shared context but without the conversation history, and its
+    reply is not added to the history. Each line is {"index", "reply",
+    "request_type", "model", "usage", "timings"} or {"index", "error",
+    "status", "timings"}, in completion order; a final {"summary"} line ends
+    the stream. The batch is a generation: POST /chat/<id>/cancel (id in the
+    X-Generation-Id header) stops it.
+    """
+    data = request.get_json(silent=True) or {}
+    prompts = data.get("prompts")
+    context = data.get("context") or ""
+    if not isinstance(prompts, list) or not prompts:
+        return jsonify({"error": "No prompts provided"}), 400
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return jsonify({"error": f"At most {BATCH_MAX_PROMPTS} prompts per batch"}), 413
+    if not all(isinstance(prompt, str) and prompt.strip() for prompt in prompts):
+        return jsonify({"error": "Each prompt must be a non-empty string"}), 400
+    if not isinstance(context, str):
+        return jsonify({"error": "context must be a string"}), 400
+    concurrency = data.get("concurrency", BATCH_CONCURRENCY)
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+        return jsonify({"error": "concurrency must be a positive integer"}), 400
+
+    if not OPENROUTER_API_KEY:
+        logger.error("OPENROUTER_API_KEY not found in environment variables")
+        return jsonify({"error": "API key not configured. Please contact the administrator."}), 500
+
+    try:
+        generation = generation_registry.start(data.get("generation_id"), session.sid, client_disconnected())
+    except GenerationExists as e:
+        return jsonify({"error": str(e)}), 409
+    except GenerationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    logger.info(f"Batch {generation.id}: {len(prompts)} prompts, concurrency {min(concurrency, BATCH_MAX_INFLIGHT)}")
+    response = Response(stream_with_context(batch_lines(prompts, context, min(concurrency, BATCH_MAX_INFLIGHT),
+                                                        generation, session.sid)),
+                        mimetype="application/x-ndjson")
+    response.headers['X-Generation-Id'] = generation.id
+    response.call_on_close(lambda: generation_registry.finish(generation))
+    return response
+
+@app.route("/jobs", methods=["POST"])
+@admission_controlled()
+def create_job():
+    """Start a chat reply as a background job and answer at once with its id"""
+    try:
+        user_input = chat_message()
+        if not user_input:
+            return jsonify({"reply": "No message provided"}), 400
+        logger.info(f"Received chat job: {user_input[:100]}...")
+        
+        if not OPENROUTER_API_KEY:
+            logger.error("OPENROUTER_API_KEY not found in environment variables")
+            return jsonify({"reply": "⚠️ API key not configured. Please contact the administrator."}), 500
+        
+        chat_request = prepare_chat_request(user_input)
+        chat_request['payload']['stream'] = True
+        sid = conversation_id()
+        job_id = job_runner.submit(session.sid, chat_request['request_type'],
+                                   lambda job: run_chat_job(job, chat_request, sid))
+        logger.info(f"Queued job {job_id} for {chat_request['request_type']}")
+        return jsonify({
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/jobs/{job_id}",
+            "stream_url": f"/jobs/{job_id}/stream"
+        }), 202
+    
+    except UploadError as e:
+        return jsonify({"reply": f"⚠️ {e}"}), 400
+    
+    except JobsFull:
+        logger.warning("Rejected chat job: every job slot is taken")
+        return jsonify({"reply": ADMISSION_MESSAGES[503]}), 503, {"Retry-After": "30"}
+    
+    except Exception as e:
+        logger.error(f"Unexpected error creating job: {e}")
+        return jsonify({"reply": "⚠️ Something went wrong. Please try again later."}), 500
+
+def run_chat_job(job, chat_request, sid):
+    """Generate a job's reply off the request thread and record it like chat_stream does; returns the job status"""
+    request_type = chat_request['request_type']
+    try:
+        reply = lookup_cached_reply(chat_request)
+        model = None
+        usage = None
+        if reply is not None:
+            job.publish(reply)
+        else:
+            upstream_started = time.perf_counter()
+            response = post_upstream(chat_request)
+            record_stage('upstream_ttfb', response.ttfb)
+            if response.status_code != 200:
+                error_reply = upstream_status_error(response.status_code, response.text)
+                response.close()
+                job.finish("error", {"reply": error_reply})
+                return "error"
+            for delta in iter_reply_deltas(response, chat_request, []):
+                job.publish(delta)
+            record_stage('upstream_total', time.perf_counter() - upstream_started)
+            model = response.model
+            usage = chat_request['usage']
+            reply = finalize_reply(''.join(job.parts), request_type, chat_request['intents'])
+            store_cached_reply(chat_request, reply)
+        
+        with timed_stage('session_save'):
+            conversation_store.append_message(sid, build_assistant_message(reply, request_type, model, usage))
+        if usage is not None:
+            account_usage(chat_request, sid, model)
+        job.finish("done", chat_response_body(reply, chat_request), model)
+        logger.info(f"Job {job.id} finished {request_type} (approx {len(reply)} chars)")
+        return "done"
+    
+    except CircuitOpenError as e:
+        job.finish("error", circuit_open_response(e)[0])
+    
+    except UpstreamStreamError as e:
+        logger.error(f"API Error during job {job.id}: {e}")
+        UPSTREAM_ERRORS.inc(code="stream_error")
+        job.finish("error", {"reply": f"⚠️ API Error: {e}"})
+    
+    except requests.exceptions.Timeout:
+        logger.error(f"Job {job.id} timed out")
+        job.finish("error", {"reply": "⚠️ Request timed out. Please try again with a shorter request."})
+    
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Request error in job {job.id}: {e}")
+        UPSTREAM_ERRORS.inc(code=error_code(e))
+        job.finish("error", {"reply": "⚠️ Network error. Please check your connection and try again."})
+    return "error"
+
+@app.route("/jobs/<job_id>")
+def get_job(job_id):
+    """A job's status and its output from ?offset= (characters already received) on"""
+    job = job_store.get(job_id, session.sid)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    content = job['content']
+    return jsonify({
+        "job_id": job_id,
+        "status": job['status'],
+        "request_type": job['request_type'],
+        "content": content[offset:],
+        "offset": len(content),
+        "result": job['body'] if job['status'] in FINISHED else None
+    }), 200
+
+def job_events(job_id, sid, offset):
+    """SSE deltas of a job from offset on, ending with its done or error event"""
+    while True:
+        job = job_store.get(job_id, sid)
+        if job is None:  # Deleted or expired while it was followed
+            yield sse_event('error', {"reply": "⚠️ This job no longer exists."})
+            return
+        content = job['content']
+        if len(content) > offset:
+            # The event id is the offset reached, so a reconnecting EventSource resumes from it
+            yield f"id: {len(content)}\n" + sse_event('delta', {"content": content[offset:]})
+            offset = len(content)
+        if job['status'] == "done":
+            yield sse_event('done', job['body'])
+            return
+        if job['status'] in FINISHED:
+            yield sse_event('error', job['body'] or {"reply": "⚠️ This request was interrupted. Please try again."})
+            return
+        time.sleep(JOBS_POLL_INTERVAL)
+
+@app.route("/jobs/<job_id>/stream")
+def stream_job(job_id):
+    """Follow a job as Server-Sent Events, resuming from ?offset= or Last-Event-ID"""
+    sid = session.sid
+    if job_store.get(job_id, sid) is None:
+        return jsonify({"error": "Job not found"}), 404
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        offset = request.headers.get("Last-Event-ID", 0, type=int)
+    return Response(
+        job_events(job_id, sid, max(offset, 0)),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 def get_enhanced_system_prompt(request_type, intents, code_blocks):
     """Generate enhanced system prompts based on request analysis"""
+    return system_prompt_for(request_type)
+
+@functools.lru_cache(maxsize=None)
+def system_prompt_for(request_type):
+    """System prompt of a request type, built once per process"""
     
     base_identity = """You are VibeCoding, an expert AI programming assistant with advanced debugging and code generation capabilities. You excel at:
 - Analyzing and debugging complex code issues
@@ -551,15 +1758,6 @@ def get_optimal_temperature(request_type, intents):
     else:
         return 0.7  # More creative for general chat
 
-def get_conversation_limit(request_type):
-    """Get appropriate conversation history limit based on request type"""
-    if request_type in ['debug_code', 'optimize_code']:
-        return 8  # Focus on recent debugging context
-    elif request_type in ['create_code', 'enhance_code']:
-        return 12  # Need more context for complex creation
-    else:
-        return 15  # Full context for general chat
-
 def filter_relevant_conversation(conversation, request_type):
     """Filter conversation history to keep only relevant messages"""
     # For debugging, prioritize recent messages with code
@@ -599,31 +1797,165 @@ def post_process_reply(reply, request_type, intents):
 
 @app.route("/clear-chat", methods=["POST"])
 def clear_chat():
-    """Clear conversation history"""
+    """Start a new conversation; the previous one stays listed and searchable"""
     try:
-        session['conversation'] = []
-        session.modified = True
+        if conversation_store.conversation_version(conversation_id())[1]:
+            session['conversation_id'] = conversation_store.create_conversation(session.sid)['id']
         return jsonify({"message": "Chat history cleared! 🧹✨ Ready for new coding challenges!"}), 200
     except Exception as e:
         logger.error(f"Error clearing chat: {e}")
         return jsonify({"error": "Failed to clear chat"}), 500
 
+@app.route("/conversations", methods=["GET"])
+def list_conversations():
+    """The session's conversations, most recently active first"""
+    limit = request.args.get("limit", 50, type=int)
+    if not 1 <= limit <= MAX_CONVERSATIONS_PAGE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_CONVERSATIONS_PAGE}"}), 400
+    try:
+        return jsonify({
+            "conversations": conversation_store.list_conversations(session.sid, limit),
+            "active": conversation_id()
+        }), 200
+    except Exception as e:
+        logger.error(f"Error listing conversations: {e}")
+        return jsonify({"error": "Failed to list conversations"}), 500
+
+@app.route("/conversations", methods=["POST"])
+def create_conversation():
+    """Start a new conversation, optionally titled, and open it"""
+    title = (request.get_json(silent=True) or {}).get("title")
+    if title is not None and not isinstance(title, str):
+        return jsonify({"error": "title must be a string"}), 400
+    try:
+        conversation = conversation_store.create_conversation(session.sid, (title or "").strip()[:TITLE_MAX_LENGTH] or None)
+        session['conversation_id'] = conversation['id']
+        return jsonify({"conversation": conversation}), 201
+    except Exception as e:
+        logger.error(f"Error creating conversation: {e}")
+        return jsonify({"error": "Failed to create conversation"}), 500
+
+@app.route("/conversations/search", methods=["GET"])
+def search_conversations():
+    """Messages of the session's conversations matching ?q=, best first, with highlighted snippets"""
+    query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", 20, type=int)
+    if not query:
+        return jsonify({"error": "No search query provided"}), 400
+    if not 1 <= limit <= MAX_SEARCH_RESULTS:
+        return jsonify({"error": f"limit must be between 1 and {MAX_SEARCH_RESULTS}"}), 400
+    try:
+        with timed_stage('search'):
+            results = conversation_store.search_messages(session.sid, query, limit)
+        return jsonify({"query": query, "results": results}), 200
+    except Exception as e:
+        logger.error(f"Error searching conversations: {e}")
+        return jsonify({"error": "Failed to search conversations"}), 500
+
+def owned_conversation(cid):
+    """The session's conversation with id cid, or None"""
+    return conversation_store.get_conversation(session.sid, cid)
+
+@app.route("/conversations/<cid>/open", methods=["POST"])
+def open_conversation(cid):
+    """Make a conversation the open one; /chat-history then returns its messages"""
+    conversation = owned_conversation(cid)
+    if conversation is None:
+        return jsonify({"error": "Conversation not found"}), 404
+    session['conversation_id'] = cid
+    return jsonify({"conversation": conversation}), 200
+
+@app.route("/conversations/<cid>", methods=["PATCH"])
+def rename_conversation(cid):
+    """Retitle a conversation"""
+    title = (request.get_json(silent=True) or {}).get("title")
+    if not isinstance(title, str) or not title.strip():
+        return jsonify({"error": "No title provided"}), 400
+    if not conversation_store.rename_conversation(session.sid, cid, title.strip()[:TITLE_MAX_LENGTH]):
+        return jsonify({"error": "Conversation not found"}), 404
+    return jsonify({"conversation": owned_conversation(cid)}), 200
+
+@app.route("/conversations/<cid>", methods=["DELETE"])
+def delete_conversation(cid):
+    """Delete a conversation and its messages; the session falls back to its first conversation if it was open"""
+    if not conversation_store.delete_conversation(session.sid, cid):
+        return jsonify({"error": "Conversation not found"}), 404
+    if session.get('conversation_id') == cid:
+        session.pop('conversation_id')
+    return jsonify({"deleted": cid, "active": conversation_id()}), 200
+
 @app.route("/chat-history", methods=["GET"])
 def chat_history():
-    """Get conversation history with metadata"""
+    """Get conversation history with metadata.
+    
+    ?limit=N returns the newest N messages and ?before=<id> pages back from a
+    message id (next_before is the cursor for the page before, null at the
+    start). ?fields=role,content keeps only those fields. Unchanged pages
+    answer If-None-Match with 304.
+    """
     try:
-        history = session.get('conversation', [])
+        limit = request.args.get("limit", type=int)
+        before = request.args.get("before", type=int)
+        fields = request.args.get("fields")
+        if limit is not None and not 1 <= limit <= MAX_HISTORY_PAGE:
+            return jsonify({"error": f"limit must be between 1 and {MAX_HISTORY_PAGE}"}), 400
+        if fields is not None:
+            fields = sorted(set(fields.split(",")))
+            unknown = set(fields) - HISTORY_FIELDS
+            if unknown:
+                return jsonify({"error": f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+        
+        # The ETag is derived without loading any message
+        user_context = session.get('user_context', {})
+        version = conversation_store.conversation_version(conversation_id())
+        etag = fingerprint(json.dumps([version, limit, before, fields, user_context], sort_keys=True).encode('utf-8'))
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+        
+        if limit is None and before is None:
+            history = get_conversation()
+            next_before = None
+        else:
+            # One extra row tells whether an older page exists
+            history = conversation_store.get_messages(conversation_id(), limit + 1 if limit else None, before)
+            next_before = None
+            if limit is not None and len(history) > limit:
+                history = history[1:]
+                next_before = history[0]['id']
+        if reply_renderer is not None and (fields is None or 'html' in fields):
+            # Replies stored before rendering was turned on
+            for message in history:
+                if message.get('role') == 'assistant' and 'html' not in message:
+                    message['html'] = render_reply(message['content'])
+        if fields is not None:
+            history = [{key: message[key] for key in ['id'] + fields if key in message} for message in history]
+        
         # Include metadata in response for debugging
         return jsonify({
             "history": history,
-            "total_messages": len(history),
-            "user_context": session.get('user_context', {})
-        }), 200
+            "conversation_id": conversation_id(),
+            "total_messages": version[1],
+            "next_before": next_before,
+            "user_context": user_context
+        }), 200, headers
     except Exception as e:
         logger.error(f"Error getting chat history: {e}")
         return jsonify({"error": "Failed to get chat history"}), 500
 
+@app.route("/usage", methods=["GET"])
+def get_usage():
+    """Tokens used by this session's replies, in total and per request type"""
+    if usage_ledger is None:
+        return jsonify({"error": "Usage accounting is turned off"}), 404
+    try:
+        return jsonify(usage_ledger.summary(session.sid)), 200
+    except Exception as e:
+        logger.error(f"Error getting usage: {e}")
+        return jsonify({"error": "Failed to get usage"}), 500
+
 @app.route("/analyze-code", methods=["POST"])
+@admission_controlled("error")
 def analyze_code():
     """Dedicated endpoint for code analysis"""
     try:
@@ -633,24 +1965,156 @@ def analyze_code():
         
         if not code:
             return jsonify({"error": "No code provided"}), 400
+        if len(code) > ANALYSIS_MAX_FILE_BYTES:
+            return jsonify({"error": f"Code larger than {ANALYSIS_MAX_FILE_BYTES} bytes"}), 413
         
-        # Quick code analysis
-        analysis = {
-            "line_count": len(code.split('\n')),
-            "character_count": len(code),
-            "estimated_complexity": "Low" if len(code) < 100 else "Medium" if len(code) < 500 else "High",
-            "language": language,
-            "has_functions": bool(re.search(r'def\s+\w+|function\s+\w+', code)),
-            "has_classes": bool(re.search(r'class\s+\w+', code)),
-            "has_imports": bool(re.search(r'import\s+\w+|#include', code))
-        }
-        
+        analysis, error = cached_analysis(code, language)
+        if error is not None:
+            return jsonify({"error": error}), 422
         return jsonify({"analysis": analysis}), 200
         
     except Exception as e:
         logger.error(f"Error in code analysis: {e}")
         return jsonify({"error": "Failed to analyze code"}), 500
 
+def cached_analysis(code, language):
+    """(analysis, error) of one file, cached by content hash.
+    
+    Files up to ANALYSIS_INLINE_MAX_BYTES are analyzed in the request thread,
+    which the linear-time analyzers finish in milliseconds, so a single call
+    never waits for the process pool to spawn. Larger ones run on the pool
+    like batches, so one pathological paste is cut off by the per-file
+    timeout instead of holding a request thread.
+    """
+    key = content_key(code, language)
+    analysis = analysis_cache.get(key)
+    if analysis is not None:
+        return analysis, None
+    if len(code) <= ANALYSIS_INLINE_MAX_BYTES:
+        analysis, error = analyze(code, language), None
+    else:
+        analysis, error = analysis_pool.analyze(code, language)
+    if error is None:
+        analysis_cache.set(key, analysis)
+    return analysis, error
+
+def analyze_files(files):
+    """Yield (path, analysis, error, cached) for (path, code, language, error) tuples.
+    
+    Cache hits are answered at once; the rest go to the process pool a chunk
+    of ANALYSIS_CHUNK_FILES at a time, so a large batch never holds more
+    than one chunk of sources in memory. Tuples with an error pass through.
+    """
+    pending = []
+    
+    def run_pending():
+        for index, analysis, error in analysis_pool.map([(code, language) for _, code, language in pending]):
+            path, code, language = pending[index]
+            if error is None:
+                analysis_cache.set(content_key(code, language), analysis)
+            yield path, analysis, error, False
+        pending.clear()
+    
+    for path, code, language, error in files:
+        if error is not None:
+            yield path, None, error, False
+            continue
+        analysis = analysis_cache.get(content_key(code, language))
+        if analysis is not None:
+            yield path, analysis, None, True
+            continue
+        pending.append((path, code, language))
+        if len(pending) >= ANALYSIS_CHUNK_FILES:
+            yield from run_pending()
+    yield from run_pending()
+
+def analysis_lines(files, counts):
+    """NDJSON lines of analyze_files() results, then the summary line"""
+    for path, analysis, error, cached in analyze_files(files):
+        if error is not None:
+            counts["errors"] += 1
+            yield json.dumps({"path": path, "error": error}) + "\n"
+        else:
+            counts["analyzed"] += 1
+            counts["cached"] += cached
+            yield json.dumps({"path": path, "analysis": analysis}) + "\n"
+    logger.info(f"Batch analysis: {counts['analyzed']} of {counts['files']} files ({counts['cached']} cached)")
+    yield json.dumps({"summary": counts}) + "\n"
+
+@app.route("/analyze-code/batch", methods=["POST"])
+@admission_controlled("error")
+def analyze_code_batch():
+    """Analyze many files at once, streaming one NDJSON line per file as it finishes.
+    
+    Body: {"files": [{"path": "app.py", "code": "...", "language": "auto"}, ...]}.
+    Each line is {"path", "analysis"} or {"path", "error"} (within each chunk
+    of files, cache hits come first, the rest in completion order); a final
+    {"summary"} line ends the stream.
+    """
+    data = request.get_json(silent=True) or {}
+    files = data.get("files")
+    if not isinstance(files, list) or not files:
+        return jsonify({"error": "No files provided"}), 400
+    if len(files) > ANALYSIS_BATCH_MAX_FILES:
+        return jsonify({"error": f"At most {ANALYSIS_BATCH_MAX_FILES} files per batch"}), 413
+    if not all(isinstance(f, dict) and isinstance(f.get("code"), str) for f in files):
+        return jsonify({"error": "Each file needs a \"code\" string"}), 400
+    
+    def entries():
+        for index, f in enumerate(files):
+            too_large = len(f["code"]) > ANALYSIS_MAX_FILE_BYTES
+            yield (f.get("path", str(index)), f["code"], f.get("language", "auto"),
+                   f"File larger than {ANALYSIS_MAX_FILE_BYTES} bytes" if too_large else None)
+    
+    counts = {"files": len(files), "analyzed": 0, "cached": 0, "errors": 0}
+    return Response(stream_with_context(analysis_lines(entries(), counts)), mimetype="application/x-ndjson")
+
+@app.route("/uploads", methods=["POST"])
+@admission_controlled("error")
+def create_upload():
+    """Store a zip archive of a project and stream back the analysis of each source file.
+    
+    The archive is the raw body (Content-Type: application/zip) or the
+    "archive" field of a multipart form. The first NDJSON line is
+    {"upload": manifest}, then one line per file as in /analyze-code/batch.
+    Files are attached to a chat message with "attachments": [{"upload_id",
+    "path"}].
+    """
+    if request.content_length is not None and request.content_length > upload_store.max_bytes + UPLOAD_FORM_OVERHEAD:
+        return jsonify({"error": f"Archives are limited to {upload_store.max_bytes / (1024 * 1024):g} MB"}), 413
+    try:
+        if request.mimetype == "multipart/form-data":
+            # Werkzeug spools form files to disk past 500 KB and stops reading at the limit
+            request.max_content_length = upload_store.max_bytes + UPLOAD_FORM_OVERHEAD
+            archive = request.files.get("archive")
+            if archive is None:
+                return jsonify({"error": "No archive provided"}), 400
+            manifest = upload_store.save(archive.stream, session.sid, archive.filename)
+        else:
+            manifest = upload_store.save(request.stream, session.sid)
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({"error": str(e) if isinstance(e, UploadTooLarge) else "Archive too large"}), 413
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
+    session.modified = True  # Uploads belong to the session: make sure it has a cookie
+    
+    upload = {key: manifest[key] for key in ("id", "name", "size", "files")}
+    counts = {"files": len(manifest["files"]), "analyzed": 0, "cached": 0, "errors": 0}
+    
+    def generate():
+        yield json.dumps({"upload": upload}) + "\n"
+        yield from analysis_lines(upload_store.iter_files(manifest["id"]), counts)
+    
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/uploads/<upload_id>")
+def get_upload(upload_id):
+    """An upload's source file list"""
+    manifest = upload_store.manifest(upload_id, session.sid)
+    if manifest is None:
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify({key: manifest[key] for key in ("id", "name", "size", "created_at", "files")}), 200
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -661,6 +2125,69 @@ def internal_error(error):
     logger.error(f"Internal server error: {error}")
     return jsonify({"error": "Internal server error - Enhanced VibeCoding"}), 500
 
+# Startup: gunicorn.conf.py preloads create_app() in the master and calls warm_up_worker() in every worker
+
+SYSTEM_PROMPT_TYPES = ("debug_code", "optimize_code", "explain_code", "enhance_code", "create_code", "analyze_code",
+                       "general_chat")
+WARM_UP_MESSAGES = [
+    "fix this bug ```python\ndef add(a, b):\n    return a - b\n```",
+    "explain how this works ```javascript\nconst total = items.reduce((sum, x) => sum + x.price, 0);\n```",
+    "write a function that parses ISO dates",
+    "hey, how's it going?",
+]
+# Pygments lexers imported ahead of the first reply that needs them
+WARM_UP_LANGUAGES = ("python", "javascript", "typescript", "java", "cpp", "csharp", "go", "rust", "html", "css",
+                     "bash", "sql", "json")
+
+def warm_up():
+    """Do the first request's one-time work ahead of it.
+    
+    Renders the home page (compiling index.html), builds every system
+    prompt, and runs the classifier, reply post-processing and the renderer
+    over sample messages, which compiles their regexes and imports the
+    Pygments lexers. Nothing here owns a thread, socket or connection, so
+    it can run in the gunicorn master and be shared with the workers.
+    """
+    started = time.perf_counter()
+    with app.app_context():
+        home_page.get()
+    for request_type in SYSTEM_PROMPT_TYPES:
+        system_prompt_for(request_type)
+    for message in WARM_UP_MESSAGES:
+        code_blocks, intents, request_type = classify(message)
+        code_block_references(code_blocks)
+        estimate_tokens(message)
+        post_process_reply(message, request_type, intents)
+    if reply_renderer is not None:
+        render_markdown("\n".join(WARM_UP_MESSAGES) + "".join(f"\n```{language}\nx\n```" for language in WARM_UP_LANGUAGES))
+    logger.info(f"Warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def warm_up_worker(preconnect=True):
+    """Per-worker warm-up in the background: open the stores and an upstream connection"""
+    def run():
+        for component in (conversation_store, response_cache, flight_group, event_log, generation_registry,
+                          usage_ledger, token_budget):
+            if component is not None:  # Turned off by its setting
+                component.instance()
+        if preconnect and UPSTREAM_PRECONNECT:
+            upstream_client.preconnect()
+
+    threading.Thread(target=run, name="worker-warm-up", daemon=True).start()
+
+def create_app():
+    """The Flask app, warmed up unless WARM_UP=0; gunicorn loads it as "app:create_app()".
+    
+    Routes and settings are registered at import. The stores, caches,
+    background threads and the upstream connection pool are Lazy and built
+    in each process on first use, so the app can be loaded in the gunicorn
+    master (preload_app) and forked. The asset bundle is loaded (and built if
+    stale) here rather than at import, once in the master when preloading.
+    """
+    asset_bundle.load()
+    if os.getenv("WARM_UP", "1") == "1":
+        warm_up()
+    return app
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=False)
+    create_app().run(host="0.0.0.0", port=port, debug=False)
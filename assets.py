@@ -0,0 +1,219 @@
+"""Fingerprinted, precompressed UI bundle.
+
+static/style.css and static/script.js are the sources. build() minifies each
+one, names the output after a hash of its content (style.1f3a9c0e2b7d.css),
+writes gzip and (with the brotli package installed) brotli variants next to it
+in static/dist/ and records the names in static/dist/manifest.json. Because a
+name changes whenever the content does, the files are served with a one-year
+immutable Cache-Control and the browser never asks for them again.
+
+    python assets.py        # build at deploy time
+
+Importing the app does not touch static/dist: the bundle is loaded on first
+use, which create_app() (the gunicorn entry point, run once in the master
+when preloading) triggers while warming up. It is built then if the manifest
+is missing or older than a source, so a plain checkout works without the
+step. Every build deletes the outputs its manifest no longer lists.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are built
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("style.css", "script.js")
+
+CONTENT_TYPES = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+}
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def minify_css(text):
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    # Not around ':' or '>' etc.: "a :hover" and "a:hover" are different selectors
+    text = re.sub(r"\s*([{};,])\s*", r"\1", text)
+    return text.replace(";}", "}").strip()
+
+
+def minify_js(text):
+    """Drop indentation, blank lines and whole-line comments, leaving template literals as they are"""
+    out = []
+    in_template = False
+    for line in text.split('\n'):
+        if not in_template:
+            line = line.strip()
+            if not line or line.startswith('//'):
+                continue
+        out.append(line)
+        if (line.count('`') - line.count('\\`')) % 2:
+            in_template = not in_template
+    return '\n'.join(out) + '\n'
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js}
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(static_dir):
+    """Minify, fingerprint and precompress every source; returns the manifest"""
+    dist_dir = os.path.join(static_dir, "dist")
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest = {}
+    for name in SOURCES:
+        stem, ext = os.path.splitext(name)
+        with open(os.path.join(static_dir, name), encoding='utf-8') as f:
+            data = MINIFIERS[ext](f.read()).encode('utf-8')
+        built = f"{stem}.{fingerprint(data)}{ext}"
+        path = os.path.join(dist_dir, built)
+        if not os.path.exists(path):
+            write_atomic(path, data)
+            write_atomic(path + ".gz", gzip.compress(data, 9, mtime=0))
+            if brotli is not None:
+                write_atomic(path + ".br", brotli.compress(data, quality=11))
+        manifest[name] = built
+    write_atomic(os.path.join(dist_dir, "manifest.json"), json.dumps(manifest, indent=2).encode('utf-8'))
+    prune(dist_dir, manifest)
+    logger.info(f"Built UI bundle: {', '.join(manifest.values())}")
+    return manifest
+
+
+def prune(dist_dir, manifest):
+    """Delete earlier builds, and their compressed variants, that manifest no longer lists"""
+    keep = set(manifest.values())
+    for name in os.listdir(dist_dir):
+        if name == "manifest.json" or name.endswith(".tmp"):  # .tmp: another process's build in progress
+            continue
+        if re.sub(r"\.(gz|br)$", "", name) not in keep:
+            try:
+                os.remove(os.path.join(dist_dir, name))
+            except FileNotFoundError:
+                pass
+
+
+def load_manifest(static_dir):
+    """The built manifest, rebuilding first when it is missing or a source is newer"""
+    path = os.path.join(static_dir, "dist", "manifest.json")
+    try:
+        built_at = os.path.getmtime(path)
+        if all(os.path.getmtime(os.path.join(static_dir, name)) <= built_at for name in SOURCES):
+            with open(path) as f:
+                manifest = json.load(f)
+            if all(os.path.exists(os.path.join(static_dir, "dist", manifest.get(name, ""))) for name in SOURCES):
+                return manifest
+    except (OSError, ValueError):
+        pass
+    return build(static_dir)
+
+
+class AssetBundle:
+    """Built assets held in memory with their precompressed variants, loaded on first use"""
+
+    def __init__(self, static_dir, url_prefix="/assets"):
+        self.static_dir = static_dir
+        self.dist_dir = os.path.join(static_dir, "dist")
+        self.url_prefix = url_prefix
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """(manifest, files), building the bundle first if it is missing or stale"""
+        if self._loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    manifest = load_manifest(self.static_dir)
+                    files = {}
+                    for built in manifest.values():
+                        variants = {}
+                        for encoding, suffix in (("identity", ""),) + ENCODINGS:
+                            try:
+                                with open(os.path.join(self.dist_dir, built + suffix), 'rb') as f:
+                                    variants[encoding] = f.read()
+                            except FileNotFoundError:
+                                continue
+                        files[built] = variants
+                    self._loaded = manifest, files
+        return self._loaded
+
+    def url(self, name):
+        manifest, _ = self.load()
+        return f"{self.url_prefix}/{manifest[name]}"
+
+    def get(self, built):
+        """Return (variants, etag, content_type) of a built file, or None"""
+        _, files = self.load()
+        variants = files.get(built)
+        if variants is None:
+            return None
+        return variants, built.rsplit('.', 2)[-2], CONTENT_TYPES[os.path.splitext(built)[1]]
+
+
+class CachedPage:
+    """A page rendered once per process, kept with its compressed variants and ETag"""
+
+    def __init__(self, render):
+        self.render = render
+        self.page = None
+
+    def get(self):
+        """Return (variants, etag), rendering on first use"""
+        if self.page is None:
+            html = self.render().encode('utf-8')
+            variants = {"identity": html, "gzip": gzip.compress(html, 9, mtime=0)}
+            if brotli is not None:
+                variants["br"] = brotli.compress(html, quality=11)
+            self.page = variants, fingerprint(html)
+        return self.page
+
+
+def pick_variant(variants, accept_encodings):
+    """(body, content_encoding) of the best variant the client accepts"""
+    for encoding, _ in ENCODINGS:
+        if encoding in variants and accept_encodings.quality(encoding):
+            return variants[encoding], encoding
+    return variants["identity"], None
+
+
+def pick_encoding(accept_encodings):
+    """Best encoding the client accepts that can be produced on the fly, or None"""
+    for encoding, _ in ENCODINGS:
+        if (encoding != "br" or brotli is not None) and accept_encodings.quality(encoding):
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    """On-the-fly compression, with faster settings than the build's"""
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, 6)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
@@ -0,0 +1,117 @@
+"""Bounded fan-out of the prompts of a /chat/batch request.
+
+A batch runs its items on at most `concurrency` threads of its own, and
+every item also takes one of the worker's upstream slots while it runs, so
+several scripts batching at once share a fixed number of upstream calls.
+Results are handed back as items finish, not in input order.
+
+An item still rate-limited once the upstream client's own retries are spent
+raises RateLimited: the whole batch then waits out the Retry-After before
+starting anything else, and the item is tried again (up to
+rate_limit_retries times), instead of every thread hammering a rate-limited
+upstream.
+"""
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """The upstream kept answering 429 for an item"""
+
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited by the upstream")
+        self.retry_after = retry_after
+
+
+class ItemError(Exception):
+    """An item that failed; the message is shown to the user"""
+
+
+class FanOut:
+    """Runs run(item) for every item of one batch on a few threads"""
+
+    def __init__(self, run, concurrency, slots=None, rate_limit_retries=2, default_retry_after=5.0):
+        self.run = run
+        self.concurrency = max(1, concurrency)
+        self.slots = slots  # Semaphore shared by all batches of the worker
+        self.rate_limit_retries = rate_limit_retries
+        self.default_retry_after = default_retry_after
+        self.rate_limited = 0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def results(self, items):
+        """Yield (index, result, error, timings) as items finish; error is the exception run() raised.
+
+        Closing the generator stops the batch: items not started yet never are.
+        """
+        items = list(items)
+        pending = iter(enumerate(items))
+        done = queue.Queue()
+        started = time.perf_counter()
+
+        def work():
+            while not self._stopped.is_set():
+                with self._lock:
+                    entry = next(pending, None)
+                if entry is None:
+                    return
+                result = self._run(*entry, started)
+                if result is not None:
+                    done.put(result)
+
+        for n in range(min(self.concurrency, len(items))):
+            threading.Thread(target=work, name=f"batch-{n}", daemon=True).start()
+        try:
+            for _ in range(len(items)):
+                yield done.get()
+        finally:
+            self._stopped.set()
+
+    def _run(self, index, item, batch_started):
+        attempts = 0
+        while True:
+            self._wait_resume()
+            if self.slots is not None:
+                self.slots.acquire()
+            try:
+                if self._stopped.is_set():
+                    return None
+                if attempts == 0:
+                    item_started = time.perf_counter()
+                try:
+                    return index, self.run(item), None, self._timings(batch_started, item_started)
+                except RateLimited as e:
+                    attempts += 1
+                    if attempts > self.rate_limit_retries:
+                        return index, None, e, self._timings(batch_started, item_started)
+                    self._pause(e.retry_after or self.default_retry_after)
+                except Exception as e:
+                    return index, None, e, self._timings(batch_started, item_started)
+            finally:
+                if self.slots is not None:
+                    self.slots.release()
+
+    @staticmethod
+    def _timings(batch_started, item_started):
+        now = time.perf_counter()
+        return {
+            "queued_ms": round((item_started - batch_started) * 1000, 2),
+            "duration_ms": round((now - item_started) * 1000, 2),
+        }
+
+    def _pause(self, seconds):
+        with self._lock:
+            self.rate_limited += 1
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        logger.warning(f"Batch rate limited, pausing it for {seconds:.1f}s")
+
+    def _wait_resume(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            self._stopped.wait(delay)
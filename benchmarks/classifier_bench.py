@@ -0,0 +1,218 @@
+"""Micro-benchmark: single-pass classifier vs the original extract/detect/analyze cascade.
+
+    python benchmarks/classifier_bench.py
+
+Each input is run through the original per-request sequence (extract, detect,
+analyze, as chat() used to call them) and through classifier.classify, checks
+that both agree and prints the mean time per message.
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classifier import classify, classify_batch  # noqa: E402
+
+
+# --- Original implementation from app.py, kept verbatim as the baseline ---
+
+def extract_code_from_message(message):
+    """Extract code blocks from user message for analysis"""
+    code_blocks = []
+    # Match code blocks with language specification
+    pattern = r'```(\w*)\n(.*?)```'
+    matches = re.findall(pattern, message, re.DOTALL)
+    
+    for language, code in matches:
+        code_blocks.append({
+            'language': language or 'text',
+            'code': code.strip()
+        })
+    
+    # Also check for inline code or code without proper formatting
+    if not code_blocks:
+        # Look for common code patterns
+        code_patterns = [
+            r'def\s+\w+\([^)]*\):\s*\n',  # Python functions
+            r'function\s+\w+\([^)]*\)\s*{',  # JavaScript functions
+            r'class\s+\w+[\s\S]*?{',  # Class definitions
+            r'import\s+\w+',  # Import statements
+            r'from\s+\w+\s+import',  # Python imports
+            r'#include\s*<[^>]+>',  # C/C++ includes
+            r'public\s+class\s+\w+',  # Java classes
+        ]
+        
+        for pattern in code_patterns:
+            if re.search(pattern, message, re.MULTILINE):
+                # Extract potential code block
+                lines = message.split('\n')
+                code_lines = []
+                in_code = False
+                
+                for line in lines:
+                    if re.search(pattern, line) or in_code:
+                        in_code = True
+                        code_lines.append(line)
+                        # Simple heuristic to end code block
+                        if line.strip() == '' and len(code_lines) > 5:
+                            break
+                
+                if code_lines:
+                    code_blocks.append({
+                        'language': 'auto-detected',
+                        'code': '\n'.join(code_lines)
+                    })
+                break
+    
+    return code_blocks
+
+def analyze_code_intent(user_input, code_blocks):
+    """Analyze what the user wants to do with the code"""
+    user_input_lower = user_input.lower()
+    
+    # Debug/fix indicators
+    debug_keywords = [
+        'fix', 'debug', 'error', 'bug', 'broken', 'not working', 'issue', 
+        'problem', 'wrong', 'incorrect', 'doesn\'t work', 'failed', 
+        'exception', 'crash', 'syntax error', 'runtime error'
+    ]
+    
+    # Optimization indicators
+    optimize_keywords = [
+        'optimize', 'improve', 'better', 'faster', 'efficient', 'performance',
+        'refactor', 'clean up', 'make it better'
+    ]
+    
+    # Explanation indicators
+    explain_keywords = [
+        'explain', 'what does', 'how does', 'understand', 'break down',
+        'step by step', 'walk through'
+    ]
+    
+    # Enhancement indicators
+    enhance_keywords = [
+        'add', 'extend', 'modify', 'change', 'update', 'enhance',
+        'feature', 'functionality', 'new'
+    ]
+    
+    # Creation indicators
+    create_keywords = [
+        'create', 'make', 'build', 'write', 'generate', 'develop',
+        'code for', 'function for', 'script for'
+    ]
+    
+    intents = []
+    
+    if any(keyword in user_input_lower for keyword in debug_keywords):
+        intents.append('debug')
+    
+    if any(keyword in user_input_lower for keyword in optimize_keywords):
+        intents.append('optimize')
+    
+    if any(keyword in user_input_lower for keyword in explain_keywords):
+        intents.append('explain')
+    
+    if any(keyword in user_input_lower for keyword in enhance_keywords):
+        intents.append('enhance')
+    
+    if any(keyword in user_input_lower for keyword in create_keywords):
+        intents.append('create')
+    
+    # If code is provided but no clear intent, assume debug/fix
+    if code_blocks and not intents:
+        intents.append('debug')
+    
+    # If no code and no clear intent, assume creation
+    if not code_blocks and not intents:
+        intents.append('create')
+    
+    return intents
+
+def detect_request_type(user_input):
+    """Enhanced request type detection"""
+    code_blocks = extract_code_from_message(user_input)
+    intents = analyze_code_intent(user_input, code_blocks)
+    
+    # Determine primary request type based on intents and content
+    if 'debug' in intents and code_blocks:
+        return 'debug_code'
+    elif 'optimize' in intents and code_blocks:
+        return 'optimize_code'
+    elif 'explain' in intents and code_blocks:
+        return 'explain_code'
+    elif 'enhance' in intents and code_blocks:
+        return 'enhance_code'
+    elif 'create' in intents or any(word in user_input.lower() for word in ['write', 'create', 'make', 'build']):
+        return 'create_code'
+    elif code_blocks:
+        return 'analyze_code'
+    else:
+        return 'general_chat'
+
+
+def legacy_classify(user_input):
+    """The sequence chat() ran on every message before the classifier"""
+    code_blocks = extract_code_from_message(user_input)
+    request_type = detect_request_type(user_input)
+    intents = analyze_code_intent(user_input, code_blocks)
+    return code_blocks, intents, request_type
+
+
+# --- Inputs ---
+
+PYTHON_CLASS = (
+    "class Handler{i}:\n"
+    "    \"\"\"Request handler number {i}\"\"\"\n\n"
+    "    def handle(self, request):\n"
+    "        if request.method == 'POST':\n"
+    "            return self.process(request.data)\n"
+    "        return None\n\n"
+)
+JS_FUNCTION = "function handler{i}(req, res) {{\n  const data = req.body;\n  return res.json(data);\n}}\n\n"
+PROSE = "We have a class of problems here that keeps coming back when the service is under load. "
+
+
+def build_inputs(target_size=100_000):
+    python_source = ''.join(PYTHON_CLASS.format(i=i) for i in range(target_size // len(PYTHON_CLASS) + 1))
+    js_source = ''.join(JS_FUNCTION.format(i=i) for i in range(target_size // len(JS_FUNCTION) + 1))
+    prose = PROSE * (target_size // len(PROSE) + 1)
+    return {
+        "fenced python + question": f"Why is this slow?\n```python\n{python_source}```",
+        "unfenced python file": f"please look at this\n{python_source}",
+        "unfenced javascript file": f"fix this\n{js_source}",
+        "long prose": prose,
+        "short chat message": "Hey! Can you explain how does a Python decorator work?",
+    }
+
+
+def mean_ms(func, message, budget=2.0, max_runs=50):
+    """Mean wall time of func(message) in ms, stopping after ~budget seconds"""
+    runs = 0
+    started = time.perf_counter()
+    while runs < max_runs:
+        func(message)
+        runs += 1
+        if time.perf_counter() - started > budget:
+            break
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def main():
+    inputs = build_inputs()
+    print(f"{'input':<28} {'size':>8} {'original ms':>12} {'classifier ms':>14} {'speedup':>9}")
+    for name, message in inputs.items():
+        assert legacy_classify(message) == tuple(classify(message)), f"results differ for {name}"
+        original = mean_ms(legacy_classify, message)
+        single_pass = mean_ms(classify, message)
+        print(f"{name:<28} {len(message):>8} {original:>12.2f} {single_pass:>14.2f} {original / single_pass:>8.1f}x")
+
+    batch = [inputs["short chat message"], inputs["fenced python + question"]] * 50
+    started = time.perf_counter()
+    classify_batch(batch)
+    print(f"\nclassify_batch of {len(batch)} messages: {(time.perf_counter() - started) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
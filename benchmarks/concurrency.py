@@ -0,0 +1,119 @@
+"""Concurrent-capacity load test: sync gunicorn worker vs the aiohttp worker.
+
+    python benchmarks/concurrency.py --concurrency 200 --latency 2
+
+Starts the fake upstream, then for each serving mode boots one gunicorn worker,
+fires N simultaneous /chat requests and probes /health while they are waiting.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "sync": ["gunicorn", "app:app", "--worker-class", "sync"],
+    "async": ["gunicorn", "aio_app:app", "--worker-class", "aiohttp.GunicornWebWorker"],
+}
+
+
+async def wait_until_up(url, timeout=20):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as client:
+        while time.monotonic() < deadline:
+            try:
+                async with client.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def run_load(base_url, concurrency, request_timeout):
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as client:
+
+        async def one_chat():
+            started = time.monotonic()
+            try:
+                async with client.post(f"{base_url}/chat", json={"message": "fix my add function"}) as response:
+                    await response.read()
+                    return response.status == 200, time.monotonic() - started
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False, time.monotonic() - started
+
+        async def probe_health():
+            await asyncio.sleep(0.5)
+            started = time.monotonic()
+            try:
+                async with client.get(f"{base_url}/health") as response:
+                    await response.read()
+                    return response.status == 200, time.monotonic() - started
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False, time.monotonic() - started
+
+        started = time.monotonic()
+        results, health = await asyncio.gather(
+            asyncio.gather(*(one_chat() for _ in range(concurrency))),
+            probe_health(),
+        )
+        wall = time.monotonic() - started
+
+    ok = [elapsed for success, elapsed in results if success]
+    return {
+        "completed": len(ok),
+        "failed": concurrency - len(ok),
+        "wall_s": wall,
+        "max_latency_s": max(ok) if ok else float('nan'),
+        "health_ok": health[0],
+        "health_latency_s": health[1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=2.0, help="fake upstream latency in seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--upstream-port", type=int, default=8900)
+    args = parser.parse_args()
+
+    upstream = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "fake_openrouter.py"),
+                                 "--port", str(args.upstream_port), "--latency", str(args.latency)])
+    env = dict(os.environ,
+               OPENROUTER_API_KEY="benchmark",
+               OPENROUTER_API_URL=f"http://127.0.0.1:{args.upstream_port}/api/v1/chat/completions")
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        print(f"{args.concurrency} concurrent /chat requests, upstream latency {args.latency}s, 1 worker\n")
+        print(f"{'mode':<6} {'ok':>5} {'failed':>6} {'wall s':>8} {'max s':>8} {'/health':>10}")
+        for mode, command in MODES.items():
+            server = subprocess.Popen(command + ["--bind", f"127.0.0.1:{args.port}", "--workers", "1",
+                                                 "--timeout", "300", "--log-level", "warning"],
+                                      cwd=ROOT, env=env)
+            try:
+                asyncio.run(wait_until_up(f"{base_url}/health"))
+                stats = asyncio.run(run_load(base_url, args.concurrency, args.timeout))
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait()
+            health = f"{stats['health_latency_s']:.2f}s" if stats['health_ok'] else "timeout"
+            print(f"{mode:<6} {stats['completed']:>5} {stats['failed']:>6} {stats['wall_s']:>8.2f} "
+                  f"{stats['max_latency_s']:>8.2f} {health:>10}")
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+
+if __name__ == "__main__":
+    main()
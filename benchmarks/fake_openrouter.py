@@ -0,0 +1,187 @@
+"""Local stand-in for the OpenRouter chat completions API.
+
+    python benchmarks/fake_openrouter.py --port 8900 --latency 2.0
+    python benchmarks/fake_openrouter.py --latency 1.5 --latency-dist lognormal --sigma 0.8 \\
+        --tokens-per-second 40 --error-rate 0.02 --rate-limit-rate 0.05
+
+Point the app at it with OPENROUTER_API_URL=http://127.0.0.1:8900/api/v1/chat/completions
+
+Latency is the time to the first token; streamed replies then arrive at
+--tokens-per-second (non-streamed replies wait for the whole generation).
+Replies honour the request's max_tokens (finish_reason "length"), continue a
+trailing assistant message (prefill) and carry a usage block like the real
+API.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+REPLY = "Here is the fix:\n\n```python\ndef add(a, b):\n    return a + b\n```\n\nThe original code returned the wrong variable."
+
+RETRYABLE_ERRORS = (500, 502, 503)
+
+
+class Behaviour:
+    """Latency, throughput and failure settings of the fake upstream"""
+
+    def __init__(self, args):
+        self.latency = args.latency
+        self.latency_dist = args.latency_dist
+        self.sigma = args.sigma
+        self.model_latency = dict(args.model_latency or [])
+        self.tokens_per_second = args.tokens_per_second
+        self.reply_tokens = args.reply_tokens
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.stream_error_rate = args.stream_error_rate
+        self.max_concurrency = args.max_concurrency
+        self.random = random.Random(args.seed)
+        self.in_flight = 0
+        self.served = 0
+
+    def first_token_delay(self, model):
+        mean = self.model_latency.get(model, self.latency)
+        if self.latency_dist == 'uniform':
+            return self.random.uniform(mean * (1 - self.sigma), mean * (1 + self.sigma))
+        if self.latency_dist == 'exponential':
+            return self.random.expovariate(1 / mean) if mean > 0 else 0.0
+        if self.latency_dist == 'lognormal':
+            # Median `mean`, long right tail controlled by sigma (free-tier style)
+            return mean * self.random.lognormvariate(0, self.sigma)
+        return mean
+
+    def reply_words(self):
+        if not self.reply_tokens:
+            return REPLY.split(' ')
+        words = (REPLY + ' ') * (self.reply_tokens // len(REPLY.split(' ')) + 1)
+        return words.split(' ')[:self.reply_tokens]
+
+    def token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+
+def usage_block(payload, completion_tokens):
+    prompt_chars = sum(len(m.get('content') or '') for m in payload.get('messages', []))
+    prompt_tokens = prompt_chars // 4 + 4 * len(payload.get('messages', []))
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def error_response(status, message, retry_after=None):
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+    return web.json_response({"error": {"code": status, "message": message}}, status=status, headers=headers)
+
+
+async def chat_completions(request):
+    behaviour = request.app['behaviour']
+    payload = await request.json()
+    model = payload.get('model', '')
+
+    if behaviour.max_concurrency and behaviour.in_flight >= behaviour.max_concurrency:
+        return error_response(429, "Rate limit exceeded: too many concurrent requests", retry_after=1)
+    if behaviour.random.random() < behaviour.rate_limit_rate:
+        return error_response(429, "Rate limit exceeded: free-models-per-min", retry_after=1)
+    if behaviour.random.random() < behaviour.error_rate:
+        return error_response(behaviour.random.choice(RETRYABLE_ERRORS), "Provider returned error")
+
+    behaviour.in_flight += 1
+    try:
+        return await generate(request, behaviour, payload, model)
+    finally:
+        behaviour.in_flight -= 1
+        behaviour.served += 1
+
+
+async def generate(request, behaviour, payload, model):
+    words = behaviour.reply_words()
+    messages = payload.get('messages') or []
+    if messages and messages[-1].get('role') == 'assistant':
+        # Assistant prefill: go on after the part of the reply already written
+        words = words[len(messages[-1]['content'].split()):]
+    max_tokens = payload.get('max_tokens')
+    finish_reason = "stop"
+    if max_tokens and len(words) > max_tokens:
+        words = words[:max_tokens]
+        finish_reason = "length"
+    delay = behaviour.first_token_delay(model)
+
+    if not payload.get('stream'):
+        await asyncio.sleep(delay + behaviour.token_delay() * len(words))
+        return web.json_response({
+            "id": f"gen-{time.time_ns()}",
+            "model": model,
+            "choices": [{"message": {"role": "assistant", "content": ' '.join(words)}, "finish_reason": finish_reason}],
+            "usage": usage_block(payload, len(words)),
+        })
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    # OpenRouter sends keep-alive comments while the model is queued
+    deadline = time.monotonic() + delay
+    while time.monotonic() < deadline:
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+        await asyncio.sleep(min(1.0, max(deadline - time.monotonic(), 0)))
+
+    fail_at = len(words) // 2 if behaviour.random.random() < behaviour.stream_error_rate else None
+    for i, word in enumerate(words):
+        if i == fail_at:
+            chunk = {"error": {"code": 502, "message": "Provider disconnected mid-stream"}}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            return response
+        chunk = {"model": model, "choices": [{"delta": {"content": word + ' '}, "finish_reason": None}]}
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        if behaviour.tokens_per_second:
+            await asyncio.sleep(behaviour.token_delay())
+    final = {"model": model, "choices": [{"delta": {}, "finish_reason": finish_reason}],
+             "usage": usage_block(payload, len(words))}
+    await response.write(f"data: {json.dumps(final)}\n\n".encode())
+    await response.write(b"data: [DONE]\n\n")
+    return response
+
+
+async def stats(request):
+    behaviour = request.app['behaviour']
+    return web.json_response({"in_flight": behaviour.in_flight, "served": behaviour.served})
+
+
+def create_app(behaviour):
+    app = web.Application()
+    app['behaviour'] = behaviour
+    app.router.add_post("/api/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def parse_model_latency(value):
+    model, _, seconds = value.rpartition('=')
+    if not model:
+        raise argparse.ArgumentTypeError("expected MODEL=SECONDS")
+    return model, float(seconds)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=2.0, help="mean/median seconds to the first token")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "exponential", "lognormal"], default="fixed")
+    parser.add_argument("--sigma", type=float, default=0.5,
+                        help="spread: +/- fraction for uniform, log-space sigma for lognormal")
+    parser.add_argument("--model-latency", type=parse_model_latency, action="append", metavar="MODEL=SECONDS",
+                        help="per-model latency override (repeatable)")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="generation speed, 0 = instant")
+    parser.add_argument("--reply-tokens", type=int, default=0, help="reply length in words, 0 = short fixed reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 5xx")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="fraction of streams failing midway")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="429 beyond this many requests in flight")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible latencies and failures")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    web.run_app(create_app(Behaviour(args)), host="127.0.0.1", port=args.port, print=None)
@@ -0,0 +1,318 @@
+"""Load test: drive /chat, /analyze-code and /chat-history under gunicorn.
+
+    python benchmarks/load_test.py --concurrency 50 --duration 30
+    python benchmarks/load_test.py --worker-class aiohttp --workers 2 --latency 1.5 --latency-dist lognormal
+    python benchmarks/load_test.py --history 400 --mix history=1      # session-size effects
+
+Starts the fake upstream and a gunicorn server on a scratch SQLite database,
+runs `concurrency` virtual users (each with its own session) for the given
+duration and reports per-endpoint throughput, p50/p95/p99 latency, the mean
+time per request stage from /metrics and the resident memory of every worker.
+With --history, every user's conversation is seeded with that many messages
+before the run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from itsdangerous import Signer  # noqa: E402
+
+from session_store import ServerSideSessionInterface, SQLiteConversationStore  # noqa: E402
+
+SECRET_KEY = "load-test"
+
+WORKER_CLASSES = {
+    "sync": ["app:app", "--worker-class", "sync"],
+    "gthread": ["app:app", "--worker-class", "gthread", "--threads", "8"],
+    "aiohttp": ["aio_app:app", "--worker-class", "aiohttp.GunicornWebWorker"],
+}
+
+CHAT_MESSAGES = [
+    "fix this bug ```python\ndef add(a, b):\n    return a - b\n```",
+    "explain how this works ```javascript\nconst total = items.reduce((sum, x) => sum + x.price, 0);\n```",
+    "write a function that parses ISO dates",
+    "hey, how's it going?",
+]
+
+ANALYZE_CODE = "import os\n\nclass Loader:\n    def load(self, path):\n        with open(path) as f:\n            return f.read()\n" * 4
+
+ENDPOINTS = {
+    "chat": ("POST", "/chat"),
+    "stream": ("POST", "/chat/stream"),
+    "analyze": ("POST", "/analyze-code"),
+    "history": ("GET", "/chat-history"),
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}, expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return float('nan')
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def seed_sessions(db_path, users, history):
+    """Create one session per user with `history` stored messages; returns the signed cookies"""
+    store = SQLiteConversationStore(db_path)
+    signer = Signer(SECRET_KEY, salt=ServerSideSessionInterface.salt)
+    cookies = []
+    for user in range(users):
+        sid = f"loadtest{user:06d}"
+        store.save_session(sid, {"user_context": {"name": None, "mood_today": None, "current_projects": [],
+                                                  "coding_level": None, "favorite_languages": [],
+                                                  "personal_notes": []}})
+        for i in range(history):
+            role = "user" if i % 2 == 0 else "assistant"
+            store.append_message(sid, {"role": role, "content": CHAT_MESSAGES[i % len(CHAT_MESSAGES)] * 3,
+                                       "timestamp": "2025-01-01T00:00:00", "metadata": {}})
+        cookies.append(signer.sign(sid).decode('ascii'))
+    return cookies
+
+
+def worker_pids(master_pid):
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            match = re.search(r"VmRSS:\s+(\d+) kB", f.read())
+    except OSError:
+        return None
+    return int(match.group(1)) / 1024 if match else None
+
+
+class MemorySampler(threading.Thread):
+    """Polls the RSS of every gunicorn worker: first, peak and last value per pid"""
+
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.samples = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            for pid in worker_pids(self.master_pid):
+                rss = rss_mb(pid)
+                if rss is None:
+                    continue
+                first, peak, _ = self.samples.get(pid, (rss, rss, rss))
+                self.samples[pid] = (first, max(peak, rss), rss)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+async def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as client:
+        while time.monotonic() < deadline:
+            try:
+                async with client.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def run_load(base_url, cookies, mix, duration, request_timeout, seed):
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: {"latencies": [], "errors": 0} for name in names}
+    deadline = time.monotonic() + duration
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
+
+    async def user(cookie, user_rng):
+        jar = aiohttp.CookieJar(unsafe=True)  # Keep cookies for 127.0.0.1
+        async with aiohttp.ClientSession(timeout=timeout, cookie_jar=jar,
+                                         connector=aiohttp.TCPConnector(limit=1)) as client:
+            if cookie:
+                jar.update_cookies({"session": cookie})
+            while time.monotonic() < deadline:
+                name = user_rng.choices(names, weights)[0]
+                method, path = ENDPOINTS[name]
+                if name == "analyze":
+                    body = {"code": ANALYZE_CODE, "language": "python"}
+                elif method == "POST":
+                    body = {"message": user_rng.choice(CHAT_MESSAGES)}
+                else:
+                    body = None
+                started = time.monotonic()
+                try:
+                    async with client.request(method, f"{base_url}{path}", json=body) as response:
+                        await response.read()
+                        ok = response.status == 200
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    ok = False
+                if ok:
+                    results[name]["latencies"].append(time.monotonic() - started)
+                else:
+                    results[name]["errors"] += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(user(cookie, random.Random(rng.random())) for cookie in cookies))
+    return results, time.monotonic() - started
+
+
+async def fetch_stage_means(base_url):
+    """Mean seconds per request stage from the app's /metrics"""
+    async with aiohttp.ClientSession() as client:
+        async with client.get(f"{base_url}/metrics") as response:
+            text = await response.text()
+    sums, counts = {}, {}
+    for kind, stage, value in re.findall(r'vibecoding_stage_seconds_(sum|count)\{stage="(\w+)"\} (\S+)', text):
+        (sums if kind == "sum" else counts)[stage] = float(value)
+    return {stage: sums[stage] / counts[stage] for stage in sums if counts.get(stage)}
+
+
+def build_report(args, results, wall, stages, memory):
+    endpoints = {}
+    for name, result in results.items():
+        ordered = sorted(result["latencies"])
+        endpoints[ENDPOINTS[name][1]] = {
+            "ok": len(ordered),
+            "errors": result["errors"],
+            "rps": len(ordered) / wall,
+            "p50_ms": percentile(ordered, 0.50) * 1000,
+            "p95_ms": percentile(ordered, 0.95) * 1000,
+            "p99_ms": percentile(ordered, 0.99) * 1000,
+        }
+    return {
+        "config": {
+            "worker_class": args.worker_class, "workers": args.workers, "concurrency": args.concurrency,
+            "duration_s": args.duration, "history": args.history, "latency_s": args.latency,
+            "latency_dist": args.latency_dist,
+        },
+        "wall_s": wall,
+        "endpoints": endpoints,
+        "stages_ms": {stage: mean * 1000 for stage, mean in stages.items()},
+        "workers_rss_mb": {str(pid): {"start": first, "peak": peak, "end": last}
+                           for pid, (first, peak, last) in sorted(memory.items())},
+    }
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"{config['worker_class']} x{config['workers']}, {config['concurrency']} users, "
+          f"{config['duration_s']:.0f}s, history {config['history']}, "
+          f"upstream {config['latency_s']}s {config['latency_dist']}\n")
+    print(f"{'endpoint':<16} {'ok':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for path, stats in report["endpoints"].items():
+        print(f"{path:<16} {stats['ok']:>7} {stats['errors']:>7} {stats['rps']:>8.1f} "
+              f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+    if report["stages_ms"]:
+        print(f"\n{'stage':<16} {'mean ms':>9}")
+        for stage, mean in sorted(report["stages_ms"].items()):
+            print(f"{stage:<16} {mean:>9.2f}")
+    print(f"\n{'worker pid':<16} {'start MB':>9} {'peak MB':>9} {'end MB':>9}")
+    for pid, rss in report["workers_rss_mb"].items():
+        print(f"{pid:<16} {rss['start']:>9.1f} {rss['peak']:>9.1f} {rss['end']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--worker-class", choices=list(WORKER_CLASSES), default="sync")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users, one session each")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=6,analyze=3,history=1"),
+                        help="endpoint weights, e.g. chat=6,analyze=3,history=1 (also: stream)")
+    parser.add_argument("--history", type=int, default=0, help="messages seeded into every session")
+    parser.add_argument("--timeout", type=float, default=120.0, help="client timeout per request")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake upstream time to first token")
+    parser.add_argument("--latency-dist", default="fixed", help="fixed, uniform, exponential or lognormal")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--upstream-arg", action="append", default=[],
+                        help="extra fake_openrouter.py argument (repeatable)")
+    parser.add_argument("--admission-control", action="store_true",
+                        help="keep the app's per-session rate and concurrency limits on")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--upstream-port", type=int, default=8900)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="vibecoding-load-")
+    db_path = os.path.join(scratch, "sessions.db")
+    cookies = seed_sessions(db_path, args.concurrency, args.history) if args.history else [None] * args.concurrency
+
+    upstream = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "benchmarks", "fake_openrouter.py"),
+        "--port", str(args.upstream_port), "--latency", str(args.latency), "--latency-dist", args.latency_dist,
+        "--tokens-per-second", str(args.tokens_per_second), "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate), "--seed", str(args.seed),
+    ] + args.upstream_arg)
+    env = dict(os.environ,
+               OPENROUTER_API_KEY="benchmark",
+               OPENROUTER_API_URL=f"http://127.0.0.1:{args.upstream_port}/api/v1/chat/completions",
+               SECRET_KEY=SECRET_KEY,
+               SESSION_DB_PATH=db_path,
+               METRICS_DIR=os.path.join(scratch, "metrics"),
+               ADMISSION_CONTROL="1" if args.admission_control else "0")
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(["gunicorn"] + WORKER_CLASSES[args.worker_class] + [
+        "--bind", f"127.0.0.1:{args.port}", "--workers", str(args.workers),
+        "--timeout", "300", "--log-level", "warning",
+    ], cwd=ROOT, env=env)
+    sampler = MemorySampler(server.pid)
+    try:
+        asyncio.run(wait_until_up(f"{base_url}/health"))
+        sampler.start()
+        results, wall = asyncio.run(run_load(base_url, cookies, args.mix, args.duration, args.timeout, args.seed))
+        time.sleep(2.5)  # Let every worker flush its metrics file
+        stages = asyncio.run(fetch_stage_means(base_url))
+    finally:
+        if sampler.is_alive():
+            sampler.stop()
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+        upstream.terminate()
+        upstream.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = build_report(args, results, wall, stages, sampler.samples)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Startup benchmark: import time and time-to-first-response of a fresh server.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --worker-class sync --runs 5
+
+Measures, in fresh interpreters, how long `import app` and `import aio_app`
+take and how long the warm-up adds. Then, for each startup mode (cold: no
+preload and no warm-up; warm: warm-up in the worker; preload: warm-up in the
+master, as gunicorn.conf.py does by default), boots a one-worker gunicorn
+against the fake upstream and reports the time until /health answers and the
+latency of the first and second home page and /chat requests.
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER_CLASSES = {
+    "aiohttp": ["aio_app:app", "--worker-class", "aiohttp.GunicornWebWorker"],
+    "sync": ["app:create_app()", "--worker-class", "sync"],
+}
+
+MODES = {
+    "cold": {"WARM_UP": "0", "GUNICORN_PRELOAD": "0"},
+    "warm": {"WARM_UP": "1", "GUNICORN_PRELOAD": "0"},
+    "preload": {"WARM_UP": "1", "GUNICORN_PRELOAD": "1"},
+}
+
+IMPORT_PROBE = """
+import json, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{warm_up}
+print(json.dumps({{"import_ms": (imported - started) * 1000, "warm_up_ms": (time.perf_counter() - imported) * 1000}}))
+"""
+
+
+def scratch_env(scratch, upstream_port, extra=None):
+    return dict(
+        os.environ,
+        OPENROUTER_API_KEY="benchmark",
+        OPENROUTER_API_URL=f"http://127.0.0.1:{upstream_port}/api/v1/chat/completions",
+        SESSION_DB_PATH=os.path.join(scratch, "sessions.db"),
+        JOBS_DB_PATH=os.path.join(scratch, "jobs.db"),
+        EVENT_LOG_PATH=os.path.join(scratch, "logs", "requests.jsonl"),
+        UPLOAD_DIR=os.path.join(scratch, "uploads"),
+        ADMISSION_CONTROL="0",
+        **(extra or {}),
+    )
+
+
+def measure_imports(env, runs):
+    """Median in-process import and warm-up time plus interpreter wall time, per module"""
+    probes = {
+        "app": ("app", "app.warm_up()"),
+        "aio_app": ("aio_app", ""),  # Imports app and warms up while building its application
+    }
+    results = {}
+    for name, (module, warm_up) in probes.items():
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            out = subprocess.run([sys.executable, "-c", IMPORT_PROBE.format(module=module, warm_up=warm_up)],
+                                 cwd=ROOT, env=dict(env, WARM_UP="0" if warm_up else "1"),
+                                 capture_output=True, text=True, check=True)
+            sample = json.loads(out.stdout.strip().splitlines()[-1])
+            sample["process_ms"] = (time.perf_counter() - started) * 1000
+            samples.append(sample)
+        results[name] = {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+    return results
+
+
+def timed(method, url, **kwargs):
+    started = time.perf_counter()
+    response = requests.request(method, url, timeout=60, **kwargs)
+    response.raise_for_status()
+    return (time.perf_counter() - started) * 1000
+
+
+def measure_boot(env, worker_class, port):
+    """Milliseconds until /health answers, then the first and second request latencies"""
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(["gunicorn"] + WORKER_CLASSES[worker_class] + [
+        "--bind", f"127.0.0.1:{port}", "--workers", "1", "--log-level", "warning",
+    ], cwd=ROOT, env=env)
+    try:
+        while True:
+            try:
+                if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            if time.perf_counter() - started > 60 or server.poll() is not None:
+                raise RuntimeError("gunicorn did not come up")
+            time.sleep(0.01)
+        ready_ms = (time.perf_counter() - started) * 1000
+        return {
+            "ready_ms": ready_ms,
+            "first_page_ms": timed("GET", f"{base_url}/"),
+            "second_page_ms": timed("GET", f"{base_url}/"),
+            "first_chat_ms": timed("POST", f"{base_url}/chat", json={"message": "fix my add function"}),
+            "second_chat_ms": timed("POST", f"{base_url}/chat", json={"message": "explain decorators"}),
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def print_report(report):
+    print("imports (median, ms)")
+    print(f"  {'module':<10} {'import':>8} {'warm-up':>8} {'process':>8}")
+    for module, values in report["imports"].items():
+        print(f"  {module:<10} {values['import_ms']:>8.0f} {values['warm_up_ms']:>8.0f} {values['process_ms']:>8.0f}")
+    print(f"\nboot to first responses, {report['worker_class']} worker (median, ms)")
+    columns = ["ready_ms", "first_page_ms", "second_page_ms", "first_chat_ms", "second_chat_ms"]
+    print(f"  {'mode':<10}" + "".join(f" {column[:-3]:>14}" for column in columns))
+    for mode, values in report["boot"].items():
+        print(f"  {mode:<10}" + "".join(f" {values[column]:>14.1f}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--worker-class", choices=list(WORKER_CLASSES), default="aiohttp")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated startup modes to compare")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per measurement (the median is reported)")
+    parser.add_argument("--port", type=int, default=8950)
+    parser.add_argument("--upstream-port", type=int, default=8951)
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake upstream latency (s)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    upstream = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "benchmarks", "fake_openrouter.py"),
+        "--port", str(args.upstream_port), "--latency", str(args.latency),
+    ])
+    scratch = tempfile.mkdtemp(prefix="vibecoding-startup-")
+    try:
+        report = {"worker_class": args.worker_class,
+                  "imports": measure_imports(scratch_env(scratch, args.upstream_port), args.runs), "boot": {}}
+        for mode in args.modes.split(","):
+            runs = []
+            for run in range(args.runs):
+                run_dir = os.path.join(scratch, f"{mode}-{run}")
+                os.makedirs(run_dir)
+                runs.append(measure_boot(scratch_env(run_dir, args.upstream_port, MODES[mode]),
+                                         args.worker_class, args.port))
+            report["boot"][mode] = {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+    finally:
+        upstream.terminate()
+        upstream.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
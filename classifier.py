@@ -0,0 +1,158 @@
+"""Single-pass request classifier.
+
+classify() scans a message once and returns its code blocks, intents and
+request type together, replacing the extract -> detect -> analyze cascade that
+rescanned the text several times per request. Results are identical to the
+original helpers in app.py.
+
+* All patterns are compiled once at import time.
+* Intent keywords are checked once per message, stopping at the first hit
+  for each intent. Substring search runs in C and measured faster on 100 KB
+  inputs than a pure-Python Aho-Corasick automaton or a single keyword
+  alternation regex, so each intent's keywords are searched with `in`.
+* The auto-detect fallback checks the class pattern in linear time; the
+  original `class\\s+\\w+[\\s\\S]*?{` search was quadratic on inputs with many
+  brace-less classes (Python files, prose mentioning "class").
+"""
+import re
+from collections import namedtuple
+
+Classification = namedtuple('Classification', ['code_blocks', 'intents', 'request_type'])
+
+FENCED_CODE = re.compile(r'```(\w*)\n(.*?)```', re.DOTALL)
+
+# Intent keywords in priority order (same lists as the original analyze_code_intent)
+INTENT_KEYWORDS = {
+    'debug': [
+        'fix', 'debug', 'error', 'bug', 'broken', 'not working', 'issue',
+        'problem', 'wrong', 'incorrect', 'doesn\'t work', 'failed',
+        'exception', 'crash', 'syntax error', 'runtime error'
+    ],
+    'optimize': [
+        'optimize', 'improve', 'better', 'faster', 'efficient', 'performance',
+        'refactor', 'clean up', 'make it better'
+    ],
+    'explain': [
+        'explain', 'what does', 'how does', 'understand', 'break down',
+        'step by step', 'walk through'
+    ],
+    'enhance': [
+        'add', 'extend', 'modify', 'change', 'update', 'enhance',
+        'feature', 'functionality', 'new'
+    ],
+    'create': [
+        'create', 'make', 'build', 'write', 'generate', 'develop',
+        'code for', 'function for', 'script for'
+    ],
+}
+
+INTENT_ORDER = list(INTENT_KEYWORDS)
+
+# Request type for the first intent that applies when code is present
+CODE_REQUEST_TYPES = [
+    ('debug', 'debug_code'),
+    ('optimize', 'optimize_code'),
+    ('explain', 'explain_code'),
+    ('enhance', 'enhance_code'),
+]
+
+
+# Auto-detect patterns for unfenced code, in priority order
+DEF_PATTERN = re.compile(r'def\s+\w+\([^)]*\):\s*\n', re.MULTILINE)
+CLASS_HEAD = re.compile(r'class\s+\w+')
+AUTO_DETECT_PATTERNS = [
+    DEF_PATTERN,  # Python functions
+    re.compile(r'function\s+\w+\([^)]*\)\s*{', re.MULTILINE),  # JavaScript functions
+    None,  # Class definitions: class\s+\w+[\s\S]*?{ (see _class_search)
+    re.compile(r'import\s+\w+', re.MULTILINE),  # Import statements
+    re.compile(r'from\s+\w+\s+import', re.MULTILINE),  # Python imports
+    re.compile(r'#include\s*<[^>]+>', re.MULTILINE),  # C/C++ includes
+    re.compile(r'public\s+class\s+\w+', re.MULTILINE),  # Java classes
+]
+
+
+def _class_search(text):
+    """Linear-time equivalent of re.search(r'class\\s+\\w+[\\s\\S]*?{', text)"""
+    head = CLASS_HEAD.search(text)
+    # Any later class header would need a '{' after it too, so the first one decides
+    return head is not None and text.find('{', head.end()) != -1
+
+
+def _matches(pattern, text):
+    if pattern is None:
+        return _class_search(text)
+    return pattern.search(text) is not None
+
+
+def extract_code_blocks(message):
+    """Fenced code blocks, or one auto-detected block for unfenced code"""
+    code_blocks = [
+        {'language': language or 'text', 'code': code.strip()}
+        for language, code in FENCED_CODE.findall(message)
+    ]
+    if code_blocks:
+        return code_blocks
+
+    for pattern in AUTO_DETECT_PATTERNS:
+        if not _matches(pattern, message):
+            continue
+        # Collect from the first line the pattern matches on until a blank line
+        code_lines = []
+        for line in message.split('\n'):
+            if code_lines or _matches(pattern, line):
+                code_lines.append(line)
+                # Simple heuristic to end code block
+                if line.strip() == '' and len(code_lines) > 5:
+                    break
+        if code_lines:
+            code_blocks.append({'language': 'auto-detected', 'code': '\n'.join(code_lines)})
+        break
+
+    return code_blocks
+
+
+def find_intents(text_lower):
+    """Set of intents whose keywords occur anywhere in the (lower-cased) text"""
+    return {
+        intent for intent, keywords in INTENT_KEYWORDS.items()
+        if any(keyword in text_lower for keyword in keywords)
+    }
+
+
+def intents_for(found, has_code):
+    """Ordered intent list with the original defaults for messages without keywords"""
+    intents = [intent for intent in INTENT_ORDER if intent in found]
+    if not intents:
+        # Code without a clear intent is assumed to need fixing, anything else is creation
+        intents.append('debug' if has_code else 'create')
+    return intents
+
+
+def request_type_for(intents, has_code):
+    if has_code:
+        for intent, request_type in CODE_REQUEST_TYPES:
+            if intent in intents:
+                return request_type
+    if 'create' in intents:
+        return 'create_code'
+    if has_code:
+        return 'analyze_code'
+    return 'general_chat'
+
+
+def classify(message):
+    """Classify one message in a single scan"""
+    code_blocks = extract_code_blocks(message)
+    intents = intents_for(find_intents(message.lower()), bool(code_blocks))
+    return Classification(code_blocks, intents, request_type_for(intents, bool(code_blocks)))
+
+
+def classify_batch(messages):
+    """Classify many messages, analysing identical messages only once"""
+    seen = {}
+    results = []
+    for message in messages:
+        if message not in seen:
+            seen[message] = classify(message)
+        results.append(seen[message])
+    return results
@@ -0,0 +1,330 @@
+"""Static analysis behind /analyze-code and /analyze-code/batch.
+
+Python is parsed with the ast module: functions and classes with their line
+numbers, imports, the deepest block nesting and McCabe cyclomatic complexity
+per function (1 + one per branch, loop, except clause, boolean operator and
+comprehension condition). Other languages, and Python that does not parse,
+get tokenizer metrics: comments and string literals are stripped, then
+decision keywords and operators, definitions, imports and brace (or
+indentation) depth are counted.
+
+analyze() is pure and cheap enough to call in the request thread for small
+files. AnalysisPool runs batches and large files on a ProcessPoolExecutor,
+so large uploads use every core instead of queueing behind the GIL. Each
+file is bounded by a timeout inside the worker process; should a worker
+stay stuck past it (in a long C call the alarm cannot interrupt), the
+parent gives up on the pending files and kills the pool's processes.
+"""
+import ast
+import hashlib
+import logging
+import multiprocessing
+import re
+import signal
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Bump when the analysis output changes so cached results are not reused
+ANALYSIS_VERSION = 2
+
+PYTHON_BRANCHES = (ast.If, ast.IfExp, ast.For, ast.AsyncFor, ast.While, ast.ExceptHandler, ast.Assert,
+                   ast.match_case)
+PYTHON_BLOCKS = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.With, ast.AsyncWith, ast.Try, ast.Match,
+                 ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+try:
+    PYTHON_BLOCKS += (ast.TryStar,)
+except AttributeError:  # Python < 3.11
+    pass
+
+# Tokenizer metrics. Pasted code is untrusted, so every pattern runs in linear time: runs of words and
+# blanks before a name are taken whole with (?=(...))\N, the atomic group of older Pythons, so a line
+# that does not match is not retried for every shorter prefix, and analyze_tokens defuses block comment
+# openers that never close before a search for their end could start from each of them
+COMMENTS_AND_STRINGS = re.compile(
+    r'//[^\n]*|/\*.*?\*/|<!--.*?-->|(?<![\w)\]])--(?=\s)[^\n]*|#(?=[ \t!#]|$)[^\n]*'  # Not i-- or CSS #ids
+    r'|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`',
+    re.DOTALL
+)
+DECISION_TOKENS = re.compile(r'\b(?:if|elif|for|foreach|while|case|catch|except)\b|&&|\|\||\?(?![.?:])')
+FUNCTION_DEFS = re.compile(
+    r'\b(?:def|function|func|fn|sub)\s+(\w+)'                        # Keyword-introduced functions
+    r'|\b(\w+)\s*=\s*(?:async\s*)?(?:\([^()]*\)|\w+)\s*=>'             # Arrow functions assigned to a name
+    r'|^(?=([ \t]*(?:[\w<>\[\],*&:]+[ \t]+)*)(\w+))\3\4'              # C-like, methods: type words, name,
+    r'\s*\([^;{}()]*\)\s*(?:const\s*)?(?:throws[\w\s,.]+)?\{',         # parameters, then the body
+    re.MULTILINE
+)
+CLASS_DEFS = re.compile(r'\b(?:class|struct|interface|trait|enum)\s+(\w+)')
+IMPORTS = re.compile(
+    r'^(?=([ \t]*))\1(?:import\s+[\w.*{}, ]+|from\s+[\w.]+\s+import|#include\s*[<"][^>"]+[>"]'
+    r'|using\s+[\w.]+\s*;|use\s+[\w:]+|[^\n]*\brequire\s*\()[^\n]*',
+    re.MULTILINE
+)
+CONTROL_WORDS = {'if', 'for', 'while', 'switch', 'catch', 'return', 'sizeof', 'else'}
+
+
+class AnalysisTimeout(Exception):
+    """A file took longer than the per-file analysis timeout"""
+
+
+def content_key(code, language):
+    """Cache key of an analysis: content hash, language and analyzer version"""
+    digest = hashlib.sha256(code.encode('utf-8')).hexdigest()
+    return f"{ANALYSIS_VERSION}:{language}:{digest}"
+
+
+def complexity_label(complexity):
+    return "Low" if complexity <= 5 else "Medium" if complexity <= 10 else "High"
+
+
+def _branches(node):
+    """Decision points of one node for cyclomatic complexity"""
+    if isinstance(node, PYTHON_BRANCHES):
+        return 1
+    if isinstance(node, ast.BoolOp):
+        return len(node.values) - 1
+    if isinstance(node, ast.comprehension):
+        return 1 + len(node.ifs)
+    return 0
+
+
+class PythonAnalyzer(ast.NodeVisitor):
+    def __init__(self):
+        self.functions = []
+        self.classes = []
+        self.imports = []
+        self.max_nesting = 0
+        self.module_complexity = 1
+        self._depth = 0
+        self._function = None
+
+    def generic_visit(self, node):
+        branches = _branches(node)
+        if self._function is not None:
+            self._function['complexity'] += branches
+        else:
+            self.module_complexity += branches
+        block = isinstance(node, PYTHON_BLOCKS)
+        if block:
+            self._depth += 1
+            self.max_nesting = max(self.max_nesting, self._depth)
+        super().generic_visit(node)
+        if block:
+            self._depth -= 1
+
+    def visit_FunctionDef(self, node):
+        function = {
+            "name": node.name,
+            "line": node.lineno,
+            "end_line": node.end_lineno,
+            "args": len(node.args.posonlyargs) + len(node.args.args) + len(node.args.kwonlyargs),
+            "complexity": 1,
+            "async": isinstance(node, ast.AsyncFunctionDef),
+        }
+        self.functions.append(function)
+        outer, self._function = self._function, function
+        self.generic_visit(node)
+        self._function = outer
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self.classes.append({
+            "name": node.name,
+            "line": node.lineno,
+            "methods": sum(isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) for item in node.body),
+        })
+        self.generic_visit(node)
+
+    def visit_Import(self, node):
+        self.imports.extend(alias.name for alias in node.names)
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        self.imports.append("." * node.level + (node.module or ""))
+        self.generic_visit(node)
+
+
+def analyze_python(tree):
+    visitor = PythonAnalyzer()
+    visitor.visit(tree)
+    complexity = max([visitor.module_complexity] + [f['complexity'] for f in visitor.functions])
+    return {
+        "engine": "ast",
+        "functions": visitor.functions,
+        "classes": visitor.classes,
+        "imports": sorted(set(visitor.imports)),
+        "max_nesting": visitor.max_nesting,
+        "cyclomatic_complexity": complexity,
+        "total_complexity": visitor.module_complexity + sum(f['complexity'] - 1 for f in visitor.functions),
+    }
+
+
+def _nesting_depth(stripped):
+    """Deepest brace nesting, or indentation depth for brace-less code"""
+    depth = max_depth = 0
+    for char in stripped:
+        if char == '{':
+            depth += 1
+            max_depth = max(max_depth, depth)
+        elif char == '}':
+            depth = max(depth - 1, 0)
+    if max_depth:
+        return max_depth
+    indents = sorted({len(line) - len(line.lstrip()) for line in stripped.split('\n') if line.strip()})
+    return max(len(indents) - 1, 0)
+
+
+def _defuse_unclosed(code, opener, closer, defused):
+    """code with the openers after the last closer, which can never be closed, made inert"""
+    last = code.rfind(closer) + 1
+    return code[:last] + code[last:].replace(opener, defused) if opener in code[last:] else code
+
+
+def analyze_tokens(code):
+    text = _defuse_unclosed(_defuse_unclosed(code, '/*', '*/', '/ *'), '<!--', '-->', '<!- -')
+    # Keep newlines of removed comments and strings so line numbers and indentation survive
+    stripped = COMMENTS_AND_STRINGS.sub(lambda m: '""' + '\n' * m.group(0).count('\n'), text)
+    functions = []
+    for match in FUNCTION_DEFS.finditer(stripped):
+        name = match.group(1) or match.group(2) or match.group(4)
+        if name not in CONTROL_WORDS:
+            functions.append({"name": name, "line": stripped.count('\n', 0, match.start()) + 1})
+    decisions = len(DECISION_TOKENS.findall(stripped))
+    return {
+        "engine": "tokens",
+        "functions": functions,
+        "classes": [{"name": m.group(1), "line": stripped.count('\n', 0, m.start()) + 1}
+                    for m in CLASS_DEFS.finditer(stripped)],
+        "imports": sorted({m.group(0).strip() for m in IMPORTS.finditer(code)}),
+        "max_nesting": _nesting_depth(stripped),
+        # Not split per function: averaged over them as an estimate of the per-function figure
+        "cyclomatic_complexity": 1 + round(decisions / max(len(functions), 1)),
+        "total_complexity": 1 + decisions,
+    }
+
+
+def analyze(code, language="auto"):
+    """Metrics of one source file; Python is parsed, everything else tokenized"""
+    result = {"language": language, "syntax_error": None}
+    if language in ("python", "auto"):
+        try:
+            result.update(analyze_python(ast.parse(code)))
+            result["language"] = "python"
+        except SyntaxError as e:
+            if language == "python":
+                result["syntax_error"] = {"message": e.msg, "line": e.lineno}
+            result.update(analyze_tokens(code))
+        except (ValueError, RecursionError) as e:  # Null bytes, absurdly deep nesting
+            result["syntax_error"] = {"message": str(e), "line": None}
+            result.update(analyze_tokens(code))
+    else:
+        result.update(analyze_tokens(code))
+    result.update({
+        "line_count": len(code.split('\n')),
+        "character_count": len(code),
+        "estimated_complexity": complexity_label(result["cyclomatic_complexity"]),
+        "has_functions": bool(result["functions"]),
+        "has_classes": bool(result["classes"]),
+        "has_imports": bool(result["imports"]),
+    })
+    return result
+
+
+def _alarm(signum, frame):
+    raise AnalysisTimeout()
+
+
+def analyze_with_timeout(code, language, timeout):
+    """analyze() bounded by a SIGALRM timer; runs in a pool worker process.
+
+    The alarm is handled between bytecodes, so a single long ast.parse call
+    (C code) still completes before the timeout takes effect.
+    """
+    previous = signal.signal(signal.SIGALRM, _alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return analyze(code, language)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class AnalysisPool:
+    """Process pool for batch analysis, started on first use and rebuilt if a worker dies or hangs"""
+
+    def __init__(self, workers=None, timeout=10, grace=5):
+        self.workers = workers
+        self.timeout = timeout
+        self.grace = grace  # Beyond timeout before the parent stops waiting for a worker
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a threaded web worker can deadlock the child
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _reset(self, executor, kill=False):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        # shutdown() leaves running calls to finish, so a hung worker is terminated (no public API before 3.14)
+        processes = list((executor._processes or {}).values()) if kill else []
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def analyze(self, code, language):
+        """(analysis, error) of one file, in a worker process with the same timeout as batches"""
+        _, analysis, error = next(self.map([(code, language)]))
+        return analysis, error
+
+    def map(self, files):
+        """Yield (index, analysis, error) for (code, language) pairs as each finishes.
+        
+        Workers run files concurrently and each is cut off after timeout, so
+        a healthy pool finishes one within timeout + grace of the last. If
+        none does, the rest are reported as timed out and the pool is killed
+        and rebuilt on next use.
+        """
+        executor = self._get_executor()
+        try:
+            futures = {executor.submit(analyze_with_timeout, code, language, self.timeout): index
+                       for index, (code, language) in enumerate(files)}
+        except BrokenProcessPool:
+            self._reset(executor)
+            for index in range(len(files)):
+                yield index, None, "Analysis worker crashed"
+            return
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=self.timeout + self.grace, return_when=FIRST_COMPLETED)
+            if not done:
+                logger.warning(f"Analysis pool made no progress in {self.timeout + self.grace:g}s; killing its workers")
+                self._reset(executor, kill=True)
+                for future in pending:
+                    yield futures[future], None, f"Analysis timed out after {self.timeout:g}s"
+                return
+            for future in done:
+                index = futures[future]
+                try:
+                    yield index, future.result(), None
+                except AnalysisTimeout:
+                    yield index, None, f"Analysis timed out after {self.timeout:g}s"
+                except BrokenProcessPool:
+                    self._reset(executor)
+                    yield index, None, "Analysis worker crashed"
+                except Exception as e:
+                    logger.error(f"Analysis failed: {e}")
+                    yield index, None, "Analysis failed"
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
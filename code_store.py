@@ -0,0 +1,177 @@
+"""Content-addressed code blocks and their versions, for iterative debugging.
+
+A debugging session pastes the same file over and over, a little changed each
+time. Every fenced code block of at least CODE_STORE_MIN_CHARS characters is
+keyed by the SHA-1 of its code and kept once per conversation: the stored
+message holds a reference in place of the code. A new block is linked to the
+most similar earlier block of its conversation (its base, when at least
+CODE_VERSION_MIN_SIMILARITY of their lines match) and numbered as the next
+version of it; the conversation store keeps it as a line delta against the
+base, with a full copy every MAX_DELTA_CHAIN versions so rebuilding a block
+never walks a long chain.
+
+The versions also shrink prompts: a block whose earlier version is already
+in the prompt in full is sent as a unified diff against it, when the diff is
+at most CODE_DIFF_MAX_RATIO of the block's size.
+"""
+import difflib
+import hashlib
+import os
+import re
+
+from classifier import FENCED_CODE
+
+# Smallest block stored by reference and diffed in prompts; smaller ones are cheaper to repeat
+CODE_STORE_MIN_CHARS = int(os.getenv("CODE_STORE_MIN_CHARS", "400"))
+# Share of matching lines from which an earlier block counts as a previous version of a new one
+CODE_VERSION_MIN_SIMILARITY = float(os.getenv("CODE_VERSION_MIN_SIMILARITY", "0.6"))
+# Largest diff, relative to the full block, still sent instead of the block
+CODE_DIFF_MAX_RATIO = float(os.getenv("CODE_DIFF_MAX_RATIO", "0.5"))
+# Earlier blocks of a conversation compared with a new one when looking for its base
+VERSION_CANDIDATES = 20
+# Versions between full copies in storage, and furthest back a prompt diff looks for a full version
+MAX_DELTA_CHAIN = 8
+
+# What a stored message holds in place of the code of a fenced block
+CODE_REFERENCE = re.compile(r"\x00code:([0-9a-f]{40})\x00")
+
+
+def code_digest(code):
+    """Key of a block: unlike prompt_builder.block_hash, exact to the whitespace, so it restores the same text"""
+    return hashlib.sha1(code.encode('utf-8')).hexdigest()
+
+
+def stored_blocks(content):
+    """{digest: code} of the blocks of content large enough to be stored by reference"""
+    return {code_digest(match.group(2)): match.group(2) for match in FENCED_CODE.finditer(content)
+            if len(match.group(2)) >= CODE_STORE_MIN_CHARS}
+
+
+def new_versions(content, versions):
+    """Positions, among the fenced blocks of content, of the new versions of earlier blocks: a prompt may diff these"""
+    if not versions or '```' not in content:
+        return set()
+    return {i for i, match in enumerate(FENCED_CODE.finditer(content))
+            if versions.get(code_digest(match.group(2)), {}).get("base") is not None}
+
+
+def compact(content):
+    """content with the code of stored blocks replaced by references"""
+    def replace(match):
+        code = match.group(2)
+        if len(code) < CODE_STORE_MIN_CHARS:
+            return match.group(0)
+        return f"```{match.group(1)}\n\x00code:{code_digest(code)}\x00```"
+    return FENCED_CODE.sub(replace, content) if '```' in content else content
+
+
+def referenced(content):
+    """Digests of the blocks content refers to"""
+    return CODE_REFERENCE.findall(content) if '\x00' in content else []
+
+
+def expand(content, codes):
+    """content with its references replaced by the code in codes ({digest: code})"""
+    if '\x00' not in content:
+        return content
+    return CODE_REFERENCE.sub(lambda match: codes.get(match.group(1), "[code no longer stored]\n"), content)
+
+
+def _lines(code):
+    return code.splitlines(keepends=True)
+
+
+def similarity(base, code):
+    """Share of matching lines between two blocks, 0 to 1"""
+    matcher = difflib.SequenceMatcher(None, _lines(base), _lines(code), autojunk=False)
+    if matcher.real_quick_ratio() < CODE_VERSION_MIN_SIMILARITY or matcher.quick_ratio() < CODE_VERSION_MIN_SIMILARITY:
+        return 0.0
+    return matcher.ratio()
+
+
+def find_base(code, candidates):
+    """Digest of the block of candidates ({digest: code}, oldest first) code is most likely a new version of, or None.
+
+    On a tie the newest candidate wins.
+    """
+    best, best_ratio = None, CODE_VERSION_MIN_SIMILARITY
+    for digest, candidate in candidates.items():
+        ratio = similarity(candidate, code)
+        if ratio >= best_ratio:
+            best, best_ratio = digest, ratio
+    return best
+
+
+def make_delta(base, code):
+    """code as a list of [start, end] line ranges copied from base and lists of new lines"""
+    base_lines, lines = _lines(base), _lines(code)
+    delta = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, base_lines, lines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append({"lines": lines[j1:j2]})
+    return delta
+
+
+def apply_delta(base, delta):
+    base_lines = _lines(base)
+    parts = []
+    for op in delta:
+        if isinstance(op, dict):
+            parts.extend(op["lines"])
+        else:
+            parts.extend(base_lines[op[0]:op[1]])
+    return ''.join(parts)
+
+
+def link_version(code, candidates, versions):
+    """(base, version) of a new block: candidates are earlier blocks ({digest: code}), versions their {"version"}"""
+    base = find_base(code, candidates)
+    if base is None:
+        return None, 1
+    return base, versions.get(base, {}).get("version", 1) + 1
+
+
+def unified_diff(base, code, base_version, version):
+    lines = difflib.unified_diff(base.splitlines(), code.splitlines(), f"version {base_version}", f"version {version}",
+                                 lineterm='')
+    return ''.join(line + '\n' for line in lines)
+
+
+def diff_code_blocks(history, versions):
+    """Send pasted blocks whose earlier version is in full in history as unified diffs against it.
+
+    history is oldest-first; versions maps block digests to their
+    {"base", "version"}. The earlier version may be several versions back
+    (replies count too: a paste of the fixed code is diffed against the
+    reply that fixed it), but diffs are always taken against a block shown
+    in full, never against another diff. Replies are left whole.
+    """
+    if not versions:
+        return history
+    shown = {}  # Blocks included in full so far, by digest
+    diffed = []
+    for msg in history:
+        def replace(match):
+            code = match.group(2)
+            digest = code_digest(code)
+            anchor, hops = versions.get(digest, {}).get("base"), 0
+            while anchor is not None and anchor not in shown and hops < MAX_DELTA_CHAIN:
+                anchor, hops = versions.get(anchor, {}).get("base"), hops + 1
+            if anchor in shown and msg["role"] == 'user':
+                version, anchor_version = versions[digest]["version"], versions.get(anchor, {}).get("version", 1)
+                diff = unified_diff(shown[anchor], code, anchor_version, version)
+                if len(diff) <= CODE_DIFF_MAX_RATIO * len(code):
+                    language = match.group(1) or 'text'
+                    return (f"[{language} code: version {version} of the block shown in full earlier as version "
+                            f"{anchor_version}, sent as a unified diff]\n```diff\n{diff}```")
+            if len(code) >= CODE_STORE_MIN_CHARS:
+                shown[digest] = code
+            return match.group(0)
+
+        content = msg["content"]
+        if '```' in content:
+            content = FENCED_CODE.sub(replace, content)
+        diffed.append({"role": msg["role"], "content": content})
+    return diffed
@@ -0,0 +1,236 @@
+"""Structured per-request event log and its offline analyzer.
+
+Each chat request emits one JSON record (request type, intents, prompt and
+reply sizes, token usage, stage timings, upstream status, model, cache
+outcome). emit() only appends to a bounded in-memory queue: a background
+thread writes the records in batches, so a slow disk never blocks a request
+(when the queue is full, records are dropped and counted instead).
+
+The log rotates once it exceeds max_bytes or has been open for
+rotate_interval seconds: logs/requests.jsonl is renamed to
+logs/requests.<timestamp>.<pid>.jsonl and a new file started. Every worker
+appends whole-line batches to the same file, and notices a rotation done by
+another one before its next batch.
+
+    python event_log.py logs/requests*.jsonl
+    python event_log.py logs/*.jsonl --since 2025-06-01T12:00 --by request_type,model
+"""
+import argparse
+import glob
+import gzip
+import json
+import logging
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class EventLog:
+    """Buffered JSONL writer with size and time based rotation"""
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, rotate_interval=24 * 3600, flush_interval=1.0,
+                 max_buffer=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_buffer)
+        self._file = None
+        self._opened_at = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        threading.Thread(target=self._run, name="event-log", daemon=True).start()
+
+    def emit(self, record):
+        """Queue one record; never blocks"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in batch))
+                self.written += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.error(f"Event log write failed: {e}")
+
+    def _write(self, data):
+        self._open()
+        # One write per batch on an O_APPEND file: lines from different workers never interleave
+        os.write(self._file, data.encode('utf-8'))
+        if os.fstat(self._file).st_size >= self.max_bytes or time.time() - self._opened_at >= self.rotate_interval:
+            self._rotate()
+
+    def _open(self):
+        if self._file is not None:
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._file).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            os.close(self._file)  # Another worker rotated the file
+        self._file = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._opened_at = time.time()
+
+    def _rotate(self):
+        stem, ext = os.path.splitext(self.path)
+        try:
+            os.rename(self.path, f"{stem}.{datetime.now().strftime('%Y%m%d-%H%M%S')}.{os.getpid()}{ext}")
+        except FileNotFoundError:
+            pass  # Rotated by another worker first
+        os.close(self._file)
+        self._file = None
+
+    def snapshot(self):
+        return {"written": self.written, "dropped": self.dropped, "buffered": self._queue.qsize()}
+
+
+# Offline analysis
+
+def read_events(paths, since=None, until=None):
+    """Stream records from JSONL files (plain or .gz) in the [since, until) time window"""
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Truncated last line of a file still being written
+                ts = record.get('ts', '')
+                if (since and ts < since) or (until and ts >= until):
+                    continue
+                yield record
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return float('nan')
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Summary:
+    """Counts and latency samples of one group of records"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.durations = []
+        self.stages = defaultdict(list)
+        self.reply_chars = []
+        self.completion_tokens = []
+        self.truncated = 0
+
+    def add(self, record):
+        self.count += 1
+        if str(record.get('status')) != '200':
+            self.errors += 1
+        if record.get('cache') == 'hit':
+            self.cache_hits += 1
+        self.durations.append(record.get('duration_ms', 0))
+        for stage, ms in (record.get('stages') or {}).items():
+            self.stages[stage].append(ms)
+        if record.get('reply_chars') is not None:
+            self.reply_chars.append(record['reply_chars'])
+        usage = record.get('usage')
+        if usage:
+            self.completion_tokens.append(usage['completion_tokens'])
+            if usage.get('continuations') or usage.get('finish_reason') == 'length':
+                self.truncated += 1
+
+    def report(self):
+        durations = sorted(self.durations)
+        completion_tokens = sorted(self.completion_tokens)
+        return {
+            "count": self.count,
+            "error_rate": self.errors / self.count if self.count else 0,
+            "cache_hit_rate": self.cache_hits / self.count if self.count else 0,
+            "p50_ms": percentile(durations, 0.50),
+            "p95_ms": percentile(durations, 0.95),
+            "p99_ms": percentile(durations, 0.99),
+            "mean_reply_chars": sum(self.reply_chars) / len(self.reply_chars) if self.reply_chars else None,
+            "completion_tokens_p50": percentile(completion_tokens, 0.50),
+            "completion_tokens_p95": percentile(completion_tokens, 0.95),
+            # Replies that hit max_tokens at least once
+            "truncated_rate": self.truncated / len(completion_tokens) if completion_tokens else 0,
+            "stages_p95_ms": {stage: percentile(sorted(values), 0.95) for stage, values in sorted(self.stages.items())},
+        }
+
+
+def analyze(records, by):
+    overall = Summary()
+    groups = {key: defaultdict(Summary) for key in by}
+    for record in records:
+        overall.add(record)
+        for key in by:
+            groups[key][str(record.get(key))].add(record)
+    return {
+        "overall": overall.report(),
+        "by": {key: {value: summary.report() for value, summary in sorted(groups[key].items(),
+                                                                          key=lambda item: -item[1].count)}
+               for key in by},
+    }
+
+
+def format_ms(value, decimals=0):
+    return "-" if value is None or (isinstance(value, float) and math.isnan(value)) else f"{value:.{decimals}f}"
+
+
+def print_report(report):
+    def row(name, summary):
+        print(f"  {name:<40} {summary['count']:>7} {summary['error_rate']:>6.1%} {summary['cache_hit_rate']:>6.1%} "
+              f"{format_ms(summary['p50_ms']):>8} {format_ms(summary['p95_ms']):>8} {format_ms(summary['p99_ms']):>8} "
+              f"{format_ms(summary['completion_tokens_p95']):>8} {summary['truncated_rate']:>6.1%}")
+
+    header = (f"  {'':<40} {'count':>7} {'errors':>6} {'cache':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'p95 tok':>8} {'trunc':>6}")
+    print(header)
+    row("all requests", report["overall"])
+    for stage, p95 in report["overall"]["stages_p95_ms"].items():
+        print(f"    {stage:<38} p95 {format_ms(p95, 1)} ms")
+    for key, groups in report["by"].items():
+        print(f"\nby {key}")
+        print(header)
+        for value, summary in groups.items():
+            row(value, summary)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency report from request event logs")
+    parser.add_argument("paths", nargs="+", help="JSONL files (globs and .gz accepted)")
+    parser.add_argument("--since", help="Only records at or after this ISO timestamp")
+    parser.add_argument("--until", help="Only records before this ISO timestamp")
+    parser.add_argument("--by", default="request_type,model,endpoint", help="Comma-separated breakdown fields")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    paths = sorted({match for pattern in args.paths for match in (glob.glob(pattern) or [pattern])})
+    report = analyze(read_events(paths, args.since, args.until), [key for key in args.by.split(",") if key])
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Cancellable generations: upstream calls that stop as soon as nobody wants their reply.
+
+Every /chat and /chat/stream request that calls OpenRouter itself runs as a
+generation with an id, picked by the client ("generation_id" in the request
+body, so a blocking /chat can be cancelled before its response arrives) or by
+the server, and returned in the X-Generation-Id header. POST
+/chat/<id>/cancel from the session that started it cancels a generation, and
+so does its client going away. Cancelling runs the callbacks the request
+registered: the sync views shut the upstream socket down, which wakes the
+thread blocked on it, and the async views cancel the task awaiting the
+upstream. OpenRouter sees the connection close and stops generating.
+
+A watcher thread notices clients that went away while their request waits on
+the upstream, by peeking at the client sockets of running generations (a
+stream also notices on the next event it fails to write). With a shared path
+configured, running generations are listed in a small SQLite table as well,
+so a cancel that lands on another gunicorn worker reaches the one running the
+generation: the watcher polls the table for cancels of its own generations.
+"""
+import logging
+import os
+import re
+import select
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+GENERATION_ID = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class GenerationCancelled(Exception):
+    """The generation was cancelled while its request was waiting on the upstream"""
+
+    def __init__(self, reason):
+        super().__init__(f"generation {reason}")
+        self.reason = reason
+
+
+class GenerationError(Exception):
+    """A generation id that cannot be used; the message is shown to the user"""
+
+
+class GenerationExists(GenerationError):
+    """A generation with this id is already running"""
+
+
+class Generation:
+    """One upstream call that can be cancelled from another thread"""
+
+    def __init__(self, generation_id, sid, disconnected=None):
+        self.id = generation_id
+        self.sid = sid                      # Only this session may cancel it
+        self.disconnected = disconnected    # Callable telling whether the client went away, polled by the watcher
+        self.reason = None                  # "cancelled" or "disconnected", once cancelled
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def on_cancel(self, callback):
+        """Run callback when the generation is cancelled, right away if it already is"""
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self, reason="cancelled"):
+        """Cancel the generation; returns False if it already was"""
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        logger.info(f"Generation {self.id} {reason}, aborting its upstream call")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Cancel callback of generation {self.id} failed: {e}")
+        return True
+
+    def check(self):
+        """Raise GenerationCancelled once the generation is cancelled"""
+        if self.reason is not None:
+            raise GenerationCancelled(self.reason)
+
+
+def socket_disconnected(sock):
+    """Generation.disconnected for a WSGI server's client socket: True once the client has closed it"""
+    def disconnected():
+        try:
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            # Readable with nothing to read means the peer closed the connection
+            return bool(poller.poll(0)) and sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+    return disconnected
+
+
+class SharedGenerations:
+    """Generations running on the workers of one host, in an SQLite file they all open"""
+
+    def __init__(self, path, lease=600):
+        self.path = path
+        self.lease = lease  # Seconds after which a row left by a dead worker is dropped
+        self._local = threading.local()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS generations (
+                id TEXT PRIMARY KEY,
+                sid TEXT NOT NULL,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                started_at REAL NOT NULL
+            )
+        """)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def add(self, generation):
+        """List a generation; raises GenerationExists when its id is running on any worker"""
+        now = time.time()
+        db = self._connect()
+        db.execute("DELETE FROM generations WHERE started_at < ?", (now - self.lease,))
+        try:
+            db.execute("INSERT INTO generations (id, sid, started_at) VALUES (?, ?, ?)",
+                       (generation.id, generation.sid, now))
+        except sqlite3.IntegrityError:
+            raise GenerationExists(f"Generation {generation.id} is already running")
+
+    def remove(self, generation):
+        self._connect().execute("DELETE FROM generations WHERE id = ?", (generation.id,))
+
+    def request_cancel(self, generation_id, sid):
+        """Flag a generation of session sid for cancelling; returns whether one was running"""
+        cursor = self._connect().execute(
+            "UPDATE generations SET cancel_requested = 1 WHERE id = ? AND sid = ?", (generation_id, sid))
+        return cursor.rowcount > 0
+
+    def cancel_requested(self, generation_ids):
+        """Ids among generation_ids whose cancelling was requested"""
+        placeholders = ",".join("?" * len(generation_ids))
+        rows = self._connect().execute(
+            f"SELECT id FROM generations WHERE cancel_requested = 1 AND id IN ({placeholders})", generation_ids)
+        return [row[0] for row in rows]
+
+
+class GenerationRegistry:
+    """Generations running in this worker, cancellable by id"""
+
+    def __init__(self, shared=None, poll_interval=0.25, on_cancel=None):
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self.on_cancel = on_cancel  # Called with the reason of every cancelled generation
+        self.started = 0
+        self.cancelled = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._watcher = None
+
+    def start(self, generation_id, sid, disconnected=None):
+        """Register a generation (with a new id when generation_id is None); raises GenerationError"""
+        if generation_id is not None and not (isinstance(generation_id, str) and GENERATION_ID.match(generation_id)):
+            raise GenerationError("generation_id must be 8 to 64 letters, digits, '-' or '_'")
+        generation = Generation(generation_id or uuid.uuid4().hex, sid, disconnected)
+        with self._lock:
+            if generation.id in self._generations:
+                raise GenerationExists(f"Generation {generation.id} is already running")
+            self._generations[generation.id] = generation
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="generation-watcher", daemon=True)
+                self._watcher.start()
+        if self.shared is not None:
+            try:
+                self.shared.add(generation)
+            except GenerationExists:
+                self._forget(generation)
+                raise
+            except sqlite3.Error as e:
+                logger.error(f"Shared generation write failed, only cancellable on this worker: {e}")
+        with self._lock:
+            self.started += 1
+        generation.on_cancel(lambda: self._cancelled(generation))
+        self._wake.set()
+        return generation
+
+    def finish(self, generation):
+        """Unregister a generation once its request is over"""
+        if self._forget(generation) and self.shared is not None:
+            try:
+                self.shared.remove(generation)
+            except sqlite3.Error as e:
+                logger.error(f"Shared generation removal failed: {e}")
+
+    def _forget(self, generation):
+        with self._lock:
+            if self._generations.get(generation.id) is generation:
+                del self._generations[generation.id]
+                return True
+        return False
+
+    def cancel(self, generation_id, sid):
+        """Cancel a generation of session sid, on this worker or, through the shared table, another one.
+
+        Returns whether such a generation was running.
+        """
+        with self._lock:
+            generation = self._generations.get(generation_id)
+        if generation is not None and generation.sid == sid:
+            generation.cancel()
+            return True
+        if self.shared is not None:
+            try:
+                return self.shared.request_cancel(generation_id, sid)
+            except sqlite3.Error as e:
+                logger.error(f"Shared generation cancel failed: {e}")
+        return False
+
+    def _cancelled(self, generation):
+        with self._lock:
+            self.cancelled += 1
+        if self.on_cancel is not None:
+            self.on_cancel(generation.reason)
+
+    def _watch(self):
+        while True:
+            with self._lock:
+                running = [generation for generation in self._generations.values() if not generation.cancelled]
+            if not running:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            for generation in running:
+                if generation.disconnected is not None and generation.disconnected():
+                    generation.cancel("disconnected")
+            if self.shared is not None:
+                by_id = {generation.id: generation for generation in running if not generation.cancelled}
+                try:
+                    requested = self.shared.cancel_requested(list(by_id)) if by_id else []
+                except sqlite3.Error as e:
+                    logger.error(f"Shared generation poll failed: {e}")
+                    requested = []
+                for generation_id in requested:
+                    by_id[generation_id].cancel()
+            time.sleep(self.poll_interval)
+
+    def snapshot(self):
+        with self._lock:
+            return {"running": len(self._generations), "started": self.started, "cancelled": self.cancelled}
+
+
+def create_generation_registry(shared_path=None, poll_interval=0.25, on_cancel=None):
+    """GenerationRegistry for this worker, reachable from sibling workers when shared_path is given"""
+    shared = None
+    if shared_path:
+        os.makedirs(os.path.dirname(os.path.abspath(shared_path)), exist_ok=True)
+        shared = SharedGenerations(shared_path)
+    return GenerationRegistry(shared, poll_interval, on_cancel)
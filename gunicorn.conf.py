@@ -0,0 +1,59 @@
+"""gunicorn settings (read automatically from the working directory).
+
+    gunicorn                                          # app:create_app() on the sync worker
+    SERVING_MODE=aio gunicorn                         # aio_app:app on the aiohttp worker
+    gunicorn app:create_app() --worker-class gthread --threads 8
+
+SERVING_MODE picks the application and its default worker class
+(GUNICORN_WORKER_CLASS overrides the latter); the Flask app is the default.
+The app is loaded once in the master (GUNICORN_PRELOAD=0 loads it in each
+worker instead): imports, the asset bundle and the warm-up (template compile,
+regexes, system prompts) happen before the fork and the workers share those
+pages copy-on-write. The garbage collector stays off while the app loads and
+everything loaded is frozen before forking, so collections in a worker never
+write to, and thereby copy, the shared pages. Each worker then opens its own
+stores and upstream connection as it starts.
+"""
+import gc
+import os
+
+SERVING_MODES = {
+    "wsgi": ("app:create_app()", "sync"),
+    "aio": ("aio_app:app", "aiohttp.GunicornWebWorker"),
+}
+wsgi_app, default_worker_class = SERVING_MODES[os.getenv("SERVING_MODE", "wsgi")]
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", default_worker_class)
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Directory the workers share their metrics through (see metrics.py)
+metrics_dir = os.getenv("METRICS_DIR")
+
+if preload_app:
+    gc.disable()
+
+
+def on_starting(server):
+    if metrics_dir:
+        from metrics import clear_directory
+        clear_directory(metrics_dir)
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        gc.freeze()
+        gc.enable()
+
+
+def post_worker_init(worker):
+    import app
+    # The aiohttp worker preconnects its own upstream session (aio_app.open_upstream_client)
+    app.warm_up_worker(preconnect=not worker.cfg.worker_class_str.startswith("aiohttp"))
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counters, drop its gauges (admission load and the like)
+    if metrics_dir:
+        from metrics import mark_process_dead
+        mark_process_dead(metrics_dir, worker.pid)
@@ -0,0 +1,201 @@
+"""Background chat jobs for long generations.
+
+POST /jobs answers at once with a job id; the generation runs on a bounded
+thread pool in the worker that accepted it, detached from the HTTP request.
+Its output is written to an SQLite table as it streams in, so any worker can
+answer GET /jobs/<id> and /jobs/<id>/stream from any offset, and a client
+that lost its connection resumes where it stopped instead of starting over.
+
+The worker refreshes its queued and running jobs every third of the lease;
+a job whose worker died (restart, crash) stops being refreshed and, once it
+has been silent for longer than the lease, reads as "interrupted".
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ("done", "error", "interrupted")
+
+
+class JobsFull(Exception):
+    """Every job slot of this worker is taken"""
+
+
+class JobStore:
+    """Job state and partial output in one SQLite file shared by the workers"""
+
+    def __init__(self, path, lease=300, ttl=24 * 3600, write_interval=0.5):
+        self.path = path
+        self.lease = lease                  # Seconds without an update after which a running job is dead
+        self.ttl = ttl                      # Seconds finished jobs stay retrievable
+        self.write_interval = write_interval
+        self._local = threading.local()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                sid TEXT NOT NULL,
+                request_type TEXT,
+                status TEXT NOT NULL,
+                content TEXT NOT NULL DEFAULT '',
+                body TEXT,
+                model TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def create(self, sid, request_type):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        db = self._connect()
+        db.execute("DELETE FROM jobs WHERE updated_at < ?", (now - self.ttl,))
+        db.execute(
+            "INSERT INTO jobs (id, sid, request_type, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+            (job_id, sid, request_type, now, now)
+        )
+        return job_id
+
+    def update(self, job_id, status, content=None, body=None, model=None):
+        """Record progress or the outcome; content is the whole output so far"""
+        try:
+            self._connect().execute(
+                "UPDATE jobs SET status = ?, content = COALESCE(?, content), body = COALESCE(?, body), "
+                "model = COALESCE(?, model), updated_at = ? WHERE id = ?",
+                (status, content, None if body is None else json.dumps(body), model, time.time(), job_id)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Job {job_id} update failed: {e}")
+
+    def touch(self, job_ids):
+        """Mark jobs as alive"""
+        if not job_ids:
+            return
+        try:
+            self._connect().execute(
+                f"UPDATE jobs SET updated_at = ? WHERE id IN ({', '.join('?' * len(job_ids))})",
+                (time.time(), *job_ids)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Job heartbeat failed: {e}")
+
+    def get(self, job_id, sid):
+        """Job of session sid as a dict, or None"""
+        row = self._connect().execute(
+            "SELECT status, content, body, model, request_type, created_at, updated_at FROM jobs "
+            "WHERE id = ? AND sid = ?", (job_id, sid)
+        ).fetchone()
+        if row is None:
+            return None
+        status, content, body, model, request_type, created_at, updated_at = row
+        if status not in FINISHED and updated_at < time.time() - self.lease:
+            status = "interrupted"
+        return {
+            "id": job_id,
+            "status": status,
+            "content": content,
+            "body": None if body is None else json.loads(body),
+            "model": model,
+            "request_type": request_type,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+
+class Job:
+    """Handle a running job reports through; progress writes are throttled"""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.id = job_id
+        self.parts = []
+        self._written = 0.0
+
+    def start(self):
+        self.store.update(self.id, "running")
+
+    def publish(self, delta):
+        self.parts.append(delta)
+        if time.monotonic() - self._written >= self.store.write_interval:
+            self._written = time.monotonic()
+            self.store.update(self.id, "running", ''.join(self.parts))
+
+    def finish(self, status, body, model=None):
+        self.store.update(self.id, status, ''.join(self.parts), body, model)
+
+
+class JobRunner:
+    """Bounded pool running this worker's jobs"""
+
+    def __init__(self, store, workers=4, max_pending=32, on_finish=None):
+        self.store = store
+        self.max_pending = max_pending          # Queued plus running jobs
+        self.on_finish = on_finish
+        self.pending = 0
+        self.running = 0
+        self.finished = {}
+        self._live = set()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.store.lease / 3)
+            with self._lock:
+                live = list(self._live)
+            self.store.touch(live)
+
+    def submit(self, sid, request_type, run):
+        """Queue run(job) and return the job id; raises JobsFull when every slot is taken"""
+        with self._lock:
+            if self.pending + self.running >= self.max_pending:
+                raise JobsFull()
+            self.pending += 1
+        try:
+            job = Job(self.store, self.store.create(sid, request_type))
+            with self._lock:
+                self._live.add(job.id)
+            self._executor.submit(self._run, job, run)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            raise
+        return job.id
+
+    def _run(self, job, run):
+        with self._lock:
+            self.pending -= 1
+            self.running += 1
+        status = "error"
+        try:
+            job.start()
+            status = run(job)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            job.finish("error", {"reply": "⚠️ Something went wrong. Please try again later."})
+        finally:
+            with self._lock:
+                self.running -= 1
+                self._live.discard(job.id)
+                self.finished[status] = self.finished.get(status, 0) + 1
+            if self.on_finish is not None:
+                self.on_finish(status)
+
+    def snapshot(self):
+        with self._lock:
+            return {"pending": self.pending, "running": self.running, "finished": dict(self.finished)}
@@ -0,0 +1,42 @@
+"""Components built on first use, once per process.
+
+Importing app.py only describes the heavy components (stores, caches,
+background threads, the upstream connection pool); each is built the first
+time a request uses it. That keeps imports fast and makes the app safe to
+preload in the gunicorn master: nothing that owns a thread, a socket or an
+SQLite connection exists before the fork, and anything built in the master
+anyway is built again in each worker instead of being shared with it.
+"""
+import os
+import threading
+
+
+class Lazy:
+    """Proxy for the object factory() returns, built in each process on first attribute access"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._pid = None
+        self._inherited = []
+        self._lock = threading.Lock()
+
+    def instance(self):
+        """The object for this process, built on the first call"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    if self._instance is not None:
+                        # Built before a fork: never used here, but kept alive, since finalizing it could
+                        # close connections the parent still uses
+                        self._inherited.append(self._instance)
+                    self._instance = self._factory()
+                    self._pid = os.getpid()
+        return self._instance
+
+    @property
+    def built(self):
+        return self._pid == os.getpid()
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
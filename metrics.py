@@ -0,0 +1,310 @@
+"""Prometheus text-format counters and histograms.
+
+Values live in the worker process. With a metrics directory configured, every
+worker writes its values to <dir>/worker-<pid>.json shortly after they change,
+and rendering sums all workers' files, so a scrape sees the whole gunicorn
+server no matter which worker answers it. Gauges are summed over live workers
+only (prometheus_client's livesum): once a worker exits, the gunicorn master
+calls mark_process_dead(), which folds its counters and histograms into
+<dir>/exited.json and removes its file, and a scrape skips the gauges of any
+worker file whose process is gone. The master clears the directory when it
+starts (clear_directory()).
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+INF_BUCKET = 'le="+Inf"'
+EXITED_FILE = "exited.json"
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def merge_value(total, value):
+    """Sum of two values of a metric: numbers, or per-bucket histogram states"""
+    if total is None:
+        return list(value) if isinstance(value, list) else value
+    if isinstance(value, list):
+        return [a + b for a, b in zip(total, value)]
+    return total + value
+
+
+class Metric:
+    """Base for labelled metrics; values maps label-value tuples to state"""
+
+    type = None
+    live = False  # Only counted while its worker runs
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.changed()
+
+    def render(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    """Current value per worker; the values of live workers are summed"""
+
+    type = 'gauge'
+    live = True
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if self.values.get(key) == value:
+                return
+            self.values[key] = value
+        self.registry.changed()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+        self.registry.changed()
+
+    def render(self, values):
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            labels = format_labels(self.labelnames, key)
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                bucket = f'le="{format_value(bound)}"'
+                yield f"{self.name}_bucket{format_labels(self.labelnames, key, bucket)} {cumulative}"
+            yield f"{self.name}_bucket{format_labels(self.labelnames, key, INF_BUCKET)} {state[-1]}"
+            yield f"{self.name}_sum{labels} {format_value(state[-2])}"
+            yield f"{self.name}_count{labels} {state[-1]}"
+
+
+class Registry:
+    """Named metrics of one process, optionally shared with sibling workers through files"""
+
+    def __init__(self, directory=None, flush_interval=2.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self._dirty = threading.Event()
+        self._flusher_pid = None
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(self, name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, help, labelnames, buckets))
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    @property
+    def path(self):
+        return worker_path(self.directory, os.getpid())
+
+    def changed(self):
+        if not self.directory:
+            return
+        self._dirty.set()
+        if self._flusher_pid != os.getpid():
+            # Started lazily so every forked worker gets its own flusher
+            with self._lock:
+                if self._flusher_pid != os.getpid():
+                    self._flusher_pid = os.getpid()
+                    threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.flush_interval)
+            self._dirty.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"Failed to write metrics file: {e}")
+
+    def dump(self):
+        """{"live": gauges, "cumulative": counters and histograms}, each {name: [[label values, value], ...]}"""
+        dumped = {"live": {}, "cumulative": {}}
+        for name, metric in self.metrics.items():
+            dumped["live" if metric.live else "cumulative"][name] = metric.dump()
+        return dumped
+
+    def flush(self):
+        """Write this worker's values for the other workers' scrapes"""
+        write_dump(self.path, self.dump())
+
+    def collect(self):
+        """Values summed over every worker: {name: {label tuple: value}}"""
+        dumps = [self.dump()]
+        if self.directory:
+            own = os.path.abspath(self.path)
+            for path in glob.glob(os.path.join(self.directory, "worker-*.json")):
+                if os.path.abspath(path) == own:
+                    continue
+                dumped = read_dump(path)
+                if dumped is not None and not pid_alive(worker_pid(path)):
+                    dumped.pop("live", None)  # Exited without the master cleaning up after it
+                dumps.append(dumped)
+            dumps.append(read_dump(os.path.join(self.directory, EXITED_FILE)))
+        return merge_dumps(dumps, self.metrics)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+def worker_path(directory, pid):
+    return os.path.join(directory, f"worker-{pid}.json")
+
+
+def worker_pid(path):
+    return int(os.path.basename(path)[len("worker-"):-len(".json")])
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Alive, just not ours
+        pass
+    return True
+
+
+def read_dump(path):
+    """A worker's dumped values, or None if its file is gone or unreadable"""
+    try:
+        with open(path) as f:
+            dumped = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Skipping unreadable metrics file {path}: {e}")
+        return None
+    if not isinstance(dumped, dict) or not all(isinstance(section, dict) for section in dumped.values()):
+        logger.warning(f"Skipping metrics file {path} in an unknown format")
+        return None
+    return dumped
+
+
+def merge_dumps(dumps, names=None):
+    """Values summed over dumps (None entries skipped): {name: {label tuple: value}}, only of names if given"""
+    totals = {name: {} for name in names} if names is not None else {}
+    for dumped in dumps:
+        if dumped is None:
+            continue
+        for section in dumped.values():
+            for name, entries in section.items():
+                if names is not None and name not in names:
+                    continue
+                values = totals.setdefault(name, {})
+                for key, value in entries:
+                    key = tuple(key)
+                    values[key] = merge_value(values.get(key), value)
+    return totals
+
+
+def write_dump(path, dumped):
+    """Write dumped values atomically (write to a temporary file, then rename)"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(dumped, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def mark_process_dead(directory, pid):
+    """Fold an exited worker's counters and histograms into exited.json and remove its file, gauges and all.
+
+    Called by the gunicorn master (child_exit), one worker at a time.
+    """
+    path = worker_path(directory, pid)
+    dumped = read_dump(path)
+    if dumped is not None:
+        exited_path = os.path.join(directory, EXITED_FILE)
+        totals = merge_dumps([read_dump(exited_path), {"cumulative": dumped.get("cumulative", {})}])
+        write_dump(exited_path, {"cumulative": {name: [[list(key), value] for key, value in values.items()]
+                                                for name, values in totals.items()}})
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def clear_directory(directory):
+    """Remove every worker's values, for a server starting afresh"""
+    for path in glob.glob(os.path.join(directory, "*.json")) + glob.glob(os.path.join(directory, "*.json.tmp")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
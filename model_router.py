@@ -0,0 +1,574 @@
+"""Fallback and hedged requests across an ordered list of models.
+
+Models are tried front to back: one that errors, times out or answers with an
+error body is skipped for the next. A model that answers with a retryable
+status (429, 5xx) is not retried while another model is left to try, and each
+model has its own circuit breaker, so one rate-limited or failing model is
+skipped without cutting the request off from the healthy ones. With hedging on, a duplicate request goes
+to the next model once the current one has produced no output for longer than
+it usually takes (its recent p95, or twice its EWMA until enough samples
+exist). The first model to produce output wins and the other request is
+cancelled. Hedges are capped at a fraction of all requests, so a slow upstream
+cannot make every request cost double.
+
+"Output" is the first content delta for streamed completions and the whole
+body otherwise; per-model latency stats are kept separately for the two.
+"""
+import asyncio
+import logging
+import queue
+import socket
+import threading
+import time
+from collections import deque
+
+import requests
+
+from upstream import CircuitBreaker, CircuitOpenError, UpstreamStreamError, parse_stream_line
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyWindow:
+    """EWMA and a window of recent samples for one model and response mode"""
+
+    def __init__(self, alpha=0.2, size=200):
+        self.alpha = alpha
+        self.samples = deque(maxlen=size)
+        self.ewma = None
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+            self.ewma = seconds if self.ewma is None else self.alpha * seconds + (1 - self.alpha) * self.ewma
+
+    def percentile(self, q):
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def snapshot(self):
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+        return {
+            "samples": len(self.samples),
+            "ewma_ms": ms(self.ewma),
+            "p50_ms": ms(self.percentile(0.5)),
+            "p95_ms": ms(self.percentile(0.95)),
+            "p99_ms": ms(self.percentile(0.99)),
+        }
+
+
+class ModelStats:
+    """Outcome counters and time-to-first-output windows for one model"""
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.latency = {'stream': LatencyWindow(), 'complete': LatencyWindow()}
+        self._lock = threading.Lock()
+
+    def add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def snapshot(self):
+        with self._lock:
+            counters = {
+                "successes": self.successes,
+                "failures": self.failures,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+            }
+        return dict(counters, latency={mode: window.snapshot() for mode, window in self.latency.items()})
+
+
+class HedgePolicy:
+    """When (and whether) to send a duplicate request to the next model"""
+
+    def __init__(self, enabled=False, min_delay=1.0, max_delay=30.0, initial_delay=10.0,
+                 min_samples=20, max_ratio=0.1):
+        self.enabled = enabled
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay  # Used until a model has any samples
+        self.min_samples = min_samples  # Samples needed before trusting the p95
+        self.max_ratio = max_ratio  # Most hedges allowed per routed request
+
+    def delay(self, window):
+        """Seconds of silence from a model before hedging it"""
+        if len(window) >= self.min_samples:
+            delay = window.percentile(0.95)
+        elif window.ewma is not None:
+            delay = 2 * window.ewma
+        else:
+            delay = self.initial_delay
+        return min(max(delay, self.min_delay), self.max_delay)
+
+
+class ModelFailure(Exception):
+    """One model could not answer; carries its error response or exception"""
+
+    def __init__(self, model, response=None, error=None):
+        super().__init__(f"{model} failed")
+        self.model = model
+        self.response = response
+        self.error = error
+
+    def result(self):
+        """What the caller sees when this was the last model tried"""
+        if self.response is not None:
+            return self.response
+        raise self.error
+
+
+class RoutedResponse:
+    """Upstream response plus the model that produced it and any lines read ahead"""
+
+    def __init__(self, response, model, prefetched=(), lines=None):
+        self.response = response
+        self.model = model
+        self.prefetched = list(prefetched)
+        self.lines = lines
+        self.ttfb = None  # Seconds from routing to this response's headers
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def iter_lines(self):
+        """Decoded SSE lines, starting with those read while waiting for output"""
+        yield from self.prefetched
+        if self.lines is not None:
+            yield from self.lines
+
+
+class AsyncRoutedResponse(RoutedResponse):
+    """aiohttp flavour of RoutedResponse; use it as an async context manager"""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.response.release()
+
+    async def iter_lines(self):
+        for line in self.prefetched:
+            yield line
+        async for raw_line in self.response.content:
+            yield raw_line.decode('utf-8').strip()
+
+
+class Inflight:
+    """Upstream calls of one request or hedged attempt, so they can be aborted from another thread.
+
+    Aborting a parent (a whole cancelled request) also aborts its hedged
+    attempts.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.responses = []
+        self.children = []
+        self.connection = None  # Connection of a request still waiting for its response headers
+        self._aborted = threading.Event()
+        self._lock = threading.Lock()
+        if parent is not None:
+            parent.adopt(self)
+
+    @property
+    def cancelled(self):
+        return self._aborted.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def wait(self, timeout):
+        """Sleep up to timeout seconds, waking as soon as the calls are aborted; True if they were"""
+        return self._aborted.wait(timeout) or self.cancelled
+
+    def adopt(self, child):
+        with self._lock:
+            self.children.append(child)
+        if self._aborted.is_set():
+            child.abort()
+
+    def sending(self, connection):
+        """UpstreamClient callback: the connection a request now waits on, or None once its headers arrived"""
+        with self._lock:
+            self.connection = connection
+        if connection is not None and self.cancelled:
+            abort_connection(connection)
+
+    def attach(self, response):
+        with self._lock:
+            self.responses.append(response)
+        if self.cancelled:
+            abort_response(response)  # Aborted before its headers arrived
+
+    def abort(self):
+        with self._lock:
+            self._aborted.set()
+            connection = self.connection
+            responses = list(self.responses)
+            children = list(self.children)
+        if connection is not None:
+            abort_connection(connection)
+        for response in responses:
+            abort_response(response)
+        for child in children:
+            child.abort()
+
+
+def abort_connection(connection):
+    """Shut a connection's socket down from another thread, waking a reader blocked on it"""
+    sock = getattr(connection, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def abort_response(response):
+    """Close a requests response from another thread, waking a reader blocked on it"""
+    abort_connection(getattr(response.raw, '_connection', None))
+    response.close()
+
+
+class BaseModelRouter:
+    """Model order, hedging policy and stats shared by the sync and async routers"""
+
+    def __init__(self, client, models, hedge_policy=None, stats=None, breakers=None):
+        if not models:
+            raise ValueError("At least one model is required")
+        self.client = client
+        self.models = list(models)
+        self.hedge_policy = hedge_policy or HedgePolicy()
+        self.stats = stats if stats is not None else {model: ModelStats() for model in self.models}
+        self.breakers = breakers if breakers is not None else {model: CircuitBreaker() for model in self.models}
+        self.routed = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def _begin(self):
+        with self._lock:
+            self.routed += 1
+        return self.hedge_policy.enabled and len(self.models) > 1
+
+    def _hedge_delay(self, model, streamed):
+        return self.hedge_policy.delay(self.stats[model].latency['stream' if streamed else 'complete'])
+
+    def _take_hedge(self, model):
+        """Claim a hedge unless that would exceed the policy's hedge ratio"""
+        with self._lock:
+            # One hedge of slack so the very first slow requests can be hedged too
+            if self.hedges >= self.hedge_policy.max_ratio * self.routed + 1:
+                return False
+            self.hedges += 1
+        self.stats[model].add(hedges=1)
+        return True
+
+    def _succeeded(self, model, streamed, started):
+        self.stats[model].add(successes=1)
+        self.stats[model].latency['stream' if streamed else 'complete'].observe(time.monotonic() - started)
+
+    def _upstream_options(self, model):
+        """client.post arguments for one model: its circuit breaker, and no retries while a later model can answer"""
+        later = self.models[self.models.index(model) + 1:]
+        return {"breaker": self.breakers[model], "fallback": any(not self.breakers[m].is_open for m in later)}
+
+    def _skipped(self, model, error):
+        logger.info(f"Model {model} skipped ({error}), trying the next model")
+        return ModelFailure(model, error=error)
+
+    def _failed(self, model, reason, inflight=None):
+        if inflight is not None and inflight.cancelled:
+            return  # Aborted because another model won, not a failure
+        self.stats[model].add(failures=1)
+        logger.warning(f"Model {model} failed ({reason}), trying the next model")
+
+    def snapshot(self):
+        with self._lock:
+            totals = {"routed": self.routed, "hedges": self.hedges}
+        return dict(
+            totals,
+            hedging=self.hedge_policy.enabled,
+            models={model: dict(self.stats[model].snapshot(), circuit=self.breakers[model].snapshot())
+                    for model in self.models},
+        )
+
+
+class ModelRouter(BaseModelRouter):
+    """Routes the sync views' OpenRouter calls through UpstreamClient"""
+
+    def post(self, headers, payload, inflight=None):
+        """POST the payload to the first model that answers; returns a RoutedResponse.
+
+        Same contract as UpstreamClient.post: once every model has failed, the
+        last error response is returned (or the last exception raised). Bodies
+        are read lazily, so streamed payloads can be relayed as they arrive.
+        Aborting inflight aborts the request: its failure is returned or raised
+        as is, without trying the remaining models.
+        """
+        started = time.monotonic()
+        if self._begin():
+            return self._post_hedged(headers, payload, started, inflight)
+        failure = None
+        for model in self.models:
+            try:
+                return self._attempt(model, headers, payload, started, inflight)
+            except ModelFailure as e:
+                if failure is not None and failure.response is not None:
+                    failure.response.close()
+                failure = e
+            if inflight is not None and inflight.cancelled:
+                break
+        return failure.result()
+
+    def _attempt(self, model, headers, payload, started, inflight=None):
+        streamed = bool(payload.get('stream'))
+        attempt_started = time.monotonic()
+        try:
+            response = self.client.post(headers, dict(payload, model=model), stream=True, inflight=inflight,
+                                        **self._upstream_options(model))
+        except CircuitOpenError as e:
+            raise self._skipped(model, e)
+        except requests.exceptions.RequestException as e:
+            self._failed(model, e.__class__.__name__, inflight)
+            raise ModelFailure(model, error=e)
+        if inflight is not None:
+            inflight.attach(response)
+
+        routed = RoutedResponse(response, model)
+        routed.ttfb = time.monotonic() - started
+        if response.status_code != 200:
+            self._failed(model, f"status {response.status_code}", inflight)
+            raise ModelFailure(model, response=routed)
+        try:
+            if streamed:
+                # Read up to the first content delta so a silent model can still be hedged or skipped
+                response.encoding = 'utf-8'
+                routed.lines = response.iter_lines(decode_unicode=True)
+                for line in routed.lines:
+                    routed.prefetched.append(line)
+                    delta = parse_stream_line(line)
+                    if delta is None or delta:
+                        break
+                else:
+                    raise UpstreamStreamError("stream ended without output")
+            elif "choices" not in response.json():
+                self._failed(model, "error body", inflight)
+                raise ModelFailure(model, response=routed)
+        except (ValueError, UpstreamStreamError, requests.exceptions.RequestException) as e:
+            self._failed(model, e.__class__.__name__, inflight)
+            response.close()
+            raise ModelFailure(model, error=e)
+        self._succeeded(model, streamed, attempt_started)
+        return routed
+
+    def _post_hedged(self, headers, payload, started, parent=None):
+        streamed = bool(payload.get('stream'))
+        results = queue.Queue()
+        inflight = {}
+        pending = iter(self.models)
+        running = 0
+
+        def run(model, hedged):
+            try:
+                results.put((model, hedged, self._attempt(model, headers, payload, started, inflight[model]), None))
+            except Exception as e:
+                results.put((model, hedged, None, e))
+
+        def launch(model, hedged):
+            nonlocal running
+            inflight[model] = Inflight(parent)
+            running += 1
+            threading.Thread(target=run, args=(model, hedged), name=f"model-{model}", daemon=True).start()
+
+        model = next(pending)
+        launch(model, False)
+        hedge_at = time.monotonic() + self._hedge_delay(model, streamed)
+        winner = failure = None
+        while running:
+            timeout = None if hedge_at is None else max(hedge_at - time.monotonic(), 0)
+            try:
+                model, hedged, routed, error = results.get(timeout=timeout)
+            except queue.Empty:
+                hedge_at = None
+                if parent is not None and parent.cancelled:
+                    continue
+                backup = next(pending, None)
+                if backup is not None and self._take_hedge(backup):
+                    logger.info(f"No output from {model} yet, hedging with {backup}")
+                    launch(backup, True)
+                continue
+
+            running -= 1
+            if routed is not None:
+                winner = routed
+                if hedged:
+                    self.stats[model].add(hedge_wins=1)
+                break
+            if isinstance(failure, ModelFailure) and failure.response is not None:
+                failure.response.close()
+            failure = error
+            if parent is not None and parent.cancelled:
+                continue
+            if running == 0:
+                # Fall back right away instead of waiting for the hedge timer
+                fallback = next(pending, None)
+                if fallback is not None:
+                    launch(fallback, False)
+                    if hedge_at is not None:
+                        hedge_at = time.monotonic() + self._hedge_delay(fallback, streamed)
+
+        if winner is None:
+            if isinstance(failure, ModelFailure):
+                return failure.result()
+            raise failure
+
+        if isinstance(failure, ModelFailure) and failure.response is not None:
+            failure.response.close()
+        for model, attempt in inflight.items():
+            if model != winner.model:
+                attempt.abort()
+        if running:
+            threading.Thread(target=self._discard, args=(results, running), daemon=True).start()
+        return winner
+
+    @staticmethod
+    def _discard(results, count):
+        """Close whatever the cancelled requests still return"""
+        for _ in range(count):
+            model, hedged, routed, error = results.get()
+            if routed is not None:
+                routed.response.close()
+            elif isinstance(error, ModelFailure) and error.response is not None:
+                error.response.close()
+
+
+class AsyncModelRouter(BaseModelRouter):
+    """Routes the async serving mode's OpenRouter calls through AsyncUpstreamClient"""
+
+    async def post(self, headers, payload):
+        """Async counterpart of ModelRouter.post returning an AsyncRoutedResponse"""
+        started = time.monotonic()
+        if self._begin():
+            return await self._post_hedged(headers, payload, started)
+        failure = None
+        for model in self.models:
+            try:
+                return await self._attempt(model, headers, payload, started)
+            except ModelFailure as e:
+                if failure is not None and failure.response is not None:
+                    failure.response.release()
+                failure = e
+        return failure.result()
+
+    async def _attempt(self, model, headers, payload, started):
+        import aiohttp
+
+        streamed = bool(payload.get('stream'))
+        attempt_started = time.monotonic()
+        try:
+            response = await self.client.post(headers, dict(payload, model=model), **self._upstream_options(model))
+        except CircuitOpenError as e:
+            raise self._skipped(model, e)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._failed(model, e.__class__.__name__)
+            raise ModelFailure(model, error=e)
+
+        routed = AsyncRoutedResponse(response, model)
+        routed.ttfb = time.monotonic() - started
+        if response.status != 200:
+            self._failed(model, f"status {response.status}")
+            raise ModelFailure(model, response=routed)
+        try:
+            if streamed:
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').strip()
+                    routed.prefetched.append(line)
+                    delta = parse_stream_line(line)
+                    if delta is None or delta:
+                        break
+                else:
+                    raise UpstreamStreamError("stream ended without output")
+            elif "choices" not in await response.json(content_type=None):
+                self._failed(model, "error body")
+                raise ModelFailure(model, response=routed)
+        except (ValueError, UpstreamStreamError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._failed(model, e.__class__.__name__)
+            response.release()
+            raise ModelFailure(model, error=e)
+        except asyncio.CancelledError:
+            response.release()
+            raise
+        self._succeeded(model, streamed, attempt_started)
+        return routed
+
+    async def _post_hedged(self, headers, payload, started):
+        streamed = bool(payload.get('stream'))
+        loop = asyncio.get_running_loop()
+        tasks = {}
+        pending = iter(self.models)
+
+        def launch(model, hedged):
+            tasks[asyncio.ensure_future(self._attempt(model, headers, payload, started))] = (model, hedged)
+
+        model = next(pending)
+        launch(model, False)
+        hedge_at = loop.time() + self._hedge_delay(model, streamed)
+        winner = failure = None
+        try:
+            while tasks and winner is None:
+                timeout = None if hedge_at is None else max(hedge_at - loop.time(), 0)
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    backup = next(pending, None)
+                    if backup is not None and self._take_hedge(backup):
+                        logger.info(f"No output from {model} yet, hedging with {backup}")
+                        launch(backup, True)
+                    continue
+
+                for task in done:
+                    model, hedged = tasks.pop(task)
+                    error = task.exception()
+                    if error is None and winner is None:
+                        winner = task.result()
+                        if hedged:
+                            self.stats[model].add(hedge_wins=1)
+                    elif error is None:
+                        task.result().response.release()
+                    else:
+                        if isinstance(failure, ModelFailure) and failure.response is not None:
+                            failure.response.release()
+                        failure = error
+                if winner is None and not tasks:
+                    # Fall back right away instead of waiting for the hedge timer
+                    fallback = next(pending, None)
+                    if fallback is not None:
+                        launch(fallback, False)
+                        if hedge_at is not None:
+                            hedge_at = loop.time() + self._hedge_delay(fallback, streamed)
+
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()  # The caller was cancelled: so is every attempt
+            raise
+
+        for task in tasks:
+            task.cancel()
+        if winner is None:
+            if isinstance(failure, ModelFailure):
+                return failure.result()
+            raise failure
+        if isinstance(failure, ModelFailure) and failure.response is not None:
+            failure.response.release()
+        return winner
@@ -0,0 +1,123 @@
+"""Token-budgeted prompt assembly.
+
+History is chosen by size instead of message count: fixed parts (system
+prompts, context, the user's new message) always go in, then earlier messages
+are packed newest-first until the request type's token budget is spent. Code
+the user pasted is sent once: the analysis context refers to the blocks in
+the user's message instead of repeating them, and older copies of a block
+that appears again later in the conversation are replaced by a short
+reference. A pasted block whose earlier version is already in the prompt is
+sent as a diff against it (see code_store).
+"""
+import hashlib
+import json
+import logging
+import os
+
+from classifier import FENCED_CODE
+from code_store import diff_code_blocks
+
+logger = logging.getLogger(__name__)
+
+# Whole-prompt token budgets per request type (override with PROMPT_TOKEN_BUDGETS='{"debug_code": 8000}')
+DEFAULT_TOKEN_BUDGETS = {
+    'debug_code': 6000,
+    'optimize_code': 6000,
+    'explain_code': 6000,
+    'enhance_code': 8000,
+    'create_code': 8000,
+    'analyze_code': 6000,
+    'general_chat': 4000,
+}
+TOKEN_BUDGETS = dict(DEFAULT_TOKEN_BUDGETS, **json.loads(os.getenv("PROMPT_TOKEN_BUDGETS", "{}")))
+
+# Role/formatting tokens the chat template adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """Rough token count: ~4 characters per token for English and code"""
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def block_hash(code):
+    return hashlib.sha1(code.strip().encode('utf-8')).hexdigest()
+
+
+def code_block_references(code_blocks, diffable=()):
+    """Describe the user's code blocks without repeating their contents.
+
+    diffable holds the positions of blocks that may go as a unified diff
+    against an earlier version instead of in full.
+    """
+    lines = []
+    for i, block in enumerate(code_blocks):
+        line_count = block['code'].count('\n') + 1
+        where = "included in the user's latest message"
+        if i in diffable:
+            where += ", in full or, where labelled so, as a unified diff against an earlier version shown in full above"
+        lines.append(f"Code Block {i+1} ({block['language']}, {line_count} lines): {where}")
+    return "\n".join(lines)
+
+
+def dedupe_code_blocks(history):
+    """Replace code blocks that reappear later in the history with a short reference.
+
+    history is oldest-first; the newest copy of every block is kept.
+    """
+    seen = set()
+    deduped = []
+    for msg in reversed(history):
+        def replace(match):
+            digest = block_hash(match.group(2))
+            if digest in seen:
+                language = match.group(1) or 'text'
+                return f"[{language} code omitted: identical to a code block in a later message]"
+            seen.add(digest)
+            return match.group(0)
+
+        content = msg["content"]
+        if '```' in content:
+            content = FENCED_CODE.sub(replace, content)
+        deduped.append({"role": msg["role"], "content": content})
+    deduped.reverse()
+    return deduped
+
+
+def assemble_prompt(system_messages, history, request_type, versions=None):
+    """Build the messages array within the request type's token budget.
+
+    system_messages are always included; history is oldest-first and its last
+    entry (the user's new message) is always included. With versions (code
+    block digest to {"base", "version"}), pasted blocks whose earlier version
+    made it into the prompt are then sent as diffs against it: the same
+    messages, in fewer tokens. Returns (messages, prompt_tokens).
+    """
+    budget = TOKEN_BUDGETS.get(request_type, DEFAULT_TOKEN_BUDGETS['general_chat'])
+    history = dedupe_code_blocks(history)
+
+    used = sum(message_tokens(m) for m in system_messages)
+    packed = []
+    for position, msg in enumerate(reversed(history)):
+        tokens = message_tokens(msg)
+        if position > 0 and used + tokens > budget:
+            break
+        packed.append(msg)
+        used += tokens
+    packed.reverse()
+
+    # Don't open the history with a dangling assistant reply
+    while len(packed) > 1 and packed[0]["role"] == "assistant":
+        used -= message_tokens(packed.pop(0))
+
+    if versions:
+        packed = diff_code_blocks(packed, versions)
+        used = sum(message_tokens(m) for m in system_messages + packed)
+
+    logger.info(f"Prompt assembled for {request_type}: ~{used} tokens "
+                f"({len(packed)}/{len(history)} history messages, budget {budget})")
+    return system_messages + packed, used
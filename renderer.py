@@ -0,0 +1,187 @@
+"""Server-side rendering of assistant replies to ready-to-insert HTML.
+
+render_markdown() covers the same markdown as processMarkdown() in
+static/script.js (fenced code blocks, inline code, headers, bold/italic,
+lists, paragraphs) and produces the same markup, but escapes the reply text
+before adding any tag, so the result is safe for innerHTML.
+
+With Pygments installed, fenced code is tokenized here and emitted with
+Prism's class names ("token keyword", ...), so the page's Prism theme colours
+it without Prism running in the browser. Without it, code is left escaped and
+unhighlighted for Prism to pick up client-side.
+
+ReplyRenderer caches renders by a SHA-256 of the reply text, so a reply that
+is rendered for the response, stored with the message and served again from
+/chat-history is only parsed once.
+"""
+import hashlib
+import html
+import re
+
+try:
+    from pygments.lexers import get_lexer_by_name
+    from pygments.token import string_to_tokentype
+    from pygments.util import ClassNotFound
+except ImportError:  # Optional: without it code blocks are highlighted by Prism in the browser
+    get_lexer_by_name = None
+
+# Bump when the markup changes so cached renders are not reused
+RENDER_VERSION = 1
+
+CODE_FENCE = re.compile(r"```(\w*)\n([\s\S]*?)```")
+INLINE_CODE = re.compile(r"`([^`\n]+)`")
+INLINE_CODE_STYLE = ("background-color: var(--bg-tertiary); padding: 2px 6px; border-radius: 4px; "
+                     "font-family: monospace;")
+LIST_ITEM = re.compile(r"^(?:(\*|-)|(\d+)\.) (.*)$")
+HEADER = re.compile(r"^(#{1,3}) (.*)$")
+
+# Pygments token types to Prism token classes, most specific first
+PRISM_CLASSES = [
+    ("Comment", "comment"),
+    ("Keyword.Constant", "boolean"),
+    ("Keyword", "keyword"),
+    ("Name.Builtin", "builtin"),
+    ("Name.Function", "function"),
+    ("Name.Class", "class-name"),
+    ("Name.Decorator", "decorator"),
+    ("Name.Tag", "tag"),
+    ("Name.Attribute", "attr-name"),
+    ("Name.Variable", "variable"),
+    ("Name.Constant", "constant"),
+    ("String.Regex", "regex"),
+    ("String", "string"),
+    ("Number", "number"),
+    ("Operator.Word", "keyword"),
+    ("Operator", "operator"),
+    ("Punctuation", "punctuation"),
+]
+PRISM_TOKENS = [(string_to_tokentype(name), css_class) for name, css_class in PRISM_CLASSES] \
+    if get_lexer_by_name is not None else []
+
+
+def prism_class(token_type):
+    for parent, css_class in PRISM_TOKENS:
+        if token_type in parent:
+            return css_class
+    return None
+
+
+def highlight(code, language):
+    """Escaped code with Prism token spans, or plain escaped code when the language is unknown"""
+    if get_lexer_by_name is None or language == "text":
+        return html.escape(code)
+    try:
+        lexer = get_lexer_by_name(language, stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        return html.escape(code)
+    # Adjacent tokens of one class share a span ('"', 's', '"' is a single string)
+    runs = []
+    for token_type, value in lexer.get_tokens(code):
+        css_class = prism_class(token_type) if value.strip() else None
+        if runs and runs[-1][0] == css_class:
+            runs[-1][1].append(value)
+        else:
+            runs.append((css_class, [value]))
+    return ''.join(f'<span class="token {css_class}">{html.escape("".join(values))}</span>' if css_class
+                   else html.escape(''.join(values)) for css_class, values in runs)
+
+
+def render_code_block(code, language):
+    language = language or "text"
+    return (
+        '<div class="code-block">'
+        '<div class="code-header">'
+        f'<span>{html.escape(language)}</span>'
+        '<button class="copy-btn" onclick="copyCode(this)"><i class="fas fa-copy"></i> Copy</button>'
+        '</div>'
+        '<div class="code-content">'
+        f'<pre><code class="language-{html.escape(language)}">{highlight(code.strip(), language)}</code></pre>'
+        '</div>'
+        '</div>'
+    )
+
+
+def render_inline(text):
+    """Escape a line and apply inline code, bold and italic"""
+    parts = INLINE_CODE.split(text)
+    out = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            out.append(f'<code style="{INLINE_CODE_STYLE}">{html.escape(part)}</code>')
+        else:
+            part = html.escape(part, quote=False)
+            part = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", part)
+            part = re.sub(r"\*(.+?)\*", r"<em>\1</em>", part)
+            out.append(part)
+    return ''.join(out)
+
+
+def render_text(text):
+    """Markdown outside code fences: headers, lists and paragraphs"""
+    out = []
+    paragraph = []
+    list_tag = None
+
+    def close_paragraph():
+        if paragraph:
+            out.append(f"<p>{'<br>'.join(paragraph)}</p>")
+            paragraph.clear()
+
+    def close_list():
+        nonlocal list_tag
+        if list_tag:
+            out.append(f"</{list_tag}>")
+            list_tag = None
+
+    for line in text.split('\n'):
+        header = HEADER.match(line)
+        item = LIST_ITEM.match(line)
+        if not line.strip():
+            close_paragraph()
+            close_list()
+        elif header:
+            close_paragraph()
+            close_list()
+            level = len(header.group(1))
+            out.append(f"<h{level}>{render_inline(header.group(2))}</h{level}>")
+        elif item:
+            close_paragraph()
+            tag = "ol" if item.group(2) else "ul"
+            if tag != list_tag:
+                close_list()
+                out.append(f"<{tag}>")
+                list_tag = tag
+            out.append(f"<li>{render_inline(item.group(3))}</li>")
+        else:
+            close_list()
+            paragraph.append(render_inline(line))
+    close_paragraph()
+    close_list()
+    return ''.join(out)
+
+
+def render_markdown(text):
+    """Sanitized HTML for an assistant reply"""
+    out = []
+    position = 0
+    for fence in CODE_FENCE.finditer(text):
+        out.append(render_text(text[position:fence.start()]))
+        out.append(render_code_block(fence.group(2), fence.group(1)))
+        position = fence.end()
+    out.append(render_text(text[position:]))
+    return ''.join(out)
+
+
+class ReplyRenderer:
+    """render_markdown behind a cache keyed by a hash of the reply text"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def render(self, text):
+        key = f"{RENDER_VERSION}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+        rendered = self.cache.get(key)
+        if rendered is None:
+            rendered = render_markdown(text)
+            self.cache.set(key, rendered)
+        return rendered
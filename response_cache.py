@@ -0,0 +1,163 @@
+"""Content-addressed cache of AI replies for deterministic request types.
+
+Entries are keyed by a SHA-256 of the final request payload (model, messages
+and sampling parameters), so a hit is only possible when the upstream would
+have been sent byte-for-byte the same request. Two tiers are consulted in
+order:
+
+* an in-process LRU with TTL, and
+* an SQLite file that survives worker restarts and is shared by every gunicorn
+  worker pointed at the same path.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Payload fields that do not change the generated text (a reply cut off at max_tokens is continued to its end)
+IGNORED_PAYLOAD_FIELDS = {'stream', 'max_tokens', 'usage'}
+
+
+def cache_key(payload):
+    """SHA-256 of the canonical JSON form of the request payload"""
+    canonical = {k: v for k, v in payload.items() if k not in IGNORED_PAYLOAD_FIELDS}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class MemoryLRUCache:
+    """Bounded in-process tier with least-recently-used eviction and a TTL"""
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        with self._lock:
+            self._entries[key] = (value, expires_at or time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """Disk tier shared between workers through one SQLite file"""
+
+    def __init__(self, path, max_entries=5000, ttl=24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, key):
+        """Return (value, expires_at) or None"""
+        db = self._connect()
+        row = db.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at < time.time():
+            db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+        db.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+        return zlib.decompress(value).decode('utf-8'), expires_at
+
+    def set(self, key, value):
+        now = time.time()
+        db = self._connect()
+        db.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+            (key, zlib.compress(value.encode('utf-8')), now + self.ttl, now)
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used beyond max_entries"""
+        db = self._connect()
+        db.execute("DELETE FROM response_cache WHERE expires_at < ?", (time.time(),))
+        db.execute(
+            "DELETE FROM response_cache WHERE key IN ("
+            "SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+
+class ResponseCache:
+    """Memory tier in front of the shared disk tier"""
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return (reply, tier) where tier is "memory"/"disk", or (None, None)"""
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value, 'memory'
+        if self.disk is not None:
+            try:
+                entry = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.error(f"Response cache read failed: {e}")
+                entry = None
+            if entry is not None:
+                value, expires_at = entry
+                self.memory.set(key, value, expires_at)
+                self.hits += 1
+                return value, 'disk'
+        self.misses += 1
+        return None, None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except sqlite3.Error as e:
+                logger.error(f"Response cache write failed: {e}")
+
+    def snapshot(self):
+        return {"hits": self.hits, "misses": self.misses}
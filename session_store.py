@@ -0,0 +1,722 @@
+"""Server-side session and conversation storage.
+
+The browser cookie only carries a signed session id. Session data (user
+context, flags) and the conversation history live in a pluggable store; SQLite
+is the default. Every record is stored as zlib-compressed compact JSON, and
+history is appended one message at a time instead of rewriting the whole
+conversation on each request.
+
+A session owns any number of conversations. Messages are keyed by conversation
+id; a session's first conversation has the session id as its id, so history
+written before conversations existed stays where it was. The SQLite backend
+indexes every message in an FTS5 table, prose and fenced code in separate
+columns, so search ranks matches with bm25 without scanning the messages.
+
+Large code blocks are stored once per conversation and linked to their
+earlier versions (see code_store); the SQLite backend keeps them out of the
+message records, each as a delta against its previous version, and puts
+them back when messages are read.
+"""
+import html
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from code_store import (MAX_DELTA_CHAIN, VERSION_CANDIDATES, apply_delta, compact, expand, link_version, make_delta,
+                        referenced, stored_blocks)
+
+logger = logging.getLogger(__name__)
+
+
+def encode(obj):
+    """Compact JSON, zlib-compressed"""
+    return zlib.compress(json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+
+def decode(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def is_repeat(previous, message):
+    return previous.get('role') == message.get('role') and previous.get('content') == message.get('content')
+
+
+CODE_FENCE = re.compile(r"```\w*\n?([\s\S]*?)```")
+TITLE_LENGTH = 60
+# Placeholders snippet() puts around matched terms, swapped for <mark> after escaping
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+
+def search_text(content):
+    """(prose, code) of a message: fenced code is indexed apart from the text around it"""
+    return CODE_FENCE.sub(' ', content), '\n'.join(CODE_FENCE.findall(content))
+
+
+def title_from(message):
+    """Conversation title taken from its first user message, or None"""
+    if message.get('role') != 'user':
+        return None
+    text = ' '.join(CODE_FENCE.sub(' ', message.get('content') or '').split())
+    return text if len(text) <= TITLE_LENGTH else text[:TITLE_LENGTH - 1].rstrip() + '…'
+
+
+def match_query(text):
+    """FTS5 query matching every word of text, the last one as a prefix; None without words.
+
+    Words are quoted, so FTS operators and punctuation typed by users are
+    searched for as plain text.
+    """
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+
+def mark_snippet(snippet):
+    """Escaped snippet with matched terms wrapped in <mark>"""
+    return html.escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+class ConversationStore:
+    """Interface shared by the storage backends"""
+
+    def load_session(self, sid):
+        """Return the stored session dict for sid, or None"""
+        raise NotImplementedError
+
+    def save_session(self, sid, data):
+        raise NotImplementedError
+
+    def append_message(self, sid, message):
+        """Append one message to the conversation of sid and return its id"""
+        raise NotImplementedError
+
+    def append_unless_repeated(self, sid, message):
+        """Append message unless the last one of sid has the same role and content.
+
+        Check and append are atomic. Returns (id, appended), id being the
+        existing message's when it was a repeat.
+        """
+        raise NotImplementedError
+
+    def get_messages(self, sid, limit=None, before=None):
+        """Return the conversation of sid oldest-first; only the newest `limit` (older than id `before`) if given"""
+        raise NotImplementedError
+
+    def conversation_version(self, sid):
+        """(newest message id, message count) of sid: changes whenever its history does"""
+        raise NotImplementedError
+
+    def code_versions(self, sid):
+        """{digest: {"base", "version"}} of the code blocks stored for the conversation of sid"""
+        raise NotImplementedError
+
+    def clear_messages(self, sid):
+        raise NotImplementedError
+
+    def purge_expired(self, max_age):
+        """Drop sessions (and their conversations) untouched for max_age seconds"""
+        raise NotImplementedError
+
+    def create_conversation(self, sid, title=None):
+        """Start an empty conversation owned by session sid and return it"""
+        raise NotImplementedError
+
+    def get_conversation(self, sid, conversation_id):
+        """Conversation of session sid as a dict, or None"""
+        raise NotImplementedError
+
+    def list_conversations(self, sid, limit=50):
+        """Conversations of session sid with their message counts, most recently active first"""
+        raise NotImplementedError
+
+    def rename_conversation(self, sid, conversation_id, title):
+        """Set a conversation's title; False if session sid has no such conversation"""
+        raise NotImplementedError
+
+    def delete_conversation(self, sid, conversation_id):
+        """Delete a conversation and its messages; False if session sid has no such conversation"""
+        raise NotImplementedError
+
+    def search_messages(self, sid, query, limit=20):
+        """Messages of session sid's conversations matching every word of query, best first.
+
+        Each hit is {"id", "conversation_id", "title", "role", "snippet"};
+        the snippet is escaped HTML with matched terms in <mark>.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _compacted(message):
+        """message as stored: large code blocks are kept once per conversation and referenced by digest"""
+        content = message.get('content')
+        return dict(message, content=compact(content)) if content else message
+
+
+class SQLiteConversationStore(ConversationStore):
+    """SQLite backend, safe to share between threads and gunicorn workers"""
+
+    # PRAGMA user_version once the conversations table and search index cover existing messages
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS messages_by_session ON messages (session_id, id);
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id TEXT PRIMARY KEY,
+                    sid TEXT NOT NULL,
+                    title TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS conversations_by_sid ON conversations (sid, updated_at);
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    content, code, conversation_id UNINDEXED, role UNINDEXED,
+                    tokenize = "unicode61 tokenchars '_'"
+                );
+                CREATE TABLE IF NOT EXISTS code_blocks (
+                    session_id TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    base TEXT,
+                    version INTEGER NOT NULL,
+                    depth INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, digest)
+                );
+            """)
+        self._migrate()
+
+    def _connect(self):
+        # sqlite3 connections must stay on the thread that created them
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _migrate(self):
+        """Register and index history written before conversations existed (once, by the first worker)"""
+        with self._transaction() as db:
+            if db.execute("PRAGMA user_version").fetchone()[0] >= self.SCHEMA_VERSION:
+                return
+            rows = db.execute(
+                "SELECT id, session_id, data, created_at FROM messages "
+                "WHERE id NOT IN (SELECT rowid FROM messages_fts) ORDER BY id"
+            ).fetchall()
+            for message_id, conversation_id, data, created_at in rows:
+                self._index(db, message_id, conversation_id, decode(data), created_at)
+            db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        if rows:
+            logger.info(f"Indexed {len(rows)} stored messages for search")
+
+    def _index(self, db, message_id, conversation_id, message, now):
+        """Add a message to the search index and mark its conversation active.
+
+        A conversation without a row yet is a session's first one, whose id
+        is the session id.
+        """
+        prose, code = search_text(message.get('content') or '')
+        db.execute(
+            "INSERT INTO messages_fts (rowid, content, code, conversation_id, role) VALUES (?, ?, ?, ?, ?)",
+            (message_id, prose, code, conversation_id, message.get('role'))
+        )
+        db.execute(
+            "INSERT INTO conversations (id, sid, title, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET title = COALESCE(title, excluded.title), updated_at = excluded.updated_at",
+            (conversation_id, conversation_id, title_from(message), now, now)
+        )
+
+    def _insert(self, db, sid, message, blocks):
+        now = time.time()
+        db.executemany(
+            "INSERT OR IGNORE INTO code_blocks (session_id, digest, base, version, depth, data, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", [(sid, *block, now) for block in blocks]
+        )
+        cursor = db.execute(
+            "INSERT INTO messages (session_id, data, created_at) VALUES (?, ?, ?)",
+            (sid, encode(self._compacted(message)), now)
+        )
+        self._index(db, cursor.lastrowid, sid, message, now)
+        return cursor.lastrowid
+
+    def _new_blocks(self, sid, message):
+        """code_blocks rows for the blocks of message not stored for sid yet, each linked to its previous version.
+
+        Read before the write transaction, so comparing blocks never holds the write lock.
+        """
+        blocks = stored_blocks(message.get('content') or '')
+        if not blocks:
+            return []
+        db = self._connect()
+        known = {row[0] for row in db.execute(
+            f"SELECT digest FROM code_blocks WHERE session_id = ? AND digest IN ({','.join('?' * len(blocks))})",
+            (sid, *blocks)
+        )}
+        if len(known) == len(blocks):
+            return []
+        recent = db.execute(
+            "SELECT digest, version, depth FROM code_blocks WHERE session_id = ? ORDER BY rowid DESC LIMIT ?",
+            (sid, VERSION_CANDIDATES)
+        ).fetchall()
+        # Oldest first, like the memory backend, so both pick the same base when candidates tie
+        versions = {digest: {"version": version, "depth": depth} for digest, version, depth in reversed(recent)}
+        codes = self._load_code(db, sid, versions)
+        candidates = {digest: codes[digest] for digest in versions}
+        rows = []
+        for digest, code in blocks.items():
+            if digest in known:
+                continue
+            base, version = link_version(code, candidates, versions)
+            # A full copy every MAX_DELTA_CHAIN versions keeps rebuilding a block cheap
+            depth = versions[base]["depth"] + 1 if base is not None else 0
+            if depth > MAX_DELTA_CHAIN:
+                depth = 0
+            delta = make_delta(candidates[base], code) if depth else None
+            rows.append((digest, base, version, depth, encode({"delta": delta} if delta is not None else {"code": code})))
+            # Later blocks of the same message may be versions of this one
+            candidates[digest] = code
+            versions[digest] = {"version": version, "depth": depth}
+        return rows
+
+    def _load_code(self, db, sid, digests):
+        """{digest: code} of the stored blocks of sid among digests, rebuilt from their deltas"""
+        records = {}
+        wanted = set(digests)
+        while wanted:
+            rows = db.execute(
+                f"SELECT digest, base, data FROM code_blocks WHERE session_id = ? "
+                f"AND digest IN ({','.join('?' * len(wanted))})", (sid, *wanted)
+            ).fetchall()
+            wanted = set()
+            for digest, base, data in rows:
+                records[digest] = (base, decode(data))
+                if base is not None and base not in records:
+                    wanted.add(base)
+        codes = {}
+
+        def rebuild(digest):
+            if digest not in codes:
+                base, record = records[digest]
+                codes[digest] = record["code"] if "code" in record else apply_delta(rebuild(base), record["delta"])
+            return codes[digest]
+
+        for digest in records:
+            rebuild(digest)
+        return codes
+
+    def _expanded(self, messages, sid):
+        """Messages read from sid with the code of their blocks put back"""
+        digests = {digest for message in messages for digest in referenced(message.get('content') or '')}
+        if not digests:
+            return messages
+        codes = self._load_code(self._connect(), sid, digests)
+        for message in messages:
+            if message.get('content'):
+                message['content'] = expand(message['content'], codes)
+        return messages
+
+    def load_session(self, sid):
+        row = self._connect().execute("SELECT data FROM sessions WHERE id = ?", (sid,)).fetchone()
+        return decode(row[0]) if row else None
+
+    def save_session(self, sid, data):
+        self._connect().execute(
+            "INSERT INTO sessions (id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (sid, encode(data), time.time())
+        )
+
+    def append_message(self, sid, message):
+        blocks = self._new_blocks(sid, message)
+        with self._transaction() as db:
+            return self._insert(db, sid, message, blocks)
+
+    def append_unless_repeated(self, sid, message):
+        blocks = self._new_blocks(sid, message)
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT id, data FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1", (sid,)
+            ).fetchone()
+            # Stored messages hold references to their code blocks, so compare them compacted
+            if row is not None and is_repeat(decode(row[1]), self._compacted(message)):
+                return row[0], False
+            return self._insert(db, sid, message, blocks), True
+
+    def get_messages(self, sid, limit=None, before=None):
+        if limit is None and before is None:
+            rows = self._connect().execute(
+                "SELECT id, data FROM messages WHERE session_id = ? ORDER BY id", (sid,)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT id, data FROM messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (sid, before if before is not None else 2 ** 63 - 1, limit if limit is not None else -1)
+            ).fetchall()
+            rows.reverse()
+        return self._expanded([dict(decode(data), id=message_id) for message_id, data in rows], sid)
+
+    def conversation_version(self, sid):
+        newest, count = self._connect().execute(
+            "SELECT MAX(id), COUNT(*) FROM messages WHERE session_id = ?", (sid,)
+        ).fetchone()
+        return newest, count
+
+    def code_versions(self, sid):
+        rows = self._connect().execute(
+            "SELECT digest, base, version FROM code_blocks WHERE session_id = ?", (sid,)
+        ).fetchall()
+        return {digest: {"base": base, "version": version} for digest, base, version in rows}
+
+    def _delete_messages(self, db, conversations, params):
+        """Drop the messages (and their index rows and code blocks) of the conversations a subquery selects"""
+        db.execute(f"DELETE FROM messages_fts WHERE rowid IN "
+                   f"(SELECT id FROM messages WHERE session_id IN ({conversations}))", params)
+        db.execute(f"DELETE FROM messages WHERE session_id IN ({conversations})", params)
+        db.execute(f"DELETE FROM code_blocks WHERE session_id IN ({conversations})", params)
+
+    def clear_messages(self, sid):
+        with self._transaction() as db:
+            self._delete_messages(db, "?", (sid,))
+            db.execute("UPDATE conversations SET title = NULL WHERE id = ?", (sid,))
+
+    def purge_expired(self, max_age):
+        cutoff = time.time() - max_age
+        expired = "SELECT id FROM sessions WHERE updated_at < ?"
+        with self._transaction() as db:
+            self._delete_messages(db, f"SELECT id FROM conversations WHERE sid IN ({expired})", (cutoff,))
+            db.execute(f"DELETE FROM conversations WHERE sid IN ({expired})", (cutoff,))
+            db.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+
+    def create_conversation(self, sid, title=None):
+        conversation = {"id": uuid.uuid4().hex, "title": title, "created_at": time.time(), "message_count": 0}
+        conversation["updated_at"] = conversation["created_at"]
+        self._connect().execute(
+            "INSERT INTO conversations (id, sid, title, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (conversation["id"], sid, title, conversation["created_at"], conversation["updated_at"])
+        )
+        return conversation
+
+    def _conversations(self, where, params, limit=-1):
+        rows = self._connect().execute(
+            "SELECT id, title, created_at, updated_at, "
+            "(SELECT COUNT(*) FROM messages WHERE session_id = conversations.id) "
+            f"FROM conversations WHERE {where} ORDER BY updated_at DESC LIMIT ?", (*params, limit)
+        ).fetchall()
+        return [{"id": conversation_id, "title": title, "created_at": created_at, "updated_at": updated_at,
+                 "message_count": count} for conversation_id, title, created_at, updated_at, count in rows]
+
+    def get_conversation(self, sid, conversation_id):
+        found = self._conversations("id = ? AND sid = ?", (conversation_id, sid))
+        return found[0] if found else None
+
+    def list_conversations(self, sid, limit=50):
+        return self._conversations("sid = ?", (sid,), limit)
+
+    def rename_conversation(self, sid, conversation_id, title):
+        cursor = self._connect().execute(
+            "UPDATE conversations SET title = ? WHERE id = ? AND sid = ?", (title, conversation_id, sid)
+        )
+        return cursor.rowcount > 0
+
+    def delete_conversation(self, sid, conversation_id):
+        with self._transaction() as db:
+            if db.execute("DELETE FROM conversations WHERE id = ? AND sid = ?", (conversation_id, sid)).rowcount == 0:
+                return False
+            self._delete_messages(db, "?", (conversation_id,))
+        return True
+
+    def search_messages(self, sid, query, limit=20):
+        expression = match_query(query)
+        if expression is None:
+            return []
+        # bm25 weights: a hit in code counts more than one in prose
+        rows = self._connect().execute(
+            "SELECT messages_fts.rowid, conversations.id, conversations.title, messages_fts.role, "
+            "snippet(messages_fts, -1, ?, ?, '…', 16) "
+            "FROM messages_fts JOIN conversations ON conversations.id = messages_fts.conversation_id "
+            "WHERE messages_fts MATCH ? AND conversations.sid = ? "
+            "ORDER BY bm25(messages_fts, 1.0, 1.5) LIMIT ?",
+            (MATCH_START, MATCH_END, expression, sid, limit)
+        ).fetchall()
+        return [{"id": message_id, "conversation_id": conversation_id, "title": title, "role": role,
+                 "snippet": mark_snippet(snippet)} for message_id, conversation_id, title, role, snippet in rows]
+
+
+class MemoryConversationStore(ConversationStore):
+    """Process-local backend for development and single-worker deployments"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._messages = {}
+        self._conversations = {}
+        self._code = {}  # Conversation id -> {digest: {"code", "base", "version"}}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def load_session(self, sid):
+        entry = self._sessions.get(sid)
+        return decode(entry[0]) if entry else None
+
+    def save_session(self, sid, data):
+        with self._lock:
+            self._sessions[sid] = (encode(data), time.time())
+
+    def _insert(self, sid, message):
+        message_id = self._next_id
+        self._next_id += 1
+        self._link_code(sid, message)
+        self._messages.setdefault(sid, []).append((message_id, encode(self._compacted(message))))
+        now = time.time()
+        # A conversation without an entry yet is a session's first one, whose id is the session id
+        conversation = self._conversations.setdefault(
+            sid, {"sid": sid, "title": None, "created_at": now, "updated_at": now})
+        conversation["title"] = conversation["title"] or title_from(message)
+        conversation["updated_at"] = now
+        return message_id
+
+    def _link_code(self, sid, message):
+        """Store the new code blocks of message once, by digest, with their previous versions"""
+        stored = self._code.setdefault(sid, {})
+        for digest, code in stored_blocks(message.get('content') or '').items():
+            if digest in stored:
+                continue
+            recent = dict(list(stored.items())[-VERSION_CANDIDATES:])
+            base, version = link_version(code, {key: block["code"] for key, block in recent.items()}, recent)
+            stored[digest] = {"code": code, "base": base, "version": version}
+
+    def append_message(self, sid, message):
+        with self._lock:
+            return self._insert(sid, message)
+
+    def append_unless_repeated(self, sid, message):
+        with self._lock:
+            rows = self._messages.get(sid)
+            # Stored messages hold references to their code blocks, so compare them compacted
+            if rows and is_repeat(decode(rows[-1][1]), self._compacted(message)):
+                return rows[-1][0], False
+            return self._insert(sid, message), True
+
+    def get_messages(self, sid, limit=None, before=None):
+        rows = list(self._messages.get(sid, []))
+        if before is not None:
+            rows = [row for row in rows if row[0] < before]
+        if limit is not None:
+            rows = rows[-limit:] if limit > 0 else []
+        return [self._expanded(dict(decode(data), id=message_id), sid) for message_id, data in rows]
+
+    def _expanded(self, message, sid):
+        """A message read from sid with the code of its blocks put back"""
+        digests = referenced(message.get('content') or '')
+        if digests:
+            stored = self._code.get(sid, {})
+            message['content'] = expand(message['content'], {digest: stored[digest]["code"] for digest in digests
+                                                             if digest in stored})
+        return message
+
+    def conversation_version(self, sid):
+        rows = self._messages.get(sid, [])
+        return (rows[-1][0] if rows else None), len(rows)
+
+    def code_versions(self, sid):
+        return {digest: {"base": block["base"], "version": block["version"]}
+                for digest, block in list(self._code.get(sid, {}).items())}
+
+    def clear_messages(self, sid):
+        with self._lock:
+            self._messages.pop(sid, None)
+            self._code.pop(sid, None)
+            if sid in self._conversations:
+                self._conversations[sid]["title"] = None
+
+    def purge_expired(self, max_age):
+        cutoff = time.time() - max_age
+        with self._lock:
+            for sid in [sid for sid, (_, updated_at) in self._sessions.items() if updated_at < cutoff]:
+                self._sessions.pop(sid, None)
+                for conversation_id in [key for key, value in self._conversations.items() if value["sid"] == sid]:
+                    self._conversations.pop(conversation_id)
+                    self._messages.pop(conversation_id, None)
+                    self._code.pop(conversation_id, None)
+
+    def _public(self, conversation_id, conversation):
+        return {"id": conversation_id, "title": conversation["title"], "created_at": conversation["created_at"],
+                "updated_at": conversation["updated_at"],
+                "message_count": len(self._messages.get(conversation_id, []))}
+
+    def create_conversation(self, sid, title=None):
+        conversation_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conversations[conversation_id] = {"sid": sid, "title": title, "created_at": now, "updated_at": now}
+            return self._public(conversation_id, self._conversations[conversation_id])
+
+    def get_conversation(self, sid, conversation_id):
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None or conversation["sid"] != sid:
+            return None
+        return self._public(conversation_id, conversation)
+
+    def list_conversations(self, sid, limit=50):
+        owned = [(key, value) for key, value in list(self._conversations.items()) if value["sid"] == sid]
+        owned.sort(key=lambda item: -item[1]["updated_at"])
+        return [self._public(key, value) for key, value in owned[:limit]]
+
+    def rename_conversation(self, sid, conversation_id, title):
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None or conversation["sid"] != sid:
+                return False
+            conversation["title"] = title
+        return True
+
+    def delete_conversation(self, sid, conversation_id):
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None or conversation["sid"] != sid:
+                return False
+            self._conversations.pop(conversation_id)
+            self._messages.pop(conversation_id, None)
+            self._code.pop(conversation_id, None)
+        return True
+
+    def search_messages(self, sid, query, limit=20):
+        """Linear scan: every word must occur, the hits with the most occurrences come first"""
+        terms = [term.casefold() for term in re.findall(r'\w+', query)]
+        if not terms:
+            return []
+        pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+        hits = []
+        for conversation_id, conversation in list(self._conversations.items()):
+            if conversation["sid"] != sid:
+                continue
+            for message_id, data in list(self._messages.get(conversation_id, [])):
+                message = self._expanded(decode(data), conversation_id)
+                content = message.get('content') or ''
+                if not all(term in content.casefold() for term in terms):
+                    continue
+                first = pattern.search(content)
+                start = max(first.start() - 60, 0)
+                excerpt = ('…' if start else '') + content[start:first.end() + 60]
+                snippet = pattern.sub(lambda m: MATCH_START + m.group(0) + MATCH_END, excerpt)
+                hits.append((-len(pattern.findall(content)), {
+                    "id": message_id, "conversation_id": conversation_id, "title": conversation["title"],
+                    "role": message.get('role'), "snippet": mark_snippet(snippet)}))
+        hits.sort(key=lambda hit: hit[0])
+        return [hit for _, hit in hits[:limit]]
+
+
+def create_store(backend, path):
+    """Build the store named by SESSION_BACKEND"""
+    if backend == 'memory':
+        return MemoryConversationStore()
+    if backend == 'sqlite':
+        return SQLiteConversationStore(path)
+    raise ValueError(f"Unknown session backend: {backend}")
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict whose contents live in the store, keyed by sid"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface keeping only a signed session id in the cookie"""
+
+    salt = 'vibecoding-session'
+
+    def __init__(self, store, max_age=30 * 24 * 3600, purge_interval=3600):
+        self.store = store
+        self.max_age = max_age
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def session_id(self, app, cookie):
+        """The session id a signed cookie value carries, or None if it does not verify"""
+        try:
+            return self._signer(app).unsign(cookie).decode('ascii')
+        except BadSignature:
+            return None
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            sid = self.session_id(app, cookie)
+            if sid:
+                data = self.store.load_session(sid)
+                if data is not None:
+                    return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=uuid.uuid4().hex, new=True)
+
+    def save_session(self, app, session, response):
+        if not session.modified:
+            return
+        self.store.save_session(session.sid, dict(session))
+        response.set_cookie(
+            self.get_cookie_name(app),
+            self._signer(app).sign(session.sid).decode('ascii'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=self.get_cookie_domain(app),
+            path=self.get_cookie_path(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        self._maybe_purge()
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        try:
+            self.store.purge_expired(self.max_age)
+        except Exception as e:
+            logger.error(f"Failed to purge expired sessions: {e}")
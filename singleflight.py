@@ -0,0 +1,327 @@
+"""Single-flight coalescing of identical in-flight upstream requests.
+
+A chat request whose final payload has the same fingerprint (model, messages
+and sampling parameters, see response_cache.cache_key) as a call that is
+already in flight does not call OpenRouter again: it subscribes to the running
+call and receives its deltas and its final reply, whether either side streams
+or not.
+
+Within a worker, flights live in a dict guarded by a lock. With a shared path
+configured, the workers of one host also claim fingerprints in a small SQLite
+table; a duplicate that lands on another worker then follows the leader's
+progress from that table instead of generating the reply a second time.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+INTERRUPTED_BODY = {"reply": "⚠️ The identical request this one was waiting on was interrupted. Please try again."}
+
+
+class FlightTimeout(Exception):
+    """A subscriber waited longer than the flight timeout for the leader"""
+
+
+class Flight:
+    """One upstream call in flight and the outcome every subscriber receives"""
+
+    def __init__(self, key, shared=None, flight_id=None):
+        self.key = key
+        self.id = flight_id or uuid.uuid4().hex
+        self.shared = shared        # SharedFlights the leader reports its progress to, if any
+        self.sessions = set()       # Sessions that already record this reply in their history
+        self.parts = []             # Stream deltas published so far
+        self.status = None          # HTTP status of the outcome, set once finished
+        self.body = None            # JSON body of the outcome ({"reply": ...})
+        self.model = None
+        self.subscribers = 0
+        self._cond = threading.Condition()
+        self._watchers = []
+        self._on_finish = []
+        self._shared_written = 0.0
+
+    @property
+    def finished(self):
+        return self.status is not None
+
+    def claim_session(self, sid):
+        """True the first time sid joins: that request records the reply in the session's history"""
+        with self._cond:
+            if sid in self.sessions:
+                return False
+            self.sessions.add(sid)
+            return True
+
+    def publish(self, delta):
+        with self._cond:
+            if self.finished:
+                return
+            self.parts.append(delta)
+            self._cond.notify_all()
+        self._notify()
+        if self.shared is not None and time.monotonic() - self._shared_written >= self.shared.write_interval:
+            self._shared_written = time.monotonic()
+            self.shared.progress(self, ''.join(self.parts))
+
+    def finish(self, status, body, model=None):
+        """Settle the flight; only the first outcome counts"""
+        with self._cond:
+            if self.finished:
+                return
+            self.status, self.body, self.model = status, body, model
+            self._cond.notify_all()
+        self._notify()
+        if self.shared is not None:
+            self.shared.finish(self)
+        for callback in self._on_finish:
+            callback(self)
+
+    def _notify(self):
+        for watcher in list(self._watchers):
+            watcher()
+
+    def _snapshot(self, sent):
+        with self._cond:
+            return self.parts[sent:], self.finished
+
+    def wait(self, timeout):
+        """Block until the flight has finished"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.finished, timeout):
+                raise FlightTimeout(f"no outcome after {timeout:.0f}s")
+
+    def wait_started(self, timeout):
+        """Block until the first delta or the outcome is available"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.parts or self.finished, timeout):
+                raise FlightTimeout(f"no output after {timeout:.0f}s")
+
+    def updates(self, timeout):
+        """Yield deltas as they are published, until the flight finishes"""
+        deadline = time.monotonic() + timeout
+        sent = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: len(self.parts) > sent or self.finished,
+                                           deadline - time.monotonic()):
+                    raise FlightTimeout(f"no outcome after {timeout:.0f}s")
+            new, finished = self._snapshot(sent)
+            sent += len(new)
+            yield from new
+            if finished:
+                return
+
+    async def async_updates(self, timeout):
+        """Async counterpart of updates for subscribers on an event loop"""
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def watcher():
+            try:
+                loop.call_soon_threadsafe(changed.set)
+            except RuntimeError:
+                pass  # Loop already closed
+
+        self._watchers.append(watcher)
+        deadline = time.monotonic() + timeout
+        sent = 0
+        try:
+            while True:
+                changed.clear()
+                new, finished = self._snapshot(sent)
+                sent += len(new)
+                for delta in new:
+                    yield delta
+                if finished:
+                    return
+                if new:
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    raise FlightTimeout(f"no outcome after {timeout:.0f}s") from None
+        finally:
+            self._watchers.remove(watcher)
+
+    async def async_wait(self, timeout):
+        async for _ in self.async_updates(timeout):
+            pass
+
+    async def async_wait_started(self, timeout):
+        async for _ in self.async_updates(timeout):
+            return
+
+
+class SharedFlights:
+    """Fingerprints claimed by the workers of one host, in an SQLite file they all open"""
+
+    def __init__(self, path, lease=300, write_interval=0.25, poll_interval=0.1, linger=60):
+        self.path = path
+        self.lease = lease                  # Seconds after which an unfinished claim is considered dead
+        self.write_interval = write_interval
+        self.poll_interval = poll_interval
+        self.linger = linger                # Seconds finished rows stay readable for slow pollers
+        self._local = threading.local()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS flights (
+                key TEXT PRIMARY KEY,
+                id TEXT NOT NULL,
+                sid TEXT,
+                content TEXT NOT NULL DEFAULT '',
+                status INTEGER,
+                body TEXT,
+                model TEXT,
+                started_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def claim(self, flight, sid):
+        """Claim flight.key for this worker; returns (claimed, (id, sid) of the current leader)"""
+        now = time.time()
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM flights WHERE (status IS NULL AND started_at < ?) OR updated_at < ?",
+                       (now - self.lease, now - self.linger))
+            row = db.execute("SELECT id, sid FROM flights WHERE key = ? AND status IS NULL",
+                             (flight.key,)).fetchone()
+            if row is None:
+                db.execute(
+                    "INSERT OR REPLACE INTO flights (key, id, sid, started_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (flight.key, flight.id, sid, now, now)
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return row is None, row
+
+    def progress(self, flight, content):
+        try:
+            self._connect().execute("UPDATE flights SET content = ?, updated_at = ? WHERE key = ? AND id = ?",
+                                    (content, time.time(), flight.key, flight.id))
+        except sqlite3.Error as e:
+            logger.error(f"Shared flight progress write failed: {e}")
+
+    def finish(self, flight):
+        try:
+            self._connect().execute(
+                "UPDATE flights SET content = ?, status = ?, body = ?, model = ?, updated_at = ? WHERE key = ? AND id = ?",
+                (''.join(flight.parts), flight.status, json.dumps(flight.body), flight.model, time.time(),
+                 flight.key, flight.id)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Shared flight result write failed: {e}")
+
+    def read(self, key, flight_id):
+        """Return (content, status, body, model) of a flight, or None once it is gone"""
+        row = self._connect().execute(
+            "SELECT content, status, body, model FROM flights WHERE key = ? AND id = ?", (key, flight_id)
+        ).fetchone()
+        if row is None:
+            return None
+        content, status, body, model = row
+        return content, status, json.loads(body) if body else None, model
+
+    def mirror(self, flight, timeout):
+        """Feed a local flight from another worker's progress until it finishes (runs on its own thread)"""
+        deadline = time.monotonic() + timeout
+        received = 0
+        while time.monotonic() < deadline:
+            try:
+                state = self.read(flight.key, flight.id)
+            except sqlite3.Error as e:
+                logger.error(f"Shared flight read failed: {e}")
+                state = None
+            if state is None:
+                break
+            content, status, body, model = state
+            if len(content) > received:
+                flight.publish(content[received:])
+                received = len(content)
+            if status is not None:
+                flight.finish(status, body, model)
+                return
+            time.sleep(self.poll_interval)
+        logger.warning(f"Lost track of shared flight {flight.key[:12]}")
+        flight.finish(500, INTERRUPTED_BODY)
+
+
+class FlightGroup:
+    """In-flight upstream calls of this worker, keyed by payload fingerprint"""
+
+    def __init__(self, shared=None, timeout=200):
+        self.shared = shared
+        self.timeout = timeout
+        self.led = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, sid):
+        """Return (flight, leader): the leader calls upstream and settles the flight, others subscribe"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.subscribers += 1
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            flight._on_finish.append(self._remove)
+
+        if self.shared is not None:
+            try:
+                claimed, leader = self.shared.claim(flight, sid)
+            except sqlite3.Error as e:
+                logger.error(f"Shared flight claim failed, leading locally: {e}")
+                claimed, leader = True, None
+            if not claimed:
+                # Another worker is generating this reply: follow its progress
+                flight.id, leader_sid = leader
+                flight.sessions.add(leader_sid)
+                with self._lock:
+                    flight.subscribers += 1
+                    self.coalesced += 1
+                threading.Thread(target=self.shared.mirror, args=(flight, self.timeout),
+                                 name="flight-mirror", daemon=True).start()
+                return flight, False
+            flight.shared = self.shared
+
+        with self._lock:
+            self.led += 1
+        return flight, True
+
+    def _remove(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def snapshot(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), "led": self.led, "coalesced": self.coalesced}
+
+
+def create_flight_group(shared_path=None, timeout=200):
+    """FlightGroup for this worker, shared with sibling workers when shared_path is given"""
+    shared = None
+    if shared_path:
+        os.makedirs(os.path.dirname(os.path.abspath(shared_path)), exist_ok=True)
+        shared = SharedFlights(shared_path, lease=timeout + 60)
+    return FlightGroup(shared, timeout)
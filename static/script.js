@@ -0,0 +1,695 @@
+let currentTab = 'chat';
+let isLoading = false;
+let currentGeneration = null;
+let currentTheme = 'light';
+
+// Theme Management
+function toggleTheme() {
+    currentTheme = currentTheme === 'light' ? 'dark' : 'light';
+    document.body.setAttribute('data-theme', currentTheme);
+    
+    const themeIcon = document.getElementById('theme-icon');
+    const prismDarkTheme = document.getElementById('prism-dark-theme');
+    
+    if (currentTheme === 'dark') {
+        themeIcon.className = 'fas fa-sun';
+        prismDarkTheme.disabled = false;
+    } else {
+        themeIcon.className = 'fas fa-moon';
+        prismDarkTheme.disabled = true;
+    }
+    
+    localStorage.setItem('theme', currentTheme);
+}
+
+// Load saved theme
+function loadTheme() {
+    const savedTheme = localStorage.getItem('theme') || 'light';
+    if (savedTheme === 'dark') {
+        toggleTheme();
+    }
+}
+
+// Tab Management
+function switchTab(tab) {
+    currentTab = tab;
+    
+    // Update menu items
+    document.querySelectorAll('.menu-item').forEach(item => {
+        item.classList.remove('active');
+    });
+    event.target.closest('.menu-item').classList.add('active');
+    
+    // Show/hide tabs
+    document.getElementById('chat-tab').style.display = tab === 'chat' ? 'flex' : 'none';
+    document.getElementById('analyze-tab').style.display = tab === 'analyze' ? 'flex' : 'none';
+}
+
+// Sidebar Management
+function toggleSidebar() {
+    const sidebar = document.getElementById('sidebar');
+    sidebar.classList.toggle('open');
+}
+
+// Message Management
+function addMessage(content, isUser = false, isTyping = false, html = null) {
+    const messagesContainer = document.getElementById('messages');
+    const welcomeScreen = document.getElementById('welcome-screen');
+    
+    if (welcomeScreen) {
+        welcomeScreen.remove();
+    }
+    
+    if (isTyping) {
+        const typingDiv = document.createElement('div');
+        typingDiv.className = 'message assistant';
+        typingDiv.id = 'typing-indicator';
+        typingDiv.innerHTML = `
+            <div class="message-avatar">R</div>
+            <div class="typing-indicator">
+                <span>Ryan is thinking</span>
+                <div class="typing-dots">
+                    <div class="typing-dot"></div>
+                    <div class="typing-dot"></div>
+                </div>
+            </div>
+        `;
+        messagesContainer.appendChild(typingDiv);
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        return;
+    }
+    
+    // Remove typing indicator
+    const typingIndicator = document.getElementById('typing-indicator');
+    if (typingIndicator) {
+        typingIndicator.remove();
+    }
+    
+    const messageDiv = createMessageElement(content, isUser, html);
+    messagesContainer.appendChild(messageDiv);
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    
+    return messageDiv;
+}
+
+// html: the reply as rendered by the server, used instead of processMarkdown when present
+function createMessageElement(content, isUser, html = null) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${isUser ? 'user' : 'assistant'}`;
+    
+    const avatar = isUser ? 'U' : 'R';
+    const processedContent = isUser ? content : (html || processMarkdown(content));
+    
+    messageDiv.innerHTML = `
+        <div class="message-avatar">${avatar}</div>
+        <div class="message-content">
+            <div class="message-text">${processedContent}</div>
+            <div class="message-actions">
+                <button class="action-btn" onclick="copyMessage(this)" title="Copy">
+                    <i class="fas fa-copy"></i>
+                </button>
+                ${!isUser ? '<button class="action-btn" onclick="regenerateResponse(this)" title="Regenerate"><i class="fas fa-redo"></i></button>' : ''}
+            </div>
+        </div>
+    `;
+    
+    // Highlight code blocks, unless the server already tokenized them
+    if (!isUser && !isTokenized(html)) {
+        if (window.Prism) Prism.highlightAllUnder(messageDiv);
+    }
+    
+    return messageDiv;
+}
+
+// Server-rendered code carries Prism token spans only when the server has Pygments
+function isTokenized(html) {
+    return Boolean(html) && html.includes('<span class="token ');
+}
+
+// History, newest page first; older pages load when scrolling to the top
+const HISTORY_PAGE_SIZE = 20;
+let historyCursor = null;
+let historyLoading = false;
+
+async function loadHistoryPage(before) {
+    let url = `/chat-history?limit=${HISTORY_PAGE_SIZE}&fields=role,content,html`;
+    if (before) url += `&before=${before}`;
+    const response = await fetch(url);
+    if (!response.ok) return [];
+    const data = await response.json();
+    historyCursor = data.next_before;
+    return data.history;
+}
+
+async function loadLatestHistory() {
+    try {
+        const history = await loadHistoryPage(null);
+        history.forEach(message => addMessage(message.content, message.role === 'user', false, message.html));
+    } catch (error) {
+        console.error('Error loading history:', error);
+    }
+}
+
+async function loadOlderHistory() {
+    if (!historyCursor || historyLoading) return;
+    historyLoading = true;
+    try {
+        const messagesContainer = document.getElementById('messages');
+        const history = await loadHistoryPage(historyCursor);
+        // Keep the message in view where it was while the page is inserted above it
+        const fromBottom = messagesContainer.scrollHeight - messagesContainer.scrollTop;
+        const fragment = document.createDocumentFragment();
+        history.forEach(message => fragment.appendChild(createMessageElement(message.content, message.role === 'user', message.html)));
+        messagesContainer.insertBefore(fragment, messagesContainer.firstChild);
+        messagesContainer.scrollTop = messagesContainer.scrollHeight - fromBottom;
+    } catch (error) {
+        console.error('Error loading history:', error);
+    } finally {
+        historyLoading = false;
+    }
+}
+
+// Re-render a streaming assistant message with the text received so far
+function updateStreamingMessage(messageDiv, content, isFinal = false, html = null) {
+    const messagesContainer = document.getElementById('messages');
+    const atBottom = messagesContainer.scrollHeight - messagesContainer.scrollTop - messagesContainer.clientHeight < 40;
+    
+    messageDiv.querySelector('.message-text').innerHTML = html || processMarkdown(content);
+    
+    if (isFinal && !isTokenized(html)) {
+        if (window.Prism) Prism.highlightAllUnder(messageDiv);
+    }
+    if (atBottom) {
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+}
+
+// Parse a block of Server-Sent Events into {event, data} objects
+function parseSSE(block) {
+    let event = 'message';
+    let data = '';
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            data += line.slice(5).trim();
+        }
+    });
+    return { event, data: data ? JSON.parse(data) : {} };
+}
+
+function processMarkdown(text) {
+    // Process code blocks
+    text = text.replace(/```(\w*)\n([\s\S]*?)```/g, (match, lang, code) => {
+        const language = lang || 'text';
+        return `
+            <div class="code-block">
+                <div class="code-header">
+                    <span>${language}</span>
+                    <button class="copy-btn" onclick="copyCode(this)">
+                        <i class="fas fa-copy"></i> Copy
+                    </button>
+                </div>
+                <div class="code-content">
+                    <pre><code class="language-${language}">${escapeHtml(code.trim())}</code></pre>
+                </div>
+            </div>
+        `;
+    });
+    
+    // Process inline code
+    text = text.replace(/`([^`]+)`/g, '<code style="background-color: var(--bg-tertiary); padding: 2px 6px; border-radius: 4px; font-family: monospace;">$1</code>');
+    
+    // Process headers
+    text = text.replace(/^### (.*$)/gim, '<h3>$1</h3>');
+    text = text.replace(/^## (.*$)/gim, '<h2>$1</h2>');
+    text = text.replace(/^# (.*$)/gim, '<h1>$1</h1>');
+    
+    // Process bold and italic
+    text = text.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>');
+    text = text.replace(/\*(.*?)\*/g, '<em>$1</em>');
+    
+    // Process lists
+    text = text.replace(/^\* (.*$)/gim, '<li>$1</li>');
+    text = text.replace(/^(\d+)\. (.*$)/gim, '<li>$2</li>');
+    
+    // Wrap consecutive list items
+    text = text.replace(/(<li>.*<\/li>)/gs, (match) => {
+        if (match.includes('1.') || match.match(/^\d+\./)) {
+            return `<ol>${match}</ol>`;
+        }
+        return `<ul>${match}</ul>`;
+    });
+    
+    // Process line breaks
+    text = text.replace(/\n\n/g, '</p><p>');
+    text = text.replace(/\n/g, '<br>');
+    
+    // Wrap in paragraphs if not already wrapped
+    if (!text.startsWith('<') && text.length > 0) {
+        text = `<p>${text}</p>`;
+    }
+    
+    return text;
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+// Chat Functions
+async function sendMessage() {
+    const input = document.getElementById('message-input');
+    const message = input.value.trim();
+    
+    if (!message || isLoading) return;
+    
+    isLoading = true;
+    updateSendButton(true);
+    
+    // Add user message
+    addMessage(message, true);
+    input.value = '';
+    updateCharCount();
+    
+    // Show typing indicator
+    addMessage('', false, true);
+    
+    // Chosen here rather than by the server, so the reply can be stopped before its response starts
+    currentGeneration = newGenerationId();
+    
+    try {
+        const response = await fetch('/chat/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ message: message, generation_id: currentGeneration })
+        });
+        
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!response.ok || !contentType.includes('text/event-stream') || !response.body) {
+            const data = await response.json();
+            if (response.ok) {
+                addMessage(data.reply, false, false, data.html);
+            } else if (data.cancelled) {
+                showStopped(data.reply);
+            } else {
+                addMessage(`Error: ${data.reply || 'Something went wrong'}`, false);
+            }
+            return;
+        }
+        
+        await readChatStream(response);
+    } catch (error) {
+        addMessage('Error: Failed to connect to the server. Please try again.', false);
+        console.error('Error:', error);
+    } finally {
+        isLoading = false;
+        currentGeneration = null;
+        updateSendButton(false);
+    }
+}
+
+function newGenerationId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+// Stop button: the server aborts the upstream call and ends the stream with what it has so far
+async function stopGeneration() {
+    if (!currentGeneration) return;
+    try {
+        await fetch(`/chat/${currentGeneration}/cancel`, { method: 'POST' });
+    } catch (error) {
+        console.error('Error:', error);
+    }
+}
+
+function showStopped(reply) {
+    addMessage(reply ? `${reply}\n\n*(stopped)*` : '*(stopped)*', false);
+}
+
+// Render tokens as they arrive from /chat/stream
+async function readChatStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    let messageDiv = null;
+    let renderPending = false;
+    let finished = false;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const { event, data } = parseSSE(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            
+            if (event === 'delta') {
+                text += data.content;
+                if (!messageDiv) {
+                    messageDiv = addMessage(text, false);
+                } else if (!renderPending) {
+                    // Coalesce re-renders to one per animation frame
+                    renderPending = true;
+                    requestAnimationFrame(() => {
+                        renderPending = false;
+                        if (!finished) {
+                            updateStreamingMessage(messageDiv, text);
+                        }
+                    });
+                }
+            } else if (event === 'done') {
+                finished = true;
+                text = data.reply;
+                if (messageDiv) {
+                    updateStreamingMessage(messageDiv, text, true, data.html);
+                } else {
+                    messageDiv = addMessage(text, false, false, data.html);
+                }
+            } else if (event === 'cancelled') {
+                finished = true;
+                if (messageDiv) {
+                    updateStreamingMessage(messageDiv, `${data.reply}\n\n*(stopped)*`, true);
+                } else {
+                    showStopped(data.reply);
+                }
+            } else if (event === 'error') {
+                addMessage(`Error: ${data.reply || 'Something went wrong'}`, false);
+            }
+        }
+    }
+}
+
+function updateSendButton(loading) {
+    const sendBtn = document.getElementById('send-btn');
+    // While a reply is generating the button stops it
+    if (loading) {
+        sendBtn.innerHTML = '<i class="fas fa-stop"></i>';
+        sendBtn.onclick = stopGeneration;
+    } else {
+        sendBtn.innerHTML = '<i class="fas fa-paper-plane"></i>';
+        sendBtn.onclick = sendMessage;
+    }
+}
+
+// Code Analysis
+async function analyzeCode() {
+    const code = document.getElementById('code-textarea').value.trim();
+    const language = document.getElementById('code-language').value;
+    const resultDiv = document.getElementById('analysis-result');
+    
+    if (!code) {
+        resultDiv.innerHTML = '<div style="color: var(--error-color); padding: 16px; background-color: var(--bg-secondary); border-radius: 8px; border: 1px solid var(--border-color);">Please enter some code to analyze.</div>';
+        return;
+    }
+    
+    resultDiv.innerHTML = '<div style="padding: 16px; text-align: center;"><i class="fas fa-spinner fa-spin"></i> Analyzing code...</div>';
+    
+    try {
+        const response = await fetch('/analyze-code', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ code: code, language: language })
+        });
+        
+        const data = await response.json();
+        
+        if (response.ok) {
+            const analysis = data.analysis;
+            resultDiv.innerHTML = `
+                <div style="background-color: var(--bg-secondary); padding: 20px; border-radius: 8px; border: 1px solid var(--border-color);">
+                    <h3 style="margin-bottom: 16px;">Code Analysis Results</h3>
+                    <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 16px;">
+                        <div>
+                            <strong>Lines of Code:</strong> ${analysis.line_count}
+                        </div>
+                        <div>
+                            <strong>Characters:</strong> ${analysis.character_count}
+                        </div>
+                        <div>
+                            <strong>Complexity:</strong> ${analysis.estimated_complexity}
+                        </div>
+                        <div>
+                            <strong>Language:</strong> ${analysis.language}
+                        </div>
+                        <div>
+                            <strong>Has Functions:</strong> ${analysis.has_functions ? 'Yes' : 'No'}
+                        </div>
+                        <div>
+                            <strong>Has Classes:</strong> ${analysis.has_classes ? 'Yes' : 'No'}
+                        </div>
+                        <div>
+                            <strong>Has Imports:</strong> ${analysis.has_imports ? 'Yes' : 'No'}
+                        </div>
+                        <div>
+                            <strong>Cyclomatic Complexity:</strong> ${analysis.cyclomatic_complexity}
+                        </div>
+                        <div>
+                            <strong>Max Nesting:</strong> ${analysis.max_nesting}
+                        </div>
+                    </div>
+                    <div style="margin-top: 20px;">
+                        <button class="btn primary" onclick="analyzeWithAI()">
+                            <i class="fas fa-robot"></i>
+                            Get AI Analysis
+                        </button>
+                    </div>
+                </div>
+            `;
+        } else {
+            resultDiv.innerHTML = `<div style="color: var(--error-color); padding: 16px; background-color: var(--bg-secondary); border-radius: 8px; border: 1px solid var(--border-color);">Error: ${data.error}</div>`;
+        }
+    } catch (error) {
+        resultDiv.innerHTML = '<div style="color: var(--error-color); padding: 16px; background-color: var(--bg-secondary); border-radius: 8px; border: 1px solid var(--border-color);">Error: Failed to analyze code.</div>';
+        console.error('Error:', error);
+    }
+}
+
+async function analyzeWithAI() {
+    const code = document.getElementById('code-textarea').value.trim();
+    const language = document.getElementById('code-language').value;
+    
+    // Switch to chat tab
+    switchTab('chat');
+    document.querySelector('.menu-item').click();
+    
+    // Send code for AI analysis
+    const message = `Please analyze this ${language} code:\n\n\`\`\`${language}\n${code}\n\`\`\``;
+    document.getElementById('message-input').value = message;
+    sendMessage();
+}
+
+// Utility Functions
+function copyMessage(btn) {
+    const messageContent = btn.closest('.message-content').querySelector('.message-text');
+    const text = messageContent.innerText || messageContent.textContent;
+    
+    navigator.clipboard.writeText(text).then(() => {
+        const originalIcon = btn.innerHTML;
+        btn.innerHTML = '<i class="fas fa-check"></i>';
+        btn.style.color = 'var(--success-color)';
+        
+        setTimeout(() => {
+            btn.innerHTML = originalIcon;
+            btn.style.color = '';
+        }, 2000);
+    });
+}
+
+function copyCode(btn) {
+    const codeBlock = btn.closest('.code-block').querySelector('code');
+    const text = codeBlock.innerText || codeBlock.textContent;
+    
+    navigator.clipboard.writeText(text).then(() => {
+        const originalText = btn.innerHTML;
+        btn.innerHTML = '<i class="fas fa-check"></i> Copied';
+        btn.style.color = 'var(--success-color)';
+        
+        setTimeout(() => {
+            btn.innerHTML = originalText;
+            btn.style.color = '';
+        }, 2000);
+    });
+}
+
+async function regenerateResponse(btn) {
+    // Implementation for regenerating the last response
+    console.log('Regenerate response feature - to be implemented');
+}
+
+async function clearChat() {
+    try {
+        const response = await fetch('/clear-chat', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            }
+        });
+        
+        if (response.ok) {
+            historyCursor = null;
+            // Clear messages
+            document.getElementById('messages').innerHTML = `
+                <div class="welcome-screen" id="welcome-screen">
+                    <div class="welcome-avatar">R</div>
+                    <div class="welcome-title">Hey there! I'm Ryan 👋</div>
+                    <div class="welcome-subtitle">
+                        Your advanced AI coding assistant, ready to help you debug, optimize, create, and understand code like never before!
+                    </div>
+                    <div class="welcome-features">
+                        <div class="feature-card">
+                            <div class="feature-icon">
+                                <i class="fas fa-bug"></i>
+                            </div>
+                            <div class="feature-title">Debug & Fix</div>
+                            <div class="feature-description">
+                                I can analyze your code, identify bugs, and provide complete fixes with detailed explanations.
+                            </div>
+                        </div>
+                        <div class="feature-card">
+                            <div class="feature-icon">
+                                <i class="fas fa-rocket"></i>
+                            </div>
+                            <div class="feature-title">Optimize Performance</div>
+                            <div class="feature-description">
+                                Let me help you improve your code's efficiency, speed, and overall performance.
+                            </div>
+                        </div>
+                        <div class="feature-card">
+                            <div class="feature-icon">
+                                <i class="fas fa-lightbulb"></i>
+                            </div>
+                            <div class="feature-title">Code Generation</div>
+                            <div class="feature-description">
+                                I can create complete applications, functions, and scripts tailored to your exact needs.
+                            </div>
+                        </div>
+                        <div class="feature-card">
+                            <div class="feature-icon">
+                                <i class="fas fa-graduation-cap"></i>
+                            </div>
+                            <div class="feature-title">Learn & Understand</div>
+                            <div class="feature-description">
+                                Get clear explanations of complex code concepts with examples and best practices.
+                            </div>
+                        </div>
+                    </div>
+                </div>
+            `;
+        }
+    } catch (error) {
+        console.error('Error clearing chat:', error);
+    }
+}
+
+async function showHistory() {
+    try {
+        const response = await fetch('/conversations');
+        const data = await response.json();
+        
+        if (response.ok) {
+            console.log('Conversations:', data);
+            // You can implement a modal or dedicated view for history here
+            const titles = data.conversations.map(c => `• ${c.title || 'Untitled'} (${c.message_count} messages)`);
+            alert(`Conversations: ${data.conversations.length}\n\n${titles.join('\n')}`);
+        }
+    } catch (error) {
+        console.error('Error fetching history:', error);
+    }
+}
+
+function exportChat() {
+    const messages = document.querySelectorAll('.message');
+    let chatText = 'Chat Export - Ryan AI\n' + '='.repeat(30) + '\n\n';
+    
+    messages.forEach(message => {
+        const isUser = message.classList.contains('user');
+        const content = message.querySelector('.message-text').innerText;
+        const role = isUser ? 'You' : 'Ryan';
+        
+        chatText += `${role}:\n${content}\n\n${'-'.repeat(20)}\n\n`;
+    });
+    
+    const blob = new Blob([chatText], { type: 'text/plain' });
+    const url = URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    a.href = url;
+    a.download = `ryan-chat-${new Date().toISOString().split('T')[0]}.txt`;
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+    URL.revokeObjectURL(url);
+}
+
+function updateCharCount() {
+    const input = document.getElementById('message-input');
+    const charCount = document.getElementById('char-count');
+    const count = input.value.length;
+    charCount.textContent = `${count} / 2000`;
+    
+    if (count > 2000) {
+        charCount.style.color = 'var(--error-color)';
+    } else if (count > 1800) {
+        charCount.style.color = 'var(--warning-color)';
+    } else {
+        charCount.style.color = 'var(--text-muted)';
+    }
+}
+
+// Event Listeners
+document.getElementById('message-input').addEventListener('input', function() {
+    updateCharCount();
+    
+    // Auto-resize textarea
+    this.style.height = 'auto';
+    this.style.height = Math.min(this.scrollHeight, 200) + 'px';
+});
+
+document.getElementById('message-input').addEventListener('keydown', function(e) {
+    if (e.key === 'Enter' && !e.shiftKey) {
+        e.preventDefault();
+        sendMessage();
+    }
+});
+
+// Mobile menu handling
+function setupMobileMenu() {
+    const menuBtn = document.getElementById('menu-btn');
+    if (window.innerWidth <= 768) {
+        menuBtn.style.display = 'block';
+    } else {
+        menuBtn.style.display = 'none';
+        document.getElementById('sidebar').classList.remove('open');
+    }
+}
+
+window.addEventListener('resize', setupMobileMenu);
+
+document.getElementById('messages').addEventListener('scroll', function() {
+    if (this.scrollTop < 80) {
+        loadOlderHistory();
+    }
+});
+
+// Initialize
+document.addEventListener('DOMContentLoaded', function() {
+    loadTheme();
+    setupMobileMenu();
+    updateCharCount();
+    loadLatestHistory();
+    
+    // Focus on input
+    document.getElementById('message-input').focus();
+});
@@ -0,0 +1,75 @@
+"""Shared fixtures: a scripted local stand-in for the OpenRouter chat completions API"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def completion(content="Hello!"):
+    """Answer with a finished, non-streamed completion"""
+    return {"status": 200, "body": {
+        "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+    }}
+
+
+def error(status, retry_after=None, delay=0.0):
+    """Answer with an error status, after delay seconds"""
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+    return {"status": status, "headers": headers, "delay": delay,
+            "body": {"error": {"code": status, "message": "Provider returned error"}}}
+
+
+class FakeUpstream:
+    """Answers every request for a model with the answers scripted for it, in turn; the last one repeats"""
+
+    def __init__(self):
+        self.answers = {}
+        self.calls = []  # Model of every request received, in order
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                answer = fake.next_answer(payload.get('model'))
+                time.sleep(answer.get("delay", 0.0))
+                body = json.dumps(answer["body"]).encode('utf-8')
+                self.send_response(answer["status"])
+                for name, value in answer.get("headers", {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except OSError:  # The client gave up on the request
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/v1/chat/completions"
+
+    def script(self, model, *answers):
+        self.answers[model] = list(answers)
+
+    def next_answer(self, model):
+        with self._lock:
+            self.calls.append(model)
+            answers = self.answers.get(model) or [error(404)]
+            return answers.pop(0) if len(answers) > 1 else answers[0]
+
+
+@pytest.fixture
+def fake_upstream():
+    upstream = FakeUpstream()
+    thread = threading.Thread(target=upstream.server.serve_forever, daemon=True)
+    thread.start()
+    yield upstream
+    upstream.server.shutdown()
+    upstream.server.server_close()
@@ -0,0 +1,94 @@
+"""Admission control: per-session token buckets, then concurrency caps with a bounded wait queue"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, ConcurrencyLimiter, RateLimiter, Rejected
+
+
+def controller(rate=0, burst=0, limit=1, key_limit=0, max_queue=1, queue_timeout=1.0):
+    return AdmissionController(RateLimiter(rate, burst), ConcurrencyLimiter(limit, key_limit, max_queue),
+                               queue_timeout=queue_timeout)
+
+
+def test_empty_bucket_is_rejected_with_its_retry_after():
+    admission = controller(rate=60, burst=2, limit=0)  # One token a second
+    admission.admit("alice").release()
+    admission.admit("alice").release()
+    with pytest.raises(Rejected) as rejected:
+        admission.admit("alice")
+    assert (rejected.value.status, rejected.value.reason, rejected.value.retry_after) == (429, "rate_limited", 1)
+    admission.admit("bob").release()  # Buckets are per key
+    assert admission.snapshot()["rejected"] == {"rate_limited": 1}
+
+
+def test_large_requests_cost_more():
+    admission = controller(rate=60, burst=3, limit=0)
+    admission.admit("alice", body_size=8000).release()  # 1 + 2 tokens
+    with pytest.raises(Rejected):
+        admission.admit("alice")
+
+
+def test_queued_request_runs_when_a_slot_frees():
+    admission = controller(limit=1, max_queue=1)
+    first = admission.admit("alice")
+    admitted = []
+    waiting = threading.Thread(target=lambda: admitted.append(admission.admit("bob")))
+    waiting.start()
+    while admission.concurrency.queued == 0:
+        time.sleep(0.01)
+
+    with pytest.raises(Rejected) as rejected:
+        admission.admit("carol")  # The queue is full
+    assert (rejected.value.status, rejected.value.reason) == (503, "queue_full")
+
+    first.release()
+    waiting.join(timeout=1)
+    assert len(admitted) == 1 and admission.concurrency.active == 1
+    admitted[0].release()
+    admitted[0].release()  # Released once only
+    assert admission.concurrency.active == 0
+
+
+def test_queue_deadline_is_rejected():
+    admission = controller(limit=1, max_queue=1, queue_timeout=0.1)
+    ticket = admission.admit("alice")
+    with pytest.raises(Rejected) as rejected:
+        admission.admit("bob")
+    assert (rejected.value.status, rejected.value.reason) == (503, "queue_timeout")
+    assert admission.concurrency.queued == 0
+    ticket.release()
+
+
+def test_one_session_cannot_take_more_than_its_share_of_the_queue():
+    admission = controller(limit=0, key_limit=1, max_queue=5, queue_timeout=0.1)
+    ticket = admission.admit("alice")
+    waiting = threading.Thread(target=lambda: pytest.raises(Rejected, admission.admit, "alice"))
+    waiting.start()
+    while admission.concurrency.queued == 0:
+        time.sleep(0.01)
+    with pytest.raises(Rejected) as rejected:
+        admission.admit("alice")
+    assert (rejected.value.status, rejected.value.reason) == (429, "session_busy")
+    waiting.join()
+    ticket.release()
+
+
+def test_cancelled_async_waiter_gives_up_its_place():
+    admission = controller(limit=1, max_queue=1)
+
+    async def run():
+        ticket = await admission.async_admit("alice")
+        waiting = asyncio.ensure_future(admission.async_admit("bob"))
+        await asyncio.sleep(0.05)
+        assert admission.concurrency.queued == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert admission.concurrency.queued == 0
+        ticket.release()
+
+    asyncio.run(run())
+    assert admission.concurrency.active == 0
@@ -0,0 +1,27 @@
+"""The analysis pool gives up on a worker stuck past its timeout instead of waiting on it"""
+import time
+
+from code_analysis import AnalysisPool
+
+# ast.parse of this takes seconds in one C call, which the in-worker alarm cannot interrupt
+STUCK = "x = 1\n" * 3_000_000
+
+
+def test_stuck_worker_is_killed_and_the_pool_rebuilt():
+    pool = AnalysisPool(workers=1, timeout=0.5, grace=0.5)
+    try:
+        assert pool.analyze("x = 1\n", "python")[1] is None
+        processes = list(pool._executor._processes.values())
+
+        started = time.monotonic()
+        results = sorted(pool.map([(STUCK, "python"), ("y = 2\n", "python")]))
+        assert time.monotonic() - started < 3
+        assert [error for _, _, error in results] == ["Analysis timed out after 0.5s"] * 2
+
+        for process in processes:
+            process.join(timeout=5)
+            assert not process.is_alive()
+        analysis, error = pool.analyze("def f():\n    pass\n", "python")
+        assert error is None and analysis["functions"][0]["name"] == "f"
+    finally:
+        pool.shutdown()
@@ -0,0 +1,94 @@
+"""Both conversation backends store pasted code once per conversation and build the same prompts from it"""
+import pytest
+
+from code_store import CODE_STORE_MIN_CHARS, code_digest, referenced
+from prompt_builder import TOKEN_BUDGETS, assemble_prompt, message_tokens
+from session_store import MemoryConversationStore, SQLiteConversationStore, decode
+
+
+def module(lines, changed=()):
+    """A block of at least CODE_STORE_MIN_CHARS characters with the given lines changed"""
+    code = "".join(f"def step_{i}(value):\n    return value + {100 if i in changed else i}\n" for i in range(lines))
+    assert len(code) >= CODE_STORE_MIN_CHARS
+    return code
+
+
+def fenced(code):
+    return f"```python\n{code}```"
+
+
+ORIGINAL = module(20)
+FIXED = module(20, changed={3})
+OTHER_FIX = module(20, changed={11})
+# One line away from both fixes: the newest candidate must be its base in both backends
+BOTH_FIXES = module(20, changed={3, 11})
+
+CONVERSATION = [
+    ("user", f"This fails:\n{fenced(ORIGINAL)}"),
+    ("assistant", f"Try this:\n{fenced(FIXED)}"),
+    ("user", f"I tried another fix:\n{fenced(OTHER_FIX)}\nstarting from:\n{fenced(ORIGINAL)}"),
+    ("user", f"Combined:\n{fenced(BOTH_FIXES)}"),
+]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryConversationStore()
+    return SQLiteConversationStore(str(tmp_path / "sessions.db"))
+
+
+def fill(store, sid="conversation"):
+    for role, content in CONVERSATION:
+        store.append_message(sid, {"role": role, "content": content})
+    return sid
+
+
+def test_messages_keep_their_code(store):
+    sid = fill(store)
+    assert [(m["role"], m["content"]) for m in store.get_messages(sid)] == CONVERSATION
+    assert len(store.search_messages(sid, "step_19")) == len(CONVERSATION)
+
+
+def test_stored_messages_reference_code(store):
+    sid = fill(store)
+    if isinstance(store, MemoryConversationStore):
+        stored = [decode(data)["content"] for _, data in store._messages[sid]]
+    else:
+        stored = [decode(row[0])["content"] for row in store._connect().execute(
+            "SELECT data FROM messages WHERE session_id = ? ORDER BY id", (sid,))]
+    assert all(ORIGINAL not in content for content in stored)
+    assert referenced(stored[0]) == referenced(stored[2])[1:]
+
+
+def test_repeat_is_detected_on_stored_messages(store):
+    sid = fill(store)
+    message_id, appended = store.append_unless_repeated(sid, {"role": "user", "content": CONVERSATION[-1][1]})
+    assert not appended
+    assert message_id == store.conversation_version(sid)[0]
+
+
+def test_backends_build_the_same_prompt(tmp_path):
+    memory, sqlite = MemoryConversationStore(), SQLiteConversationStore(str(tmp_path / "sessions.db"))
+    prompts = []
+    for store in (memory, sqlite):
+        sid = fill(store)
+        versions = store.code_versions(sid)
+        history = [{"role": m["role"], "content": m["content"]} for m in store.get_messages(sid)]
+        prompts.append((versions, assemble_prompt([], history, "debug_code", versions)))
+    assert prompts[0] == prompts[1]
+    versions, (messages, tokens) = prompts[0]
+    assert versions[code_digest(BOTH_FIXES)] == {"base": code_digest(OTHER_FIX), "version": 3}
+    assert "sent as a unified diff" in messages[-1]["content"]
+    assert len(messages) == len(CONVERSATION)
+    assert tokens == sum(message_tokens(m) for m in messages) <= TOKEN_BUDGETS["debug_code"]
+
+
+def test_history_is_packed_within_the_request_types_budget():
+    # One message per 1000 tokens of budget, so exactly the newest budget / 1000 fit
+    filler = {"role": "user", "content": "x" * (4 * (1000 - 4))}
+    history = [filler] * 12
+    for request_type in ("debug_code", "create_code", "general_chat"):
+        messages, tokens = assemble_prompt([], history, request_type)
+        assert len(messages) == TOKEN_BUDGETS[request_type] // 1000
+        assert tokens <= TOKEN_BUDGETS[request_type]
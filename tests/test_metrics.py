@@ -0,0 +1,57 @@
+"""Aggregation across workers: counters outlive their worker, gauges do not"""
+import os
+import subprocess
+import sys
+
+from metrics import Registry, clear_directory, mark_process_dead, worker_path, write_dump
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def registry(directory):
+    registry = Registry(str(directory))
+    requests = registry.counter("requests_total", "Requests", ["status"])
+    active = registry.gauge("active", "Requests in progress")
+    seconds = registry.histogram("seconds", "Latency", buckets=(1, 10))
+    return registry, requests, active, seconds
+
+
+def test_exited_worker_keeps_counters_and_drops_gauges(tmp_path):
+    worker, requests, active, seconds = registry(tmp_path)
+    requests.inc(status="200")
+    active.set(3)
+    seconds.observe(5)
+    dead = exited_pid()
+    write_dump(worker_path(str(tmp_path), dead), worker.dump())
+
+    scraper, requests, active, seconds = registry(tmp_path)
+    requests.inc(status="200")
+    active.set(1)
+    # Not cleaned up yet: its gauge is skipped since its process is gone
+    assert scraper.collect()["active"] == {(): 1}
+    assert scraper.collect()["requests_total"] == {("200",): 2}
+
+    mark_process_dead(str(tmp_path), dead)
+    assert not os.path.exists(worker_path(str(tmp_path), dead))
+    totals = scraper.collect()
+    assert totals["requests_total"] == {("200",): 2}
+    assert totals["active"] == {(): 1}
+    assert totals["seconds"] == {(): [0, 1, 5.0, 1]}
+    assert 'requests_total{status="200"} 2' in scraper.render()
+
+
+def test_live_workers_gauges_are_summed(tmp_path):
+    worker, _, active, _ = registry(tmp_path)
+    active.set(2)
+    write_dump(worker_path(str(tmp_path), os.getppid()), worker.dump())
+
+    scraper, _, active, _ = registry(tmp_path)
+    active.set(1)
+    assert scraper.collect()["active"] == {(): 3}
+
+    clear_directory(str(tmp_path))
+    assert scraper.collect()["active"] == {(): 1}
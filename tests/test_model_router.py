@@ -0,0 +1,77 @@
+"""Fallback across models: a rate-limited or failing model hands the request to the next one"""
+import asyncio
+import time
+
+import aiohttp
+
+from conftest import completion, error
+from model_router import AsyncModelRouter, ModelRouter
+from upstream import AsyncUpstreamClient, CircuitBreaker, RetryPolicy, UpstreamClient
+
+HEADERS = {"Content-Type": "application/json"}
+PAYLOAD = {"messages": [{"role": "user", "content": "fix my add function"}]}
+MODELS = ["model-a", "model-b"]
+
+
+def reply_of(response):
+    return response.json()["choices"][0]["message"]["content"]
+
+
+def test_rate_limited_model_falls_back_to_the_next(fake_upstream):
+    fake_upstream.script("model-a", error(429, retry_after=5))
+    fake_upstream.script("model-b", completion("from model-b"))
+    router = ModelRouter(UpstreamClient(fake_upstream.url), MODELS)
+
+    started = time.monotonic()
+    response = router.post(HEADERS, PAYLOAD)
+    response.close()
+
+    assert (response.model, response.status_code, reply_of(response)) == ("model-b", 200, "from model-b")
+    # Neither retried first nor waited out its Retry-After while model-b could answer
+    assert fake_upstream.calls == ["model-a", "model-b"]
+    assert time.monotonic() - started < 5
+    # A 429 is no health failure: model-a's circuit stays closed
+    assert router.breakers["model-a"].snapshot()["consecutive_failures"] == 0
+
+
+def test_failing_model_opens_only_its_own_circuit(fake_upstream):
+    fake_upstream.script("model-a", error(503))
+    fake_upstream.script("model-b", completion())
+    breakers = {model: CircuitBreaker(failure_threshold=2, recovery_timeout=60) for model in MODELS}
+    router = ModelRouter(UpstreamClient(fake_upstream.url), MODELS, breakers=breakers)
+
+    for _ in range(4):
+        response = router.post(HEADERS, PAYLOAD)
+        response.close()
+        assert (response.model, response.status_code) == ("model-b", 200)
+
+    assert breakers["model-a"].is_open and not breakers["model-b"].is_open
+    assert fake_upstream.calls.count("model-a") == 2  # Skipped once its circuit opened
+    assert router.snapshot()["models"]["model-a"]["circuit"]["state"] == "open"
+
+
+def test_last_model_is_retried(fake_upstream):
+    fake_upstream.script("model-a", error(503), completion("second try"))
+    router = ModelRouter(UpstreamClient(fake_upstream.url, retry_policy=RetryPolicy(base_delay=0.01)), ["model-a"])
+
+    response = router.post(HEADERS, PAYLOAD)
+    response.close()
+
+    assert (response.status_code, reply_of(response)) == (200, "second try")
+    assert fake_upstream.calls == ["model-a", "model-a"]
+
+
+def test_async_rate_limited_model_falls_back_to_the_next(fake_upstream):
+    fake_upstream.script("model-a", error(429, retry_after=5))
+    fake_upstream.script("model-b", completion("from model-b"))
+
+    async def post():
+        client = AsyncUpstreamClient(fake_upstream.url)
+        async with aiohttp.ClientSession() as client.session:
+            async with await AsyncModelRouter(client, MODELS).post(HEADERS, PAYLOAD) as response:
+                return response.model, response.status, await response.json()
+
+    model, status, body = asyncio.run(post())
+
+    assert (model, status, body["choices"][0]["message"]["content"]) == ("model-b", 200, "from model-b")
+    assert fake_upstream.calls == ["model-a", "model-b"]
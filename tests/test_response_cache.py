@@ -0,0 +1,52 @@
+"""Reply cache: keyed by the exact request, an in-process LRU in front of a disk tier shared by workers"""
+import time
+
+from response_cache import MemoryLRUCache, ResponseCache, SQLiteCache, cache_key
+
+PAYLOAD = {"model": "model-a", "temperature": 0, "messages": [{"role": "user", "content": "explain this loop"}]}
+
+
+def test_key_covers_what_changes_the_reply():
+    assert cache_key(PAYLOAD) == cache_key(dict(reversed(list(PAYLOAD.items()))))
+    assert cache_key(PAYLOAD) == cache_key(dict(PAYLOAD, stream=True, max_tokens=100))
+    assert cache_key(PAYLOAD) != cache_key(dict(PAYLOAD, model="model-b"))
+    assert cache_key(PAYLOAD) != cache_key(dict(PAYLOAD, messages=[{"role": "user", "content": "explain this"}]))
+
+
+def test_memory_tier_evicts_least_recently_used_and_expired():
+    memory = MemoryLRUCache(max_entries=2, ttl=60)
+    memory.set("a", "1")
+    memory.set("b", "2")
+    memory.get("a")
+    memory.set("c", "3")
+    assert (memory.get("a"), memory.get("b"), memory.get("c")) == ("1", None, "3")
+
+    memory.set("d", "4", expires_at=time.time() - 1)
+    assert memory.get("d") is None
+
+
+def test_disk_tier_is_shared_and_fills_the_memory_tier(tmp_path):
+    path = str(tmp_path / "cache.db")
+    key = cache_key(PAYLOAD)
+    ResponseCache(MemoryLRUCache(), SQLiteCache(path)).set(key, "The loop sums the list.")
+
+    other_worker = ResponseCache(MemoryLRUCache(), SQLiteCache(path))
+    assert other_worker.get(key) == ("The loop sums the list.", "disk")
+    assert other_worker.get(key) == ("The loop sums the list.", "memory")
+    assert other_worker.get(cache_key(dict(PAYLOAD, temperature=1))) == (None, None)
+    assert other_worker.snapshot() == {"hits": 2, "misses": 1}
+
+
+def test_disk_tier_drops_expired_and_least_recently_used(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "cache.db"), max_entries=2, ttl=60)
+    for key in ("a", "b", "c"):
+        disk.set(key, key.upper())
+        time.sleep(0.01)  # Distinct last_used
+    disk.get("a")
+    disk.evict()
+    assert disk.get("b") is None
+    assert (disk.get("a")[0], disk.get("c")[0]) == ("A", "C")
+
+    expired = SQLiteCache(str(tmp_path / "expired.db"), ttl=-1)
+    expired.set("a", "A")
+    assert expired.get("a") is None
@@ -0,0 +1,115 @@
+"""Circuit breaking and cancellation of upstream calls"""
+import threading
+import time
+
+import pytest
+import requests
+
+from conftest import completion, error
+from generations import GenerationRegistry
+from model_router import Inflight
+from upstream import CircuitBreaker, CircuitOpenError, RetryPolicy, UpstreamClient, record_failure
+
+HEADERS = {"Content-Type": "application/json"}
+PAYLOAD = {"model": "model-a", "messages": [{"role": "user", "content": "fix my add function"}]}
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes_once():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.1)
+    breaker.record_failure()
+    assert breaker.before_request() is False
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    time.sleep(0.15)
+    assert breaker.before_request() is True  # The probe
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()  # Only one at a time
+    breaker.record_success()
+    assert breaker.snapshot() == {"state": "closed", "consecutive_failures": 0, "times_opened": 1, "rejected": 2}
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.1)
+    breaker.record_failure()
+    time.sleep(0.15)
+    assert breaker.before_request() is True
+    breaker.record_failure()
+    assert breaker.is_open and breaker.snapshot()["times_opened"] == 2
+
+
+def test_rate_limit_is_not_a_failure():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.1)
+    record_failure(breaker, 429)
+    assert not breaker.is_open
+    record_failure(breaker, 503)
+    assert breaker.is_open
+
+    time.sleep(0.15)
+    assert breaker.before_request() is True
+    record_failure(breaker, 429, probe=True)  # Released without a verdict: the next request probes
+    assert breaker.state == "half_open"
+    assert breaker.before_request() is True
+
+
+def test_rate_limited_client_honours_retry_after_without_opening_the_circuit(fake_upstream):
+    fake_upstream.script("model-a", error(429, retry_after=0.2), completion("after waiting"))
+    client = UpstreamClient(fake_upstream.url, breaker=CircuitBreaker(failure_threshold=1))
+
+    started = time.monotonic()
+    response = client.post(HEADERS, PAYLOAD)
+    response.close()
+
+    assert response.status_code == 200 and time.monotonic() - started >= 0.2
+    assert client.breaker.snapshot()["consecutive_failures"] == 0
+
+
+def abort_after(inflight, seconds):
+    timer = threading.Timer(seconds, inflight.abort)
+    timer.start()
+    return timer
+
+
+def test_abort_wakes_a_request_waiting_for_headers(fake_upstream):
+    fake_upstream.script("model-a", dict(completion(), delay=5))
+    client = UpstreamClient(fake_upstream.url)
+    inflight = Inflight()
+    abort_after(inflight, 0.2)
+
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.RequestException):
+        client.post(HEADERS, PAYLOAD, inflight=inflight)
+    assert time.monotonic() - started < 2
+    assert client.breaker.snapshot()["consecutive_failures"] == 0  # Cancelled, not failed
+
+
+def test_abort_cuts_a_retry_wait_short(fake_upstream):
+    fake_upstream.script("model-a", error(503, retry_after=5))
+    client = UpstreamClient(fake_upstream.url, retry_policy=RetryPolicy(max_delay=10))
+    inflight = Inflight(parent=Inflight())
+    abort_after(inflight.parent, 0.2)  # Aborting the request aborts its attempts
+
+    started = time.monotonic()
+    response = client.post(HEADERS, PAYLOAD, inflight=inflight)
+    response.close()
+
+    assert response.status_code == 503 and time.monotonic() - started < 2
+    assert fake_upstream.calls == ["model-a"]
+
+
+def test_generation_is_cancelled_only_by_its_session():
+    registry = GenerationRegistry()
+    generation = registry.start("generation-1", sid="owner")
+    aborted = []
+    generation.on_cancel(lambda: aborted.append(True))
+
+    assert registry.cancel("generation-1", "someone-else") is False
+    assert not generation.cancelled
+    assert registry.cancel("generation-1", "owner") is True
+    assert generation.reason == "cancelled" and aborted == [True]
+    assert registry.cancelled == 1
+
+    registry.finish(generation)
+    assert registry.cancel("generation-1", "owner") is False
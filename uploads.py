@@ -0,0 +1,251 @@
+"""Project archives uploaded for analysis and attached to chat prompts by reference.
+
+POST /uploads takes a zip archive, either as the raw request body or as the
+"archive" field of a multipart form, and copies it to disk in fixed-size
+chunks: the size limit is enforced while reading, so an oversized upload is
+cut off after max_bytes instead of being buffered first.
+
+Members are read lazily from a memory map of the archive, one at a time, and
+never more than max_file_bytes of one (a member whose header understates its
+size cannot inflate further). Only source files are considered; their
+language comes from the extension.
+
+An upload is kept for ttl seconds as <id>.zip with a <id>.json manifest next
+to it, so any worker can serve it, and only to the session that uploaded it.
+"""
+import json
+import logging
+import mmap
+import os
+import re
+import time
+import uuid
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+LANGUAGES = {
+    ".py": "python", ".pyi": "python",
+    ".js": "javascript", ".mjs": "javascript", ".cjs": "javascript", ".jsx": "jsx",
+    ".ts": "typescript", ".tsx": "tsx",
+    ".java": "java", ".kt": "kotlin", ".scala": "scala", ".groovy": "groovy",
+    ".c": "c", ".h": "c", ".cc": "cpp", ".cpp": "cpp", ".cxx": "cpp", ".hpp": "cpp",
+    ".cs": "csharp", ".go": "go", ".rs": "rust", ".swift": "swift", ".m": "objectivec",
+    ".rb": "ruby", ".php": "php", ".pl": "perl", ".lua": "lua", ".r": "r", ".dart": "dart",
+    ".sh": "bash", ".bash": "bash", ".ps1": "powershell", ".sql": "sql",
+    ".html": "html", ".htm": "html", ".css": "css", ".scss": "scss", ".vue": "markup", ".svelte": "markup",
+    ".json": "json", ".yaml": "yaml", ".yml": "yaml", ".toml": "toml", ".xml": "xml",
+    ".md": "markdown",
+}
+
+
+class UploadError(Exception):
+    """An upload or attachment that cannot be used; the message is shown to the user"""
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+def source_language(path):
+    """Language of a source file by extension, or None for anything else"""
+    return LANGUAGES.get(os.path.splitext(path)[1].lower())
+
+
+class UploadStore:
+    """Uploaded archives on local disk, shared by the workers"""
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024, max_file_bytes=1024 * 1024, max_files=2000,
+                 ttl=24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes              # Archive size
+        self.max_file_bytes = max_file_bytes    # Uncompressed size of one member
+        self.max_files = max_files              # Source files per archive
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, upload_id, ext):
+        return os.path.join(self.directory, upload_id + ext)
+
+    def save(self, stream, sid, name=None):
+        """Copy an archive from a file-like stream to disk and return its manifest.
+
+        Raises UploadTooLarge past max_bytes and UploadError when it is not a
+        zip archive or holds no source files.
+        """
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        path = self._path(upload_id, ".zip")
+        try:
+            size = 0
+            with open(path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f"Archives are limited to {self.max_bytes / (1024 * 1024):g} MB")
+                    f.write(chunk)
+            files = self._list(path)
+            manifest = {"id": upload_id, "sid": sid, "name": name, "size": size, "created_at": time.time(),
+                        "files": files}
+            with open(self._path(upload_id, ".json"), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+        except BaseException:
+            self._remove(upload_id)
+            raise
+        logger.info(f"Stored upload {upload_id}: {size} bytes, {len(files)} source files")
+        return manifest
+
+    def _list(self, path):
+        """Source members of an archive as [{"path", "language", "size"}]"""
+        if not zipfile.is_zipfile(path):
+            raise UploadError("Upload a .zip archive")
+        with self._open(path) as archive:
+            files = [{"path": info.filename, "language": source_language(info.filename), "size": info.file_size}
+                     for info in archive.infolist() if not info.is_dir() and source_language(info.filename)]
+        if not files:
+            raise UploadError("The archive holds no source files")
+        if len(files) > self.max_files:
+            raise UploadError(f"Archives are limited to {self.max_files} source files")
+        return files
+
+    def _open(self, path):
+        with open(path, 'rb') as f:
+            mapped = _Mapped(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return _MappedZip(mapped)
+
+    def manifest(self, upload_id, sid):
+        """Manifest of an upload of session sid, or None"""
+        if not UPLOAD_ID.match(upload_id or ""):
+            return None
+        try:
+            with open(self._path(upload_id, ".json"), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest["sid"] != sid or manifest["created_at"] < time.time() - self.ttl:
+            return None
+        return manifest
+
+    def _read(self, archive, info):
+        if info.file_size > self.max_file_bytes:
+            raise UploadError(f"File larger than {self.max_file_bytes} bytes")
+        with archive.open(info) as member:
+            data = member.read(self.max_file_bytes + 1)
+        if len(data) > self.max_file_bytes:
+            raise UploadError(f"File larger than {self.max_file_bytes} bytes")
+        if b'\0' in data:
+            raise UploadError("Binary file")
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            raise UploadError("Not UTF-8 text")
+
+    def iter_files(self, upload_id, paths=None):
+        """Yield (path, code, language, error) for the source files of an upload, reading one at a time.
+
+        paths limits the walk to those members, in that order; a path the
+        archive does not hold yields an error.
+        """
+        with self._open(self._path(upload_id, ".zip")) as archive:
+            if paths is None:
+                infos = [info for info in archive.infolist() if not info.is_dir() and source_language(info.filename)]
+            else:
+                infos = [archive.lookup(path) for path in paths]
+            for path, info in zip(paths or [info.filename for info in infos], infos):
+                language = source_language(path)
+                if info is None or language is None:
+                    yield path, None, language, "No such source file in the upload"
+                    continue
+                try:
+                    yield path, self._read(archive, info), language, None
+                except UploadError as e:
+                    yield path, None, language, str(e)
+                except (zipfile.BadZipFile, OSError, EOFError) as e:
+                    logger.warning(f"Unreadable member {path} of upload {upload_id}: {e}")
+                    yield path, None, language, "Unreadable file"
+
+    def attachment_text(self, sid, attachments, max_files=20, max_chars=200 * 1024):
+        """Attached files as markdown code blocks to append to a chat message.
+
+        attachments is [{"upload_id", "path"}, ...]; raises UploadError for
+        an unknown upload or file, or when the files exceed the limits.
+        """
+        if not isinstance(attachments, list) or not all(
+                isinstance(a, dict) and isinstance(a.get("upload_id"), str) and isinstance(a.get("path"), str)
+                for a in attachments):
+            raise UploadError("attachments must be a list of {\"upload_id\", \"path\"}")
+        if len(attachments) > max_files:
+            raise UploadError(f"At most {max_files} attached files per message")
+        by_upload = {}
+        for attachment in attachments:
+            by_upload.setdefault(attachment["upload_id"], []).append(attachment["path"])
+        blocks = []
+        total = 0
+        for upload_id, paths in by_upload.items():
+            if self.manifest(upload_id, sid) is None:
+                raise UploadError("Upload not found; it may have expired")
+            for path, code, language, error in self.iter_files(upload_id, paths):
+                if error is not None:
+                    raise UploadError(f"{path}: {error}")
+                total += len(code)
+                if total > max_chars:
+                    raise UploadError(f"Attached files are limited to {max_chars // 1024} KB per message")
+                blocks.append(f"File `{path}`:\n```{language}\n{code.rstrip()}\n```")
+        return "\n\nAttached files:\n\n" + "\n\n".join(blocks) if blocks else ""
+
+    def _remove(self, upload_id):
+        for ext in (".zip", ".json"):
+            try:
+                os.remove(self._path(upload_id, ext))
+            except FileNotFoundError:
+                pass
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            upload_id, ext = os.path.splitext(entry.name)
+            if ext == ".zip" and UPLOAD_ID.match(upload_id):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        self._remove(upload_id)
+                except FileNotFoundError:
+                    pass  # Removed by another worker
+
+
+class _Mapped(mmap.mmap):
+    """Read-only memory map usable as a zipfile's file object"""
+
+    def seekable(self):  # mmap only has it from Python 3.13
+        return True
+
+
+class _MappedZip(zipfile.ZipFile):
+    """ZipFile over a memory map, released with it"""
+
+    def __init__(self, mapped):
+        self._mapped = mapped
+        try:
+            super().__init__(mapped)
+        except BaseException:
+            mapped.close()
+            raise
+
+    def lookup(self, path):
+        try:
+            return self.getinfo(path)
+        except KeyError:
+            return None
+
+    def close(self):
+        super().close()
+        self._mapped.close()
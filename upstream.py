@@ -0,0 +1,471 @@
+"""Pooled OpenRouter client with retries and a circuit breaker.
+
+One UpstreamClient per process keeps a keep-alive connection pool to the
+provider, retries 429/5xx and connection failures with jittered exponential
+backoff inside a per-request retry budget, and stops calling the provider for a
+while once it keeps failing (5xx and connection failures; a 429 only means it
+is throttling us), so requests fail fast instead of piling up.
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+
+logger = logging.getLogger(__name__)
+
+# Upstream statuses worth another attempt (rate limited / overloaded / gateway trouble)
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class UpstreamStreamError(Exception):
+    """Error reported by OpenRouter in the middle of a streamed completion"""
+
+
+def parse_stream_line(line, usage=None):
+    """Parse one line of an OpenRouter SSE stream.
+
+    Returns the content delta (possibly empty), or None once the stream is done.
+    The finish reason and token counts of the final chunks are read into usage.
+    """
+    # Skip blank separators and ": OPENROUTER PROCESSING" keep-alive comments
+    if not line or not line.startswith('data:'):
+        return ''
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return None
+    chunk = json.loads(data)
+    if 'error' in chunk:
+        raise UpstreamStreamError(chunk['error'].get('message', 'Unknown API error'))
+    if usage is not None:
+        usage.read(chunk)
+    choices = chunk.get('choices') or []
+    if choices:
+        return (choices[0].get('delta') or {}).get('content') or ''
+    return ''
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures, half-open probe after a cool-down"""
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Raise CircuitOpenError unless a request may go to the upstream now; True if it goes as the probe"""
+        with self._lock:
+            if self.state == 'closed':
+                return False
+            remaining = self.opened_at + self.recovery_timeout - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probe_in_flight:
+                # Let exactly one probe through to test the upstream
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            raise CircuitOpenError(max(remaining, 1.0))
+
+    def release_probe(self):
+        """Give up the probe without a verdict (it was cancelled), so the next request probes instead"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info("Upstream circuit closed")
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"Upstream circuit opened after {self.consecutive_failures} consecutive failures")
+                    self.times_opened += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.state == 'open'
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class RetryPolicy:
+    """Jittered exponential backoff bounded by an attempt count and a time budget"""
+
+    def __init__(self, max_retries=3, base_delay=0.5, max_delay=8.0, budget=20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def next_delay(self, retry, started, retry_after=None):
+        """Seconds to wait before retry number `retry`, or None if the budget is spent"""
+        if retry > self.max_retries:
+            return None
+        # "Full jitter": uniform over the exponential window
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() - started + delay > self.budget:
+            return None
+        return delay
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds form only)"""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamStats:
+    """Thread-safe request/retry/connection counters shared by both clients"""
+
+    def __init__(self):
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self._lock = threading.Lock()
+
+    def add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "connections_opened": self.connections_opened,
+                "connections_reused": self.connections_reused,
+            }
+
+
+def record_failure(breaker, error, probe=False):
+    """Count a failed attempt against the breaker, except a 429: a rate-limited upstream is up, just throttling us.
+
+    Retry-After is honoured by the retry policy instead; a probe answered
+    with 429 is released without a verdict, so the next request probes.
+    """
+    if error != 429:
+        breaker.record_failure()
+    elif probe:
+        breaker.release_probe()
+
+
+def error_code(error):
+    """Short label for a failed attempt: the HTTP status or the kind of exception"""
+    if isinstance(error, int):
+        return str(error)
+    if isinstance(error, (requests.exceptions.Timeout, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(error, (requests.exceptions.ConnectionError, ConnectionError)):
+        return "connection_error"
+    return error.__class__.__name__
+
+
+_sending = threading.local()
+
+
+class _ReportingConnectionMixin:
+    """Hands the connection a request is waiting on to the sending thread's callback, so another thread can abort it"""
+
+    def getresponse(self, *args, **kwargs):
+        report = getattr(_sending, 'report', None)
+        if report is None:
+            return super().getresponse(*args, **kwargs)
+        report(self)
+        try:
+            return super().getresponse(*args, **kwargs)
+        finally:
+            report(None)
+
+
+class _ReportingHTTPConnection(_ReportingConnectionMixin, HTTPConnection):
+    pass
+
+
+class _ReportingHTTPSConnection(_ReportingConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _ReportingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _ReportingHTTPConnection
+
+
+class _ReportingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _ReportingHTTPSConnection
+
+
+class _ReportingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _ReportingHTTPConnectionPool,
+                                                   "https": _ReportingHTTPSConnectionPool}
+
+
+class UpstreamClient:
+    """requests-based client used by the sync Flask views"""
+
+    def __init__(self, url, pool_size=20, retry_policy=None, breaker=None, timeout=180, on_error=None):
+        self.url = url
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = UpstreamStats()
+        self.on_error = on_error  # Called with error_code() of every failed attempt
+        self.adapter = _ReportingAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def post(self, headers, payload, stream=False, inflight=None, breaker=None, fallback=False):
+        """POST a chat completion request; returns the final requests.Response.
+
+        Retryable failures are retried while the budget allows. The last
+        retryable response is returned (or the last exception raised) once it
+        is spent, so callers keep their existing status/exception handling.
+        With fallback (the caller has another model to try), a retryable
+        status is returned at once instead. breaker replaces the client's own,
+        so each model can have its circuit. While it waits for response
+        headers, the connection is handed to inflight.sending() (then None),
+        so another thread can abort the wait; an aborted request is neither
+        retried nor counted as a failure.
+        """
+        breaker = breaker or self.breaker
+        self.stats.add(requests=1)
+        started = time.monotonic()
+        retry = 0
+        while True:
+            probe = breaker.before_request()
+            self.stats.add(attempts=1)
+            _sending.report = inflight.sending if inflight is not None else None
+            try:
+                response = self.session.post(self.url, headers=headers, json=payload,
+                                             timeout=self.timeout, stream=stream)
+            except requests.exceptions.RequestException as e:
+                if inflight is not None and inflight.cancelled:
+                    if probe:
+                        breaker.release_probe()
+                    raise
+                self._failed(breaker, e)
+                retry += 1
+                retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                delay = self.retry_policy.next_delay(retry, started) if retryable and not breaker.is_open else None
+                if delay is None:
+                    raise
+                logger.warning(f"Upstream request failed ({e.__class__.__name__}), retry {retry} in {delay:.2f}s")
+                self.stats.add(retries=1)
+                if self._wait(delay, inflight):
+                    raise
+                continue
+            except BaseException:
+                if probe:
+                    breaker.release_probe()
+                raise
+            finally:
+                _sending.report = None
+
+            if response.status_code not in RETRYABLE_STATUSES:
+                breaker.record_success()
+                if response.status_code >= 400 and self.on_error is not None:
+                    self.on_error(error_code(response.status_code))
+                return response
+
+            self._failed(breaker, response.status_code, probe)
+            if fallback:
+                return response
+            retry += 1
+            delay = None if breaker.is_open else self.retry_policy.next_delay(
+                retry, started, parse_retry_after(response.headers.get("Retry-After")))
+            if delay is None or (inflight is not None and inflight.cancelled):
+                return response
+            logger.warning(f"Upstream returned {response.status_code}, retry {retry} in {delay:.2f}s")
+            response.close()
+            self.stats.add(retries=1)
+            if self._wait(delay, inflight):
+                return response
+
+    def preconnect(self, timeout=10):
+        """Open a pooled connection before the first request needs it, paying the TCP and TLS handshakes early.
+
+        Sends a HEAD request, whose status does not matter, outside the
+        retry and circuit breaker accounting. Returns whether it connected.
+        """
+        try:
+            self.session.head(self.url, timeout=timeout)
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Upstream preconnect failed: {e}")
+            return False
+
+    @staticmethod
+    def _wait(delay, inflight):
+        """Back off before a retry; True if inflight was aborted meanwhile, which ends the wait early"""
+        if inflight is None:
+            time.sleep(delay)
+            return False
+        return inflight.wait(delay)
+
+    def _failed(self, breaker, error, probe=False):
+        record_failure(breaker, error, probe)
+        if self.on_error is not None:
+            self.on_error(error_code(error))
+
+    def snapshot(self):
+        stats = self.stats.snapshot()
+        # urllib3 counts new sockets per host pool; everything else was a reuse
+        opened = handled = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                handled += pool.num_requests
+        stats["connections_opened"] = opened
+        stats["connections_reused"] = max(handled - opened, 0)
+        stats["circuit"] = self.breaker.snapshot()
+        return stats
+
+
+class AsyncUpstreamClient:
+    """aiohttp counterpart of UpstreamClient used by the async serving mode"""
+
+    def __init__(self, url, retry_policy=None, breaker=None, on_error=None):
+        self.url = url
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = UpstreamStats()
+        self.on_error = on_error
+        self.session = None
+
+    def trace_config(self):
+        """aiohttp TraceConfig feeding the connection open/reuse counters"""
+        import aiohttp
+
+        trace = aiohttp.TraceConfig()
+
+        async def on_create(session, context, params):
+            self.stats.add(connections_opened=1)
+
+        async def on_reuse(session, context, params):
+            self.stats.add(connections_reused=1)
+
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        return trace
+
+    async def preconnect(self, timeout=10):
+        """Async counterpart of UpstreamClient.preconnect"""
+        import aiohttp
+
+        try:
+            async with self.session.head(self.url, timeout=aiohttp.ClientTimeout(total=timeout)):
+                return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Upstream preconnect failed: {e!r}")
+            return False
+
+    async def post(self, headers, payload, breaker=None, fallback=False):
+        """POST a chat completion request; returns an un-read aiohttp response.
+
+        breaker and fallback work as in UpstreamClient.post. The caller owns
+        the returned response and must release it.
+        """
+        import aiohttp
+
+        breaker = breaker or self.breaker
+        self.stats.add(requests=1)
+        started = time.monotonic()
+        retry = 0
+        while True:
+            probe = breaker.before_request()
+            self.stats.add(attempts=1)
+            try:
+                response = await self.session.post(self.url, headers=headers, json=payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._failed(breaker, e)
+                retry += 1
+                retryable = isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+                delay = self.retry_policy.next_delay(retry, started) if retryable and not breaker.is_open else None
+                if delay is None:
+                    raise
+                logger.warning(f"Upstream request failed ({e.__class__.__name__}), retry {retry} in {delay:.2f}s")
+                self.stats.add(retries=1)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:  # asyncio.CancelledError: the generation was cancelled
+                if probe:
+                    breaker.release_probe()
+                raise
+
+            if response.status not in RETRYABLE_STATUSES:
+                breaker.record_success()
+                if response.status >= 400 and self.on_error is not None:
+                    self.on_error(error_code(response.status))
+                return response
+
+            self._failed(breaker, response.status, probe)
+            if fallback:
+                return response
+            retry += 1
+            delay = None if breaker.is_open else self.retry_policy.next_delay(
+                retry, started, parse_retry_after(response.headers.get("Retry-After")))
+            if delay is None:
+                return response
+            logger.warning(f"Upstream returned {response.status}, retry {retry} in {delay:.2f}s")
+            response.release()
+            self.stats.add(retries=1)
+            await asyncio.sleep(delay)
+
+    def _failed(self, breaker, error, probe=False):
+        record_failure(breaker, error, probe)
+        if self.on_error is not None:
+            self.on_error(error_code(error))
+
+    def snapshot(self):
+        stats = self.stats.snapshot()
+        stats["circuit"] = self.breaker.snapshot()
+        return stats
@@ -0,0 +1,292 @@
+"""Token usage accounting and adaptive max_tokens.
+
+Every reply records the prompt, completion and total tokens OpenRouter
+reports for it (estimated when a response carries no usage block) and why it
+stopped. A reply cut off at max_tokens (finish_reason "length") is continued:
+the model is sent the reply so far as an assistant message to extend, and the
+counts of all the calls that produced the reply are added up.
+
+The usage of each reply is kept in an SQLite ledger shared by the workers,
+from which totals per session and per request type are read. The completion
+lengths seen for each request type, and for each request type and first
+intent, decide the max_tokens reserved for the next request of that kind: a
+high percentile plus headroom, between a floor and a ceiling. Each worker
+starts from the latest lengths in the ledger and then learns from its own
+replies.
+
+    python usage.py usage.db
+    python usage.py usage.db --session <session id>
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# max_tokens per request type until enough replies have been seen (override with MAX_TOKENS_DEFAULTS='{"debug_code": 6000}')
+DEFAULT_MAX_TOKENS = {
+    'debug_code': 4000,
+    'optimize_code': 4000,
+    'explain_code': 3000,
+    'enhance_code': 6000,
+    'create_code': 8000,
+    'analyze_code': 3000,
+    'general_chat': 1500,
+}
+MAX_TOKENS_DEFAULTS = dict(DEFAULT_MAX_TOKENS, **json.loads(os.getenv("MAX_TOKENS_DEFAULTS", "{}")))
+
+# Finish reasons of replies whose length says how long replies of their kind run
+SAMPLED_FINISH_REASONS = {'stop', 'length'}
+
+
+class Usage:
+    """Tokens and finish reason of one reply, added up over the upstream calls that generated it"""
+
+    def __init__(self, prompt_estimate, max_tokens):
+        self.prompt_estimate = prompt_estimate  # Prompt size assumed for calls that report no usage
+        self.max_tokens = max_tokens
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.finish_reason = None
+        self.calls = 0
+        self.estimated = False
+        self._counts = None
+        self._finish_reason = None
+        self._accounted = 0  # Characters of the reply generated by the calls added up so far
+
+    def read(self, data):
+        """Take the finish reason and token counts of a completion body or stream chunk"""
+        choices = data.get('choices') or []
+        if choices and choices[0].get('finish_reason'):
+            self._finish_reason = choices[0]['finish_reason']
+        if data.get('usage'):
+            self._counts = data['usage']
+
+    def end_call(self, reply, finish_reason=None):
+        """Add up the call that generated the end of reply (the whole reply so far)"""
+        counts = self._counts or {}
+        prompt, completion = counts.get('prompt_tokens'), counts.get('completion_tokens')
+        if not isinstance(prompt, int) or not isinstance(completion, int):
+            # Continuations are also sent the reply so far, as the assistant message they extend
+            prompt = self.prompt_estimate + estimate_tokens(reply[:self._accounted])
+            completion = estimate_tokens(reply[self._accounted:])
+            self.estimated = True
+        self.calls += 1
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        self.total_tokens += prompt + completion
+        self.finish_reason = finish_reason or self._finish_reason
+        self._counts = self._finish_reason = None
+        self._accounted = len(reply)
+
+    def wants_continuation(self, limit):
+        """Whether the last call stopped at max_tokens and fewer than limit continuations were made"""
+        return self.finish_reason == 'length' and self.calls <= limit
+
+    def as_dict(self):
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "finish_reason": self.finish_reason,
+            "max_tokens": self.max_tokens,
+            "continuations": max(self.calls - 1, 0),
+            "estimated": self.estimated,
+        }
+
+
+def continuation_payload(payload, reply):
+    """Payload asking the model to go on with a reply it cut off at max_tokens"""
+    return dict(payload, messages=payload['messages'] + [{"role": "assistant", "content": reply}])
+
+
+class LengthWindow:
+    """Recent completion lengths of one kind of request"""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, tokens):
+        with self._lock:
+            self.samples.append(tokens)
+
+    def percentile(self, q):
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class TokenBudget:
+    """max_tokens per request type and first intent, from the completion lengths seen for them"""
+
+    def __init__(self, defaults=None, ceiling=12000, floor=512, quantile=0.95, headroom=1.25,
+                 min_samples=20, window=500):
+        self.defaults = MAX_TOKENS_DEFAULTS if defaults is None else defaults
+        self.ceiling = ceiling
+        self.floor = floor
+        self.quantile = quantile
+        self.headroom = headroom    # Multiplier on the percentile, so most replies finish in one call
+        self.min_samples = min_samples
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def keys(request_type, intents):
+        """Most specific first: request type and first intent, then the request type alone"""
+        return ([f"{request_type}/{intents[0]}"] if intents else []) + [request_type]
+
+    def max_tokens(self, request_type, intents):
+        for key in self.keys(request_type, intents):
+            window = self._windows.get(key)
+            if window is not None and len(window) >= self.min_samples:
+                return self._clamp(window.percentile(self.quantile) * self.headroom)
+        return self._clamp(self.defaults.get(request_type, self.ceiling))
+
+    def _clamp(self, tokens):
+        return int(min(self.ceiling, max(self.floor, tokens)))
+
+    def observe(self, request_type, intents, completion_tokens):
+        for key in self.keys(request_type, intents):
+            window = self._windows.get(key)
+            if window is None:
+                with self._lock:
+                    window = self._windows.setdefault(key, LengthWindow(self.window))
+            window.observe(completion_tokens)
+
+    def snapshot(self):
+        with self._lock:
+            windows = dict(self._windows)
+        return {
+            key: {
+                "samples": len(window),
+                "p50": window.percentile(0.5),
+                "p95": window.percentile(0.95),
+                # None while the request type's default applies
+                "max_tokens": self._clamp(window.percentile(self.quantile) * self.headroom)
+                if len(window) >= self.min_samples else None,
+            }
+            for key, window in sorted(windows.items())
+        }
+
+
+class UsageLedger:
+    """Usage of every reply, in an SQLite file all workers write to"""
+
+    def __init__(self, path, retention=30 * 24 * 3600):
+        self.path = path
+        self.retention = retention  # Seconds a reply's usage is kept
+        self._local = threading.local()
+        self._last_prune = 0
+        db = self._connect()
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                conversation_id TEXT,
+                request_type TEXT NOT NULL,
+                intent TEXT,
+                model TEXT,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                total_tokens INTEGER NOT NULL,
+                finish_reason TEXT,
+                max_tokens INTEGER,
+                continuations INTEGER NOT NULL DEFAULT 0,
+                estimated INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS usage_session ON usage (session_id)")
+        db.execute("CREATE INDEX IF NOT EXISTS usage_created ON usage (created_at)")
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def record(self, session_id, conversation_id, request_type, intents, model, usage):
+        """Add a reply's usage; a failed write is logged, never raised"""
+        now = time.time()
+        try:
+            db = self._connect()
+            db.execute("""
+                INSERT INTO usage (session_id, conversation_id, request_type, intent, model, prompt_tokens,
+                                   completion_tokens, total_tokens, finish_reason, max_tokens, continuations,
+                                   estimated, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (session_id, conversation_id, request_type, intents[0] if intents else None, model,
+                  usage.prompt_tokens, usage.completion_tokens, usage.total_tokens, usage.finish_reason,
+                  usage.max_tokens, max(usage.calls - 1, 0), int(usage.estimated), now))
+            if now - self._last_prune > 3600:
+                self._last_prune = now
+                db.execute("DELETE FROM usage WHERE created_at < ?", (now - self.retention,))
+        except sqlite3.Error as e:
+            logger.error(f"Usage ledger write failed: {e}")
+
+    def summary(self, session_id=None):
+        """Totals, overall and per request type, of one session's replies or of all of them"""
+        where, args = ("WHERE session_id = ?", (session_id,)) if session_id is not None else ("", ())
+        rows = self._connect().execute(f"""
+            SELECT request_type, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens),
+                   SUM(finish_reason = 'length'), SUM(continuations > 0), SUM(estimated)
+            FROM usage {where} GROUP BY request_type ORDER BY request_type
+        """, args).fetchall()
+        fields = ("replies", "prompt_tokens", "completion_tokens", "total_tokens", "truncated", "continued",
+                  "estimated")
+        by_request_type = {row[0]: dict(zip(fields, row[1:])) for row in rows}
+        totals = {field: sum(group[field] for group in by_request_type.values()) for field in fields}
+        return dict(totals, by_request_type=by_request_type)
+
+    def recent_lengths(self, limit):
+        """(request_type, intent, completion_tokens) of the latest replies that ran to a stop or to max_tokens"""
+        placeholders = ",".join("?" * len(SAMPLED_FINISH_REASONS))
+        rows = self._connect().execute(f"""
+            SELECT request_type, intent, completion_tokens FROM usage
+            WHERE finish_reason IN ({placeholders}) ORDER BY id DESC LIMIT ?
+        """, (*SAMPLED_FINISH_REASONS, limit)).fetchall()
+        return rows[::-1]
+
+
+def create_token_budget(ledger=None, **settings):
+    """TokenBudget seeded with the latest completion lengths recorded in ledger"""
+    budget = TokenBudget(**settings)
+    if ledger is not None:
+        try:
+            for request_type, intent, completion_tokens in ledger.recent_lengths(budget.window * len(budget.defaults)):
+                budget.observe(request_type, [intent] if intent else [], completion_tokens)
+        except sqlite3.Error as e:
+            logger.error(f"Could not seed max_tokens from the usage ledger: {e}")
+    return budget
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Token usage totals from the usage ledger")
+    parser.add_argument("path", nargs="?", default="usage.db", help="Usage ledger (USAGE_DB_PATH)")
+    parser.add_argument("--session", help="Only this session's replies")
+    args = parser.parse_args(argv)
+    json.dump(UsageLedger(args.path).summary(args.session), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()